@@ -0,0 +1,75 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+HITS_KEY = 'stats:hits'
+MISSES_KEY = 'stats:misses'
+
+
+def get_cache():
+    return caches[settings.API_CACHE_ALIAS]
+
+
+def generation_key(scope):
+    return f'gen:{scope}'
+
+
+def bumped_key(scope):
+    return f'bumped:{scope}'
+
+
+def get_generations(scopes):
+    """ Returns current generation of every scope. Missing generation gets fresh unique value,
+        so responses cached before it was evicted are never reused """
+    cache = get_cache()
+    keys = [generation_key(scope) for scope in scopes]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            cache.add(key, time.time_ns(), timeout=None)
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+
+def bump(scopes):
+    """ Invalidates responses cached for scopes after current transaction commits. With replicas scopes are
+        marked as bumped for API_REPLICA_STICKY_SECONDS, see recently_bumped() """
+    def _bump():
+        cache = get_cache()
+        for scope in scopes:
+            try:
+                cache.incr(generation_key(scope))
+            except ValueError:
+                cache.set(generation_key(scope), time.time_ns(), timeout=None)
+        if settings.API_READ_REPLICAS and settings.API_REPLICA_STICKY_SECONDS > 0:
+            cache.set_many({bumped_key(scope): True for scope in scopes}, timeout=settings.API_REPLICA_STICKY_SECONDS)
+    if scopes:
+        transaction.on_commit(_bump)
+
+
+def recently_bumped(scopes):
+    """ Whether any of scopes was bumped within API_REPLICA_STICKY_SECONDS. Replicas may not have the write yet,
+        a response read from them would be cached stale under the new generation """
+    return bool(get_cache().get_many([bumped_key(scope) for scope in scopes]))
+
+
+def response_key(path, scopes):
+    generations = ','.join(f'{scope}={generation}' for scope, generation in zip(scopes, get_generations(scopes)))
+    return 'response:' + hashlib.md5(f'{path}|{generations}'.encode()).hexdigest()
+
+
+def count(hit):
+    cache = get_cache()
+    key = HITS_KEY if hit else MISSES_KEY
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, timeout=None)
+
+
+def get_stats():
+    stats = get_cache().get_many([HITS_KEY, MISSES_KEY])
+    return {'hits': stats.get(HITS_KEY, 0), 'misses': stats.get(MISSES_KEY, 0)}
@@ -0,0 +1,60 @@
+import base64
+from collections import namedtuple
+
+from django.utils.dateparse import parse_datetime
+
+from .models import Artist, Album, Track, Tombstone
+
+# sources of the change feed in keyset order: live rows by their updated_at, then deleted ones
+SOURCES = [
+    (Artist.objects.all(), 'updated_at'),
+    (Album.objects.select_related('artist'), 'updated_at'),
+    (Track.objects.select_related('artist'), 'updated_at'),
+    (Tombstone.objects.all(), 'deleted_at'),
+]
+
+# change of an object, row is model instance or Tombstone
+Change = namedtuple('Change', 'time source pk row')
+
+
+class Cursor(namedtuple('Cursor', 'time source pk')):
+    """ Position in the feed: key of the last seen change. Opaque for clients """
+
+    @classmethod
+    def after(cls, time):
+        """ Cursor past every change up to time: source beyond the last one skips the whole instant """
+        return cls(time, len(SOURCES), 0)
+
+    def encode(self):
+        return base64.urlsafe_b64encode(f'{self.time.isoformat()}|{self.source}|{self.pk}'.encode()).decode()
+
+    @classmethod
+    def decode(cls, token):
+        """ Raises ValueError for malformed token """
+        try:
+            time, source, pk = base64.urlsafe_b64decode(token.encode()).decode().split('|')
+            time = parse_datetime(time)
+        except (UnicodeError, ValueError, TypeError):
+            raise ValueError('Invalid cursor')
+        if time is None or not source.isdigit() or not 0 <= int(source) <= len(SOURCES) or not pk.isdigit():
+            raise ValueError('Invalid cursor')
+        return cls(time, int(source), int(pk))
+
+
+def get_changes(cursor, limit, until):
+    """ Changes after cursor and not later than until, ordered by (time, source, pk). Every source is read
+        by index range from the cursor time, so a page costs one query per source whatever feed size is.
+        Returns (changes, has_more) """
+    changes = []
+    for index, (queryset, field) in enumerate(SOURCES):
+        queryset = queryset.filter(**{f'{field}__lte': until})
+        if cursor is not None:
+            queryset = queryset.filter(**{f'{field}__gte': cursor.time})
+            if index < cursor.source:
+                queryset = queryset.exclude(**{field: cursor.time})
+            elif index == cursor.source:
+                queryset = queryset.exclude(**{field: cursor.time, 'pk__lte': cursor.pk})
+        changes += [Change(getattr(row, field), index, row.pk, row)
+                    for row in queryset.order_by(field, 'pk')[:limit + 1]]
+    changes.sort(key=lambda change: change[:3])
+    return changes[:limit], len(changes) > limit
@@ -0,0 +1,48 @@
+from collections import Counter
+
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Artist, Album, Track, AlbumTrack
+
+
+def change_counter(model, field, deltas):
+    """ Adds deltas {pk: delta} to counter field and touches updated_at. One statement per distinct delta """
+    by_delta = {}
+    for pk, delta in deltas.items():
+        if delta:
+            by_delta.setdefault(delta, []).append(pk)
+    for delta, pks in by_delta.items():
+        model.objects.filter(pk__in=pks).update(**{field: F(field) + delta, 'updated_at': timezone.now()})
+
+
+def count_by(instances, field, sign=1):
+    return Counter({key: value * sign for key, value in Counter(getattr(item, field) for item in instances).items()})
+
+
+def _count(model, fk):
+    queryset = model.objects.filter(**{fk: OuterRef('pk')}).order_by().values(fk).annotate(count=Count('pk'))
+    return Coalesce(Subquery(queryset.values('count')), 0)
+
+
+def _repair(queryset, counters):
+    """ Rewrites counters which differ from real values. Returns number of repaired rows """
+    real = {f'real_{field}': expression for field, expression in counters.items()}
+    broken = Q()
+    for field in counters:
+        broken |= ~Q(**{field: F(f'real_{field}')})
+    pks = list(queryset.annotate(**real).filter(broken).values_list('pk', flat=True))
+    if pks:
+        queryset.model.objects.filter(pk__in=pks).update(**counters)
+    return len(pks)
+
+
+def recount_artists(pks=None):
+    queryset = Artist.objects.all() if pks is None else Artist.objects.filter(pk__in=pks)
+    return _repair(queryset, {'albums_count': _count(Album, 'artist'), 'tracks_count': _count(Track, 'artist')})
+
+
+def recount_albums(pks=None):
+    queryset = Album.objects.all() if pks is None else Album.objects.filter(pk__in=pks)
+    return _repair(queryset, {'tracks_count': _count(AlbumTrack, 'album')})
@@ -0,0 +1,143 @@
+import django
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+from .models import Artist, Album, Track, AlbumTrack, AlbumTracklist
+from .ordering import get_album_ordering
+from .signals import bulk_deleted
+
+# rows per DELETE and per read of related rows
+BATCH_SIZE = 1000
+# QuerySet._raw_delete(using) is private API: one DELETE of matching rows, with no collection of related rows and
+# no signals. It is the same from Django 1.9 to 4.2, other releases are refused until RawDeleteTest passes on them
+RAW_DELETE_VERSIONS = ((1, 9), (4, 2))
+
+
+def batches(items, size=BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def raw_delete(model, pks):
+    """ Deletes rows by pk without loading them and without per-row signals. queryset.delete() can't do it,
+        receivers of post_delete make it load the rows and send signals one by one """
+    if not RAW_DELETE_VERSIONS[0] <= django.VERSION[:2] <= RAW_DELETE_VERSIONS[1]:
+        raise ImproperlyConfigured(f'QuerySet._raw_delete is not checked on Django {django.get_version()}, '
+                                   f'see RAW_DELETE_VERSIONS in api/deletion.py')
+    for batch in batches(pks):
+        model.objects.filter(pk__in=batch)._raw_delete(model.objects.db)
+
+
+def album_ids_of(album_tracks):
+    return {album_track.album_id for album_track in album_tracks}
+
+
+def delete_album_tracks(queryset):
+    """ Deletes album tracks matching queryset by set-based statements. Albums they are on are locked first and
+        compacted once after, whatever number of tracks each loses. Counters, cache, touches go through
+        bulk_deleted. Returns number of deleted rows """
+    ordering = get_album_ordering()
+    with transaction.atomic():
+        album_ids = set(queryset.order_by().values_list('album_id', flat=True).distinct())
+        ordering.lock_many(album_ids)
+        # read again under lock, rows of other albums may match by now
+        instances = list(queryset.filter(album__in=album_ids).only('album_id', 'track_id'))
+        remove_album_tracks(ordering, instances)
+    return len(instances)
+
+
+def delete_tracks(queryset):
+    """ Deletes tracks matching queryset with their album tracks by set-based statements, see
+        delete_album_tracks. Returns number of deleted tracks """
+    with transaction.atomic():
+        return remove_tracks(list(queryset.values_list('pk', flat=True)))
+
+
+def delete_albums(queryset):
+    """ Deletes albums matching queryset with their album tracks and tracklists by set-based statements, whatever
+        number of tracks they have. Returns number of deleted albums """
+    ordering = get_album_ordering()
+    with transaction.atomic():
+        album_ids = list(queryset.values_list('pk', flat=True))
+        ordering.lock_many(album_ids)
+        # read again under lock, some may be deleted by now
+        albums = [album for batch in batches(album_ids)
+                  for album in Album.objects.filter(pk__in=batch).only('artist_id')]
+        remove_albums(albums)
+    return len(albums)
+
+
+def delete_artists(queryset):
+    """ Deletes artists matching queryset with their albums and tracks by set-based statements, whatever size
+        of their catalog is. Albums are locked before artists, as writers of tracklists lock albums before
+        they insert rows referencing artists. Returns number of deleted artists """
+    ordering = get_album_ordering()
+    with transaction.atomic():
+        pks = list(queryset.values_list('pk', flat=True))
+        album_ids = set()
+        for batch in batches(pks):
+            album_ids |= set(Album.objects.filter(artist__in=batch).values_list('pk', flat=True))
+        ordering.lock_many(album_ids)
+        artists = [artist for batch in batches(pks)
+                   for artist in Artist.objects.filter(pk__in=batch).select_for_update().only('pk')]
+        pks = [artist.pk for artist in artists]
+        albums = [album for batch in batches(pks)
+                  for album in Album.objects.filter(artist__in=batch).only('artist_id')]
+        # created before artists were locked
+        ordering.lock_many({album.pk for album in albums} - album_ids)
+        remove_albums(albums, origin=Artist)
+        track_ids = [pk for batch in batches(pks)
+                     for pk in Track.objects.filter(artist__in=batch).values_list('pk', flat=True)]
+        remove_tracks(track_ids, origin=Artist)
+        if artists:
+            raw_delete(Artist, pks)
+            bulk_deleted.send(sender=Artist, instances=artists)
+    return len(artists)
+
+
+def remove_tracks(pks, origin=None):
+    """ Deletes tracks by pks with their album tracks. Albums they are on are locked first and compacted once
+        after, tracks are locked after their albums, as single deletes lock them. Must run in transaction.
+        Returns number of deleted tracks """
+    ordering = get_album_ordering()
+    album_ids = set()
+    for batch in batches(pks):
+        album_tracks = AlbumTrack.objects.filter(track__in=batch).order_by()
+        album_ids |= set(album_tracks.values_list('album_id', flat=True).distinct())
+    ordering.lock_many(album_ids)
+    tracks = [track for batch in batches(pks)
+              for track in Track.objects.filter(pk__in=batch).select_for_update().only('artist_id')]
+    pks = [track.pk for track in tracks]
+    album_tracks = [album_track for batch in batches(pks)
+                    for album_track in AlbumTrack.objects.filter(track__in=batch).only('album_id', 'track_id')]
+    # added to other albums before tracks were locked
+    ordering.lock_many(album_ids_of(album_tracks) - album_ids)
+    remove_album_tracks(ordering, album_tracks)
+    if tracks:
+        raw_delete(Track, pks)
+        bulk_deleted.send(sender=Track, instances=tracks, origin=origin)
+    return len(tracks)
+
+
+def remove_albums(albums, origin=None):
+    """ Deletes albums with their album tracks and tracklists. Albums must be locked. Nothing is compacted or
+        counted on albums which go """
+    if not albums:
+        return
+    pks = [album.pk for album in albums]
+    album_tracks = [album_track for batch in batches(pks)
+                    for album_track in AlbumTrack.objects.filter(album__in=batch).only('album_id', 'track_id')]
+    if album_tracks:
+        raw_delete(AlbumTrack, [album_track.pk for album_track in album_tracks])
+        bulk_deleted.send(sender=AlbumTrack, instances=album_tracks, origin=Album)
+    raw_delete(AlbumTracklist, pks)
+    raw_delete(Album, pks)
+    bulk_deleted.send(sender=Album, instances=albums, origin=origin)
+
+
+def remove_album_tracks(ordering, instances):
+    if not instances:
+        return
+    raw_delete(AlbumTrack, [instance.pk for instance in instances])
+    ordering.compact(album_ids_of(instances))
+    bulk_deleted.send(sender=AlbumTrack, instances=instances)
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction, connection
+from django.test.utils import CaptureQueriesContext
+
+from ...models import Artist, Album, Track, AlbumTrack
+
+
+class Command(BaseCommand):
+    help = 'Measures statements and wall time of album track insert/delete for albums of different size. ' \
+           'All data is rolled back after run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10, 100, 1000])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"tracks":>8} {"operation":>10} {"statements":>11} {"ms/op":>9}')
+        with transaction.atomic():
+            artist = Artist.objects.create(name='bench_album_order')
+            for size in options['sizes']:
+                album = Album.objects.create(name=f'bench {size}', artist=artist, year=2000)
+                tracks = Track.objects.bulk_create(Track(name=f'track {i}', artist=artist) for i in range(size))
+                AlbumTrack.objects.bulk_create(AlbumTrack(album=album, track=track, order=order)
+                                               for order, track in enumerate(tracks, start=1))
+                self.measure(size, 'insert', options['repeat'],
+                             lambda: AlbumTrack.objects.create(album=album, track=tracks[0], order=1))
+                self.measure(size, 'delete', options['repeat'],
+                             lambda: AlbumTrack.objects.get(album=album, order=1).delete())
+            transaction.set_rollback(True)
+
+    def measure(self, size, operation, repeat, func):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                func()
+            elapsed = time.perf_counter() - start
+        self.stdout.write(f'{size:>8} {operation:>10} {len(queries) / repeat:>11.1f} {elapsed / repeat * 1000:>9.2f}')
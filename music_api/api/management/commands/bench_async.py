@@ -0,0 +1,141 @@
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import Artist, Album, Track, AlbumTrack
+from ...ordering import get_album_ordering
+from ...signals import bulk_created
+
+SERVERS = {
+    'wsgi': ['music_api.wsgi:application', '-k', 'gthread'],
+    'asgi': ['music_api.asgi:application', '-k', 'uvicorn.workers.UvicornWorker'],
+}
+
+
+class Command(BaseCommand):
+    help = 'Starts gunicorn with sync WSGI workers and with uvicorn ASGI workers on local ports and measures ' \
+           'requests/sec and latency of read endpoints at given numbers of concurrent keep-alive connections. ' \
+           'WSGI server is requested at /<path>, ASGI server at /async/<path>. Response cache is disabled in both. ' \
+           'Servers use the configured database, --seed rows are committed there and deleted after run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paths', nargs='+', default=['artists/', 'albums/', 'tracks/'])
+        parser.add_argument('--concurrency', nargs='+', type=int, default=[100, 500, 1000])
+        parser.add_argument('--duration', type=float, default=10, help='Seconds per path and concurrency')
+        parser.add_argument('--workers', type=int, default=2, help='Gunicorn processes of each server')
+        parser.add_argument('--threads', type=int, default=8, help='WSGI threads per worker and API_ASYNC_THREADS')
+        parser.add_argument('--port', type=int, default=8701, help='WSGI server port, ASGI server takes the next one')
+        parser.add_argument('--seed', type=int, default=0, help='Albums of 10 tracks to create before run')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds to wait for response, counted as error')
+
+    def handle(self, *args, **options):
+        seeded = self.seed(options['seed']) if options['seed'] else None
+        servers = {}
+        try:
+            for offset, (name, app) in enumerate(SERVERS.items()):
+                servers[name] = self.start(app, options['port'] + offset, options)
+            for port in range(options['port'], options['port'] + len(SERVERS)):
+                self.wait(port)
+            self.stdout.write(f'{"path":>12} {"conc":>5} {"server":>6} {"req/s":>9} {"p50 ms":>8} {"p95 ms":>8} '
+                              f'{"errors":>7}')
+            for path in options['paths']:
+                for concurrency in options['concurrency']:
+                    for offset, name in enumerate(SERVERS):
+                        url = f'/{path}' if name == 'wsgi' else f'/async/{path}'
+                        result = asyncio.run(self.load(options['port'] + offset, url, concurrency,
+                                                       options['duration'], options['timeout']))
+                        self.stdout.write(f'{path:>12} {concurrency:>5} {name:>6} {result["rps"]:>9.0f} '
+                                          f'{result["p50"]:>8.1f} {result["p95"]:>8.1f} {result["errors"]:>7}')
+        finally:
+            for process in servers.values():
+                process.terminate()
+                process.wait()
+            if seeded:
+                Artist.objects.filter(pk__in=seeded).delete()
+
+    def seed(self, albums_count):
+        """ Returns pks of created artists, their albums and tracks are deleted with them """
+        artists = Artist.objects.bulk_create(Artist(name=f'bench_async {i}') for i in range(albums_count // 10 + 1))
+        albums = Album.objects.bulk_create(Album(name=f'bench_async {i}', artist=artists[i % len(artists)], year=2000)
+                                           for i in range(albums_count))
+        tracks = Track.objects.bulk_create(Track(name=f'bench_async {i}', artist=album.artist)
+                                           for album in albums for i in range(10))
+        step = get_album_ordering().step
+        album_tracks = AlbumTrack.objects.bulk_create(AlbumTrack(album=albums[i // 10], track=track,
+                                                                 order=(i % 10 + 1) * step)
+                                                      for i, track in enumerate(tracks))
+        for model, instances in ((Artist, artists), (Album, albums), (Track, tracks), (AlbumTrack, album_tracks)):
+            bulk_created.send(sender=model, instances=instances)
+        return [artist.pk for artist in artists]
+
+    def start(self, app, port, options):
+        env = dict(os.environ, API_CACHE_ENABLED='0', API_ASYNC_THREADS=str(options['threads']),
+                   DJANGO_ALLOWED_HOSTS=' '.join(settings.ALLOWED_HOSTS + ['127.0.0.1']))
+        command = [sys.executable, '-m', 'gunicorn', *app, '-b', f'127.0.0.1:{port}', '-w', str(options['workers']),
+                   '--threads', str(options['threads']), '--worker-connections', '2000', '--backlog', '2048',
+                   '--graceful-timeout', '5', '--log-level', 'warning']
+        return subprocess.Popen(command, cwd=settings.BASE_DIR, env=env)
+
+    def wait(self, port, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError(f'Server on port {port} did not start')
+
+    async def load(self, port, url, concurrency, duration, timeout):
+        """ Every client keeps one connection and sends the next request as soon as response is read """
+        request = f'GET {url} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: keep-alive\r\n\r\n'.encode()
+        timings, errors = [], 0
+        deadline = time.perf_counter() + duration
+
+        async def client():
+            nonlocal errors
+            reader = writer = None
+            while time.perf_counter() < deadline:
+                try:
+                    if writer is None:
+                        reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+                    start = time.perf_counter()
+                    writer.write(request)
+                    status, keep_alive = await asyncio.wait_for(self.read_response(reader), timeout)
+                    timings.append(time.perf_counter() - start)
+                    if status != 200:
+                        errors += 1
+                    if not keep_alive:
+                        writer.close()
+                        writer = None
+                except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+                    errors += 1
+                    if writer is not None:
+                        writer.close()
+                        writer = None
+                    await asyncio.sleep(0.01)
+            if writer is not None:
+                writer.close()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        timings.sort()
+        if not timings:
+            return {'rps': 0, 'p50': 0, 'p95': 0, 'errors': errors}
+        return {'rps': len(timings) / elapsed, 'p50': statistics.median(timings) * 1000,
+                'p95': timings[int(len(timings) * 0.95)] * 1000, 'errors': errors}
+
+    async def read_response(self, reader):
+        """ Reads response with Content-Length body, returns status code and whether connection stays open """
+        head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').lower().split('\r\n')
+        headers = dict(line.split(':', 1) for line in head[1:] if ':' in line)
+        await reader.readexactly(int(headers.get('content-length', 0)))
+        return int(head[0].split()[1]), headers.get('connection', '').strip() != 'close'
@@ -0,0 +1,86 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction, connection
+from django.test.utils import CaptureQueriesContext
+
+from ...counters import recount_artists, recount_albums
+from ...deletion import delete_tracks
+from ...models import Artist, Album, Track, AlbumTrack
+from ...ordering import get_album_ordering, GappedOrdering
+from ...signals import bulk_created
+
+
+class Command(BaseCommand):
+    help = 'Measures takedown of an artist catalog: tracks deleted one by one by Track.delete() with per-row ' \
+           'signals, against delete_tracks of POST /tracks/bulk-delete/ and DELETE /tracks/{id}/. ' \
+           'Tracks of the artist and --keep tracks of another one are spread over albums, every track is on ' \
+           '1-3 of them. One by one deletion runs on --sample tracks and is extrapolated. All data is rolled back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tracks', type=int, default=10000, help='Tracks to take down')
+        parser.add_argument('--keep', type=int, default=10000, help='Tracks left on the same albums')
+        parser.add_argument('--albums', type=int, default=1000)
+        parser.add_argument('--sample', type=int, default=200, help='Tracks deleted one by one')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        with transaction.atomic():
+            artist, albums = self.prepare(options['tracks'], options['keep'], options['albums'], rnd)
+            pks = list(Track.objects.filter(artist=artist).values_list('pk', flat=True))
+            rnd.shuffle(pks)
+            sample = pks[:options['sample']]
+            self.stdout.write(f'{"method":>10} {"tracks":>7} {"statements":>11} {"seconds":>9} '
+                              f'{"10k tracks, s":>14}')
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                for track in Track.objects.filter(pk__in=sample):
+                    track.delete()
+                elapsed = time.perf_counter() - start
+            self.report('one by one', len(sample), len(queries), elapsed)
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                count = delete_tracks(Track.objects.filter(artist=artist))
+                elapsed = time.perf_counter() - start
+            self.report('bulk', count, len(queries), elapsed)
+            self.verify(albums)
+            transaction.set_rollback(True)
+
+    def prepare(self, tracks_count, keep_count, albums_count, rnd):
+        """ Returns artist to take down and albums """
+        artist, kept = Artist.objects.bulk_create([Artist(name='bench_bulk_delete'), Artist(name='bench_keep')])
+        albums = Album.objects.bulk_create(Album(name=f'bench {i}', artist=artist, year=2000)
+                                           for i in range(albums_count))
+        tracks = [Track(name=f'track {i}', artist=artist if i < tracks_count else kept)
+                  for i in range(tracks_count + keep_count)]
+        rnd.shuffle(tracks)
+        Track.objects.bulk_create(tracks, batch_size=1000)
+        step, orders, album_tracks = get_album_ordering().step, {}, []
+        for track in tracks:
+            for album in rnd.sample(albums, rnd.randint(1, 3)):
+                orders[album.pk] = orders.get(album.pk, 0) + 1
+                album_tracks.append(AlbumTrack(album=album, track=track, order=orders[album.pk] * step))
+        AlbumTrack.objects.bulk_create(album_tracks, batch_size=1000)
+        bulk_created.send(sender=Track, instances=tracks)
+        recount_artists([artist.pk, kept.pk])
+        recount_albums([album.pk for album in albums])
+        return artist, albums
+
+    def report(self, method, tracks, statements, elapsed):
+        self.stdout.write(f'{method:>10} {tracks:>7} {statements:>11} {elapsed:>9.2f} '
+                          f'{elapsed / max(tracks, 1) * 10000:>14.1f}')
+
+    def verify(self, albums):
+        dense = not isinstance(get_album_ordering(), GappedOrdering)
+        rows = AlbumTrack.objects.filter(album__in=albums).order_by('album', 'order').values_list('album', 'order')
+        orders = {album.pk: [] for album in albums}
+        for album_id, order in rows:
+            orders[album_id].append(order)
+        for album in Album.objects.filter(pk__in=orders):
+            if dense and orders[album.pk] != list(range(1, len(orders[album.pk]) + 1)):
+                raise CommandError(f'Album {album.pk}: order is not 1..N after bulk delete')
+            if album.tracks_count != len(orders[album.pk]):
+                raise CommandError(f'Album {album.pk}: tracks_count is {album.tracks_count}, '
+                                   f'tracks {len(orders[album.pk])}')
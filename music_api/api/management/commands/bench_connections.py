@@ -0,0 +1,78 @@
+import io
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+
+# (name, CONN_MAX_AGE, CONN_HEALTH_CHECKS) of compared connection settings
+MODES = [
+    ('per request', 0, False),
+    ('persistent', 600, False),
+    ('checked', 600, True),
+]
+
+
+class Command(BaseCommand):
+    help = 'Serves GET requests through the WSGI handler in this thread, as a worker thread does, with a new ' \
+           'database connection per request and with persistent connections, unchecked and health checked. ' \
+           'Reports connections opened and time per request against the configured databases, including ' \
+           'replicas of SQL_REPLICAS. Response cache is disabled'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paths', nargs='+', default=['/artists/', '/tracks/1/'])
+        parser.add_argument('--requests', type=int, default=1000, help='Requests per path and mode')
+
+    def handle(self, *args, **options):
+        handler = WSGIHandler()
+        opened = []
+        connection_created.connect(lambda connection, **kwargs: opened.append(connection.alias), weak=False,
+                                   dispatch_uid='bench_connections')
+        self.stdout.write(f'{"path":>14} {"mode":>12} {"connections":>12} {"ms/request":>11} {"saved ms":>9}')
+        try:
+            with override_settings(API_CACHE_ENABLED=False):
+                for path in options['paths']:
+                    baseline = None
+                    for name, max_age, health_checks in MODES:
+                        self.configure(max_age, health_checks)
+                        self.request(handler, path)
+                        opened.clear()
+                        start = time.perf_counter()
+                        for _ in range(options['requests']):
+                            self.request(handler, path)
+                        elapsed = (time.perf_counter() - start) * 1000 / options['requests']
+                        baseline = elapsed if baseline is None else baseline
+                        self.stdout.write(f'{path:>14} {name:>12} {len(opened):>12} {elapsed:>11.3f} '
+                                          f'{baseline - elapsed:>9.3f}')
+        finally:
+            connection_created.disconnect(dispatch_uid='bench_connections')
+            for connection in connections.all():
+                connection.close()
+
+    def configure(self, max_age, health_checks):
+        for connection in connections.all():
+            connection.close()
+            connection.settings_dict.update(CONN_MAX_AGE=max_age, CONN_HEALTH_CHECKS=health_checks)
+
+    def request(self, handler, path):
+        url = urlsplit(path)
+        host = next((host for host in settings.ALLOWED_HOSTS if host and '*' not in host), 'localhost').lstrip('.')
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': url.path, 'QUERY_STRING': url.query, 'SCRIPT_NAME': '',
+            'SERVER_NAME': host, 'SERVER_PORT': '80', 'HTTP_HOST': host,
+            'wsgi.input': io.BytesIO(), 'wsgi.url_scheme': 'http', 'wsgi.errors': io.StringIO(),
+        }
+        statuses = []
+        response = handler(environ, lambda status, headers: statuses.append(status))
+        try:
+            for _ in response:
+                pass
+        finally:
+            # sends request_finished, connections are closed or kept as a server does after response
+            response.close()
+        if not statuses[0].startswith(('200', '404')):
+            raise CommandError(f'{path}: {statuses[0]}')
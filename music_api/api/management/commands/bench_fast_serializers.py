@@ -0,0 +1,92 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory
+
+from ...models import Artist, Album, Track, AlbumTrack
+from ...views import ArtistViewSet, AlbumViewSet, TrackViewSet
+
+
+class Command(BaseCommand):
+    help = 'Checks that fast list serializers render the same JSON as model serializers and compares rows/sec ' \
+           'of whole list requests and of their serialization stage alone: reading page rows with what they show ' \
+           'and building items. Requests also filter, count, validate and render the same way on both paths. ' \
+           'Seeded data is rolled back after run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--artists', type=int, default=1000)
+        parser.add_argument('--albums', type=int, default=5, help='Albums per artist')
+        parser.add_argument('--tracks', type=int, default=10, help='Tracks per album')
+        parser.add_argument('--pages', type=int, default=5)
+        parser.add_argument('--repeat', type=int, default=3, help='Runs of every measure, the fastest is taken')
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory(SERVER_NAME=settings.ALLOWED_HOSTS[0])
+        with transaction.atomic(), override_settings(API_CACHE_ENABLED=False):
+            self.seed(options['artists'], options['albums'], options['tracks'])
+            self.stdout.write(f'{"endpoint":>10} {"stage":>10} {"rows/s":>10} {"fast rows/s":>12} {"speedup":>8}')
+            for name, viewset in (('artists', ArtistViewSet), ('albums', AlbumViewSet), ('tracks', TrackViewSet)):
+                view = viewset.as_view({'get': 'list'})
+                requests = [factory.get(f'/{name}/', {'page': page}) for page in range(1, options['pages'] + 1)]
+                runs = []
+                for _ in range(options['repeat']):
+                    with override_settings(API_FAST_LIST_SERIALIZERS=0):
+                        content, rows, elapsed = self.render(view, requests)
+                    with override_settings(API_FAST_LIST_SERIALIZERS=1):
+                        fast_content, _, fast_elapsed = self.render(view, requests)
+                    if content != fast_content:
+                        raise CommandError(f'{name}: fast serializer output differs')
+                    runs.append((rows, elapsed, fast_elapsed))
+                self.report(name, 'request', *self.fastest(runs))
+                runs = [self.serialize(viewset, factory.get(f'/{name}/'), options['pages'])
+                        for _ in range(options['repeat'])]
+                self.report(name, 'serialize', *self.fastest(runs))
+            transaction.set_rollback(True)
+
+    def fastest(self, runs):
+        """ Rows and the shortest time of every path out of runs """
+        return runs[0][0], min(run[1] for run in runs), min(run[2] for run in runs)
+
+    def report(self, name, stage, rows, elapsed, fast_elapsed):
+        self.stdout.write(f'{name:>10} {stage:>10} {rows / elapsed:>10.0f} {rows / fast_elapsed:>12.0f} '
+                          f'{elapsed / fast_elapsed:>7.1f}x')
+
+    def seed(self, artists_count, albums_count, tracks_count):
+        artists = Artist.objects.bulk_create(Artist(name=f'bench artist {i}') for i in range(artists_count))
+        albums = Album.objects.bulk_create(Album(name=f'album {i}', artist=artist, year=2000, tracks_count=tracks_count)
+                                           for artist in artists for i in range(albums_count))
+        tracks = Track.objects.bulk_create(Track(name=f'track {i}', artist=album.artist)
+                                           for album in albums for i in range(tracks_count))
+        AlbumTrack.objects.bulk_create(AlbumTrack(album=albums[i // tracks_count], track=track,
+                                                  order=i % tracks_count + 1) for i, track in enumerate(tracks))
+
+    def render(self, view, requests):
+        content, rows = [], 0
+        start = time.perf_counter()
+        for request in requests:
+            response = view(request)
+            if response.status_code != 200:
+                break
+            content.append(response.render().content)
+            rows += len(response.data['results'])
+        return content, rows, time.perf_counter() - start
+
+    def serialize(self, viewset, request, pages):
+        """ Reads and serializes list pages with serializer_class and with fast_list_serializer_class.
+            Returns rows and seconds of both """
+        view = viewset(action_map={'get': 'list'}, format_kwarg=None, args=(), kwargs={})
+        view.request = view.initialize_request(request)
+        queryset = view.filter_queryset(view.get_queryset())
+        size = view.paginator.page_size
+        slices = [slice(page * size, (page + 1) * size) for page in range(pages)]
+        start = time.perf_counter()
+        rows = sum(len(view.get_serializer(list(queryset[page]), many=True).data) for page in slices)
+        elapsed = time.perf_counter() - start
+        serializer = view.fast_list_serializer_class()
+        start = time.perf_counter()
+        for page in slices:
+            serializer.to_representation(serializer.get_queryset(queryset)[page])
+        return rows, elapsed, time.perf_counter() - start
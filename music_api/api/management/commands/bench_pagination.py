@@ -0,0 +1,46 @@
+import time
+from base64 import b64encode
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.test import APIRequestFactory
+
+from ...models import Artist, Track
+from ...views import TrackViewSet
+
+
+class Command(BaseCommand):
+    help = 'Compares /tracks/ page latency of page number and keyset pagination at different offsets. ' \
+           'Seeded tracks are rolled back after run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_200, help='Tracks to seed')
+        parser.add_argument('--offsets', nargs='+', type=int, default=[0, 1_000_000])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        view = TrackViewSet.as_view({'get': 'list'})
+        factory = APIRequestFactory(SERVER_NAME=settings.ALLOWED_HOSTS[0])
+        with transaction.atomic():
+            artist = Artist.objects.create(name='bench_pagination')
+            Track.objects.bulk_create((Track(name=f'track {i}', artist=artist) for i in range(options['rows'])),
+                                      batch_size=5000)
+            ids = Track.objects.order_by('-id').values_list('id', flat=True)
+            self.stdout.write(f'{"offset":>10} {"page ms":>10} {"cursor ms":>10}')
+            for offset in options['offsets']:
+                page = offset // TrackViewSet.pagination_class.page_size + 1
+                # cursor pointing right after the row preceding offset, same rows as the page above
+                cursor = b64encode(urlencode({'p': ids[offset - 1]}).encode()).decode() if offset else ''
+                page_time = self.measure(view, factory.get('/tracks/', {'page': page}), options['repeat'])
+                cursor_time = self.measure(view, factory.get('/tracks/', {'cursor': cursor}), options['repeat'])
+                self.stdout.write(f'{offset:>10} {page_time * 1000:>10.2f} {cursor_time * 1000:>10.2f}')
+            transaction.set_rollback(True)
+
+    def measure(self, view, request, repeat):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            response = view(request)
+            assert response.status_code == 200, response.data
+        return (time.perf_counter() - start) / repeat
@@ -0,0 +1,73 @@
+import random
+import statistics
+import string
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.test import APIRequestFactory
+
+from ...models import Artist, Album, Track
+from ...search import get_search_backend
+from ...views import SearchView
+
+
+class Command(BaseCommand):
+    help = 'Seeds catalog with random names and measures /search/ latency for prefix queries of different ' \
+           'selectivity. Seeded data is rolled back after run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tracks', type=int, default=1000000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--words', type=int, default=20000, help='Vocabulary size')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rand = random.Random(options['seed'])
+        words = [''.join(rand.choices(string.ascii_lowercase, k=rand.randint(3, 9))) for _ in range(options['words'])]
+        factory = APIRequestFactory(SERVER_NAME=settings.ALLOWED_HOSTS[0])
+        view = SearchView.as_view()
+        backend = get_search_backend()
+        with transaction.atomic():
+            start = time.perf_counter()
+            self.seed(rand, words, options['tracks'])
+            backend.rebuild()
+            self.stdout.write(f'Seeded and indexed {options["tracks"]} tracks in {time.perf_counter() - start:.1f}s')
+            self.stdout.write(f'{"query":>12} {"p50 ms":>8} {"p95 ms":>8} {"max ms":>8} {"results":>8}')
+            names = [name.lower().split() for name in Track.objects.order_by('?').values_list('name', flat=True)[:1000]]
+            names = [name for name in names if len(name) > 1] or [[rand.choice(words)] * 2]
+
+            def two_words():
+                first, second = rand.choice(names)[:2]
+                return f'{first} {second[:3]}'
+
+            kinds = {
+                '2 letters': lambda: rand.choice(words)[:2],
+                '3 letters': lambda: rand.choice(words)[:3],
+                'word': lambda: rand.choice(words),
+                'two words': two_words,
+            }
+            for name, make_query in kinds.items():
+                timings, results = [], 0
+                for _ in range(options['queries']):
+                    request = factory.get('/search/', {'q': make_query()})
+                    started = time.perf_counter()
+                    response = view(request)
+                    timings.append((time.perf_counter() - started) * 1000)
+                    results += len(response.data['results'])
+                timings.sort()
+                self.stdout.write(f'{name:>12} {statistics.median(timings):>8.2f} '
+                                  f'{timings[int(len(timings) * 0.95)]:>8.2f} {timings[-1]:>8.2f} '
+                                  f'{results / len(timings):>8.1f}')
+            transaction.set_rollback(True)
+
+    def seed(self, rand, words, tracks_count):
+        def name():
+            return ' '.join(rand.choices(words, k=rand.randint(1, 4))).capitalize()
+        artists = Artist.objects.bulk_create((Artist(name=f'{name()} {i}') for i in range(max(tracks_count // 100, 1))),
+                                             batch_size=5000)
+        Album.objects.bulk_create((Album(name=name(), artist=rand.choice(artists), year=2000)
+                                   for _ in range(max(tracks_count // 10, 1))), batch_size=5000, ignore_conflicts=True)
+        Track.objects.bulk_create((Track(name=name(), artist=rand.choice(artists)) for _ in range(tracks_count)),
+                                  batch_size=5000)
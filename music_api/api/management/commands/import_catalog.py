@@ -0,0 +1,165 @@
+import csv
+import json
+import os
+import time
+from collections import defaultdict
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from ...models import Artist, Album, Track, AlbumTrack
+from ...ordering import get_album_ordering
+from ...signals import bulk_created, bulk_updated
+
+FIELDS = ('artist', 'album', 'year', 'track')
+# larger than any album, tracks reserved at it are appended
+END_POSITION = 2 ** 31 - 1
+
+
+class Command(BaseCommand):
+    help = 'Imports album tracks from NDJSON or CSV file with fields artist, album, year, track. ' \
+           'Artists and albums are upserted by their unique keys, tracks are appended to the end of albums ' \
+           'in file order unless the album has a track of that name, so a file imported again adds nothing. ' \
+           'Every chunk is committed separately and recorded in checkpoint file, ' \
+           'so interrupted import continues from the first not committed chunk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['ndjson', 'csv'], help='Defaults to file extension')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--checkpoint', help='Defaults to <path>.checkpoint')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if input_format not in ('ndjson', 'csv'):
+            raise CommandError('Unknown input format, use --format')
+        checkpoint = options['checkpoint'] or f'{path}.checkpoint'
+        done = self.read_checkpoint(checkpoint)
+        if done:
+            self.stdout.write(f'Resuming after {done} rows')
+        imported, start = 0, time.perf_counter()
+        with open(path, newline='', encoding='utf-8') as file:
+            records = islice(self.read(file, input_format), done, None)
+            while chunk := list(islice(records, options['chunk_size'])):
+                rows = [self.clean(record, done + index) for index, record in enumerate(chunk, start=1)]
+                with transaction.atomic():
+                    self.import_chunk(rows)
+                done += len(rows)
+                imported += len(rows)
+                self.write_checkpoint(checkpoint, done)
+                elapsed = time.perf_counter() - start
+                self.stdout.write(f'{done} rows, {imported / elapsed:.0f} rows/s')
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(f'Imported {imported} rows in {elapsed:.1f}s '
+                                             f'({imported / elapsed if elapsed else 0:.0f} rows/s)'))
+
+    def read(self, file, input_format):
+        if input_format == 'csv':
+            yield from csv.DictReader(file)
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+    def clean(self, record, line):
+        try:
+            row = {field: str(record[field]).strip() for field in FIELDS}
+            row['year'] = int(row['year'])
+        except (KeyError, ValueError):
+            raise CommandError(f'Row {line}: fields {", ".join(FIELDS)} are required, year must be integer')
+        if not all(row.values()) or max(len(row[field]) for field in ('artist', 'album', 'track')) > 255:
+            raise CommandError(f'Row {line}: names must be 1 to 255 characters long')
+        try:
+            Album._meta.get_field('year').run_validators(row['year'])
+        except ValidationError as exc:
+            raise CommandError(f'Row {line}: {" ".join(exc.messages)}')
+        return row
+
+    def import_chunk(self, rows):
+        """ Resolves artists and albums of the chunk with id maps, then inserts tracks missing on their albums and
+            their album orders. Per-row signals are not fired, bulk_created and bulk_updated keep counters, caches
+            and updated_at in sync """
+        now = timezone.now()
+        artist_names = {row['artist'] for row in rows}
+        existing = set(Artist.objects.filter(name__in=artist_names).values_list('name', flat=True))
+        Artist.objects.bulk_create([Artist(name=name) for name in artist_names - existing], ignore_conflicts=True)
+        artist_ids = dict(Artist.objects.filter(name__in=artist_names).values_list('name', 'id'))
+        self.send(bulk_created, Artist, [Artist(pk=artist_ids[name], name=name) for name in artist_names - existing])
+
+        years = {(artist_ids[row['artist']], row['album']): row['year'] for row in rows}
+        albums = self.get_albums(years)
+        new_keys = years.keys() - albums.keys()
+        changed_keys = {key for key, album in albums.items() if album['year'] != years[key]}
+        Album.objects.bulk_create([Album(artist_id=key[0], name=key[1], year=years[key], updated_at=now)
+                                   for key in new_keys | changed_keys],
+                                  update_conflicts=True, unique_fields=['artist', 'name'],
+                                  update_fields=['year', 'updated_at'])
+        # albums inserted by the upsert above are the only ones without id yet
+        album_ids = {key: album['id'] for key, album in albums.items()}
+        if new_keys:
+            album_ids.update({key: album['id'] for key, album in self.get_albums(new_keys).items()})
+        ordering = get_album_ordering()
+        # albums are locked in id order before their tracks are read, so concurrent imports neither deadlock
+        # nor add the same track twice
+        ordering.lock_many(album_ids.values())
+        self.send(bulk_created, Album, [Album(pk=album_ids[key], artist_id=key[0], name=key[1]) for key in new_keys])
+        self.send(bulk_updated, Album, [Album(pk=album_ids[key], artist_id=key[0], name=key[1], year=years[key])
+                                        for key in changed_keys])
+
+        rows = self.get_new_rows(rows, artist_ids, album_ids)
+        tracks = Track.objects.bulk_create([Track(name=row['track'], artist_id=artist_ids[row['artist']])
+                                            for row in rows])
+        self.send(bulk_created, Track, tracks)
+        album_tracks = defaultdict(list)
+        for row, track in zip(rows, tracks):
+            album_tracks[(artist_ids[row['artist']], row['album'])].append(track)
+        instances = []
+        for key, album_track_list in sorted(album_tracks.items(), key=lambda item: album_ids[item[0]]):
+            # position past the end, reserve() clamps it to the end of the album it reads under the lock
+            _, orders = ordering.reserve(album_ids[key], END_POSITION, len(album_track_list))
+            instances += [AlbumTrack(album_id=album_ids[key], track=track, order=order)
+                          for track, order in zip(album_track_list, orders)]
+        AlbumTrack.objects.bulk_create(instances)
+        self.send(bulk_created, AlbumTrack, instances)
+
+    def get_new_rows(self, rows, artist_ids, album_ids):
+        """ Rows whose album has no track of their name yet, album tracks are keyed by (album, track name) """
+        keys = [(album_ids[(artist_ids[row['artist']], row['album'])], row['track']) for row in rows]
+        existing = AlbumTrack.objects.filter(album__in={album_id for album_id, _ in keys},
+                                             track__name__in={name for _, name in keys})
+        seen = set(existing.values_list('album_id', 'track__name'))
+        new_rows = []
+        for row, key in zip(rows, keys):
+            if key not in seen:
+                seen.add(key)
+                new_rows.append(row)
+        return new_rows
+
+    def send(self, signal, model, instances):
+        if instances:
+            signal.send(sender=model, instances=instances)
+
+    def get_albums(self, keys):
+        """ Albums of the chunk by key: {(artist_id, name): {'id', 'artist_id', 'name', 'year'}} """
+        albums = Album.objects.filter(artist_id__in={artist_id for artist_id, _ in keys},
+                                      name__in={name for _, name in keys})
+        return {(album['artist_id'], album['name']): album
+                for album in albums.values('id', 'artist_id', 'name', 'year')
+                if (album['artist_id'], album['name']) in keys}
+
+    def read_checkpoint(self, checkpoint):
+        if not os.path.exists(checkpoint):
+            return 0
+        with open(checkpoint) as file:
+            return json.load(file)['rows']
+
+    def write_checkpoint(self, checkpoint, rows):
+        with open(f'{checkpoint}.tmp', 'w') as file:
+            json.dump({'rows': rows}, file)
+        os.replace(f'{checkpoint}.tmp', checkpoint)
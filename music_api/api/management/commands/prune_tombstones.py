@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...models import Tombstone
+
+
+class Command(BaseCommand):
+    help = 'Deletes tombstones of deleted objects older than API_CHANGES_RETENTION_DAYS. /changes/ answers 410 ' \
+           'to cursors older than that, so their clients sync the whole catalog again'
+
+    def handle(self, *args, **options):
+        deadline = timezone.now() - timedelta(days=settings.API_CHANGES_RETENTION_DAYS)
+        deleted, _ = Tombstone.objects.filter(deleted_at__lt=deadline).delete()
+        self.stdout.write(self.style.SUCCESS(f'Deleted tombstones: {deleted}'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...models import Album
+from ...ordering import get_album_ordering
+
+
+class Command(BaseCommand):
+    help = 'Renumbers album tracks with the step of current ALBUM_TRACK_ORDERING. ' \
+           'Run after switching ordering strategy or to restore free space between tracks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('album_ids', nargs='*', type=int, help='Albums to rebalance. All albums by default')
+
+    def handle(self, *args, **options):
+        ordering = get_album_ordering()
+        album_ids = options['album_ids'] or Album.objects.values_list('pk', flat=True).iterator()
+        count = 0
+        for album_id in album_ids:
+            with transaction.atomic():
+                ordering.rebalance(album_id)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Rebalanced albums: {count}'))
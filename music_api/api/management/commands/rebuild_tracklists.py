@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...models import Album
+from ...tracklists import rebuild, BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds album tracklist snapshots from album tracks. Run after turning API_TRACKLIST_SNAPSHOTS on, ' \
+           'albums without snapshot are served from their tracks until then'
+
+    def add_arguments(self, parser):
+        parser.add_argument('album_ids', nargs='*', type=int, help='Albums to rebuild. All albums by default')
+
+    def handle(self, *args, **options):
+        albums = Album.objects.order_by('pk')
+        if options['album_ids']:
+            albums = albums.filter(pk__in=options['album_ids'])
+        album_ids = list(albums.values_list('pk', flat=True))
+        for start in range(0, len(album_ids), BATCH_SIZE):
+            with transaction.atomic():
+                rebuild(album_ids[start:start + BATCH_SIZE])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt tracklists: {len(album_ids)}'))
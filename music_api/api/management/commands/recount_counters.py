@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...counters import recount_artists, recount_albums
+
+
+class Command(BaseCommand):
+    help = 'Recomputes albums_count and tracks_count of artists and albums, repairs the ones which differ'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            artists = recount_artists()
+            albums = recount_albums()
+        self.stdout.write(self.style.SUCCESS(f'Repaired artists: {artists}, albums: {albums}'))
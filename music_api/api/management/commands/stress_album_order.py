@@ -0,0 +1,117 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, OperationalError
+from django.http import Http404
+
+from ...models import Artist, Album, Track, AlbumTrack
+from ...ordering import get_album_ordering, GappedOrdering
+from ...signals import bulk_created
+
+
+class Command(BaseCommand):
+    help = 'Fires album track inserts and deletes at random positions from concurrent threads, then checks that ' \
+           'every album keeps positions 1..N and its tracks_count. Run once per --albums value: threads share ' \
+           'that many albums, so with one album all writers wait for each other. Uses the configured database, ' \
+           'created rows are deleted after run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--albums', nargs='+', type=int, default=[1, 8])
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--operations', type=int, default=100, help='Inserts and deletes per thread')
+        parser.add_argument('--tracks', type=int, default=20, help='Tracks per album before run')
+        parser.add_argument('--retries', type=int, default=50,
+                            help='Attempts of an operation failing with database lock or deadlock error')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"albums":>7} {"threads":>8} {"ops":>6} {"ops/s":>8} {"inserts":>8} {"deletes":>8} '
+                          f'{"conflicts":>10} {"retries":>8}')
+        problems = []
+        for albums_count in options['albums']:
+            artist, album_ids, track_ids = self.prepare(albums_count, options['tracks'])
+            try:
+                stats, elapsed = self.run(album_ids, track_ids, options)
+                ops = stats['inserts'] + stats['deletes']
+                self.stdout.write(f'{albums_count:>7} {options["threads"]:>8} {ops:>6} {ops / elapsed:>8.0f} '
+                                  f'{stats["inserts"]:>8} {stats["deletes"]:>8} {stats["conflicts"]:>10} '
+                                  f'{stats["retries"]:>8}')
+                problems += self.verify(album_ids)
+                if stats['failed']:
+                    problems.append(f'{stats["failed"]} operations failed after {options["retries"]} attempts')
+            finally:
+                artist.delete()
+        if problems:
+            raise CommandError('\n'.join(problems))
+        self.stdout.write(self.style.SUCCESS('Every album has gap-free order'))
+
+    def prepare(self, albums_count, tracks_count):
+        artist = Artist.objects.create(name='stress_album_order')
+        albums = Album.objects.bulk_create(Album(name=f'stress {i}', artist=artist, year=2000)
+                                           for i in range(albums_count))
+        tracks = Track.objects.bulk_create(Track(name=f'stress {i}', artist=artist) for i in range(tracks_count))
+        step = get_album_ordering().step
+        album_tracks = AlbumTrack.objects.bulk_create(AlbumTrack(album=album, track=track, order=order * step)
+                                                      for album in albums
+                                                      for order, track in enumerate(tracks, start=1))
+        for model, instances in ((Album, albums), (Track, tracks), (AlbumTrack, album_tracks)):
+            bulk_created.send(sender=model, instances=instances)
+        return artist, [album.pk for album in albums], [track.pk for track in tracks]
+
+    def run(self, album_ids, track_ids, options):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            results = list(executor.map(lambda number: self.work(album_ids, track_ids, options, number),
+                                        range(options['threads'])))
+        elapsed = time.perf_counter() - start
+        return {key: sum(result[key] for result in results) for key in results[0]}, elapsed
+
+    def work(self, album_ids, track_ids, options, number):
+        """ Runs in a thread with its own database connection """
+        rnd = random.Random(options['seed'] * 1000 + number)
+        stats = dict.fromkeys(['inserts', 'deletes', 'conflicts', 'retries', 'failed'], 0)
+        try:
+            for _ in range(options['operations']):
+                album_id = rnd.choice(album_ids)
+                insert = rnd.random() < 0.5
+                for attempt in range(options['retries']):
+                    try:
+                        stats[self.apply(album_id, insert, rnd.choice(track_ids), rnd)] += 1
+                        break
+                    except OperationalError:
+                        stats['retries'] += 1
+                        time.sleep(rnd.uniform(0, 0.01 * (attempt + 1)))
+                else:
+                    stats['failed'] += 1
+        finally:
+            connection.close()
+        return stats
+
+    def apply(self, album_id, insert, track_id, rnd):
+        """ Positions are taken before the album is locked, as API requests take them """
+        count = Album.objects.values_list('tracks_count', flat=True).get(pk=album_id)
+        if insert or not count:
+            AlbumTrack.objects.create(album_id=album_id, track_id=track_id, order=rnd.randint(1, count + 1))
+            return 'inserts'
+        ordering = get_album_ordering()
+        try:
+            queryset = ordering.with_positions(AlbumTrack.objects.filter(album=album_id).order_by('order'))
+            ordering.get_by_position(queryset, rnd.randint(1, count)).delete()
+        except (Http404, AlbumTrack.DoesNotExist):
+            # the end of album or the row itself was deleted by another thread meanwhile
+            return 'conflicts'
+        return 'deletes'
+
+    def verify(self, album_ids):
+        problems = []
+        dense = not isinstance(get_album_ordering(), GappedOrdering)
+        for album in Album.objects.filter(pk__in=album_ids).order_by('pk'):
+            orders = list(AlbumTrack.objects.filter(album=album).order_by('order').values_list('order', flat=True))
+            if dense and orders != list(range(1, len(orders) + 1)):
+                gaps = sorted(set(range(1, len(orders) + 1)) - set(orders))[:10]
+                problems.append(f'Album {album.pk}: order of {len(orders)} tracks is not 1..N, missing {gaps}')
+            if album.tracks_count != len(orders):
+                problems.append(f'Album {album.pk}: tracks_count is {album.tracks_count}, tracks {len(orders)}')
+        return problems
@@ -0,0 +1,28 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS
+
+
+class Command(BaseCommand):
+    help = 'Copies the primary SQLite database into replica files of SQL_REPLICAS, standing in for replication ' \
+           'when replicas are tried locally. Writes made after the copy are not on replicas until the next run, ' \
+           'as with replication lag'
+
+    def handle(self, *args, **options):
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != 'sqlite':
+            raise CommandError('Replicas of a server database are kept by its replication')
+        if not settings.API_READ_REPLICAS:
+            raise CommandError('No replicas configured, set SQL_REPLICAS')
+        primary.ensure_connection()
+        for alias in settings.API_READ_REPLICAS:
+            replica = connections[alias]
+            replica.close()
+            target = sqlite3.connect(replica.settings_dict['NAME'])
+            try:
+                primary.connection.backup(target)
+            finally:
+                target.close()
+            self.stdout.write(f'{alias}: {replica.settings_dict["NAME"]}')
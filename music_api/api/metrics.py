@@ -0,0 +1,101 @@
+import threading
+from bisect import bisect_left
+
+from . import cache
+
+
+class Histogram:
+    """ In-process histogram with fixed buckets per label set. Exposed in Prometheus text format """
+
+    def __init__(self, name, description, buckets, labels=('view', 'action')):
+        self.name = name
+        self.description = description
+        self.buckets = list(buckets)
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self.lock:
+            # bucket counts, then sum and count of observations
+            values = self.values.setdefault(labels, [0] * (len(self.buckets) + 1) + [0, 0])
+            values[bisect_left(self.buckets, value)] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            items = [(labels, list(values)) for labels, values in self.values.items()]
+        for labels, values in sorted(items):
+            label_text = format_labels(zip(self.labels, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ['+Inf'], values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {values[-2]}')
+            lines.append(f'{self.name}_count{{{label_text}}} {values[-1]}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, description, labels):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, labels, value=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + value
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        with self.lock:
+            items = sorted(self.values.items())
+        lines += [f'{self.name}{{{format_labels(zip(self.labels, labels))}}} {value}' for labels, value in items]
+        return lines
+
+
+def format_labels(pairs):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return ','.join(f'{name}="{escape(value)}"' for name, value in pairs)
+
+
+SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+requests_total = Counter('api_requests_total', 'Requests by view action and status',
+                         ('view', 'action', 'method', 'status'))
+request_duration = Histogram('api_request_duration_seconds', 'Request duration', SECONDS)
+sql_queries = Histogram('api_sql_queries', 'SQL queries per request', (1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144))
+sql_duration = Histogram('api_sql_duration_seconds', 'Time of SQL queries per request', SECONDS)
+non_sql_duration = Histogram('api_non_sql_duration_seconds',
+                             'Request time minus time of its SQL queries: Python, serialization, rendering, waits',
+                             SECONDS)
+response_size = Histogram('api_response_size_bytes', 'Response body size',
+                          (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304))
+slow_queries_total = Counter('api_slow_queries_total', 'SQL queries slower than API_SLOW_QUERY_MS', ('view', 'action'))
+
+HISTOGRAMS = [request_duration, sql_queries, sql_duration, non_sql_duration, response_size]
+
+
+def record(labels, duration, queries, query_duration, size):
+    """ Records sampled request. Size is None for streaming responses """
+    request_duration.observe(labels, duration)
+    sql_queries.observe(labels, queries)
+    sql_duration.observe(labels, query_duration)
+    non_sql_duration.observe(labels, max(duration - query_duration, 0))
+    if size is not None:
+        response_size.observe(labels, size)
+
+
+def expose():
+    lines = requests_total.expose() + slow_queries_total.expose()
+    for histogram in HISTOGRAMS:
+        lines += histogram.expose()
+    stats = cache.get_stats()
+    for name, value in (('hits', stats['hits']), ('misses', stats['misses'])):
+        lines += [f'# TYPE api_cache_{name}_total counter', f'api_cache_{name}_total {value}']
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from rest_framework.permissions import SAFE_METHODS
+
+from . import metrics
+from .routers import read_replica
+
+logger = logging.getLogger(__name__)
+
+
+class QueryTimer:
+    """ Database execute wrapper counting queries and their time. Logs queries slower than API_SLOW_QUERY_MS """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+        self.slow = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            if duration * 1000 >= settings.API_SLOW_QUERY_MS:
+                self.slow += 1
+                logger.warning('Slow query (%.1f ms): %s', duration * 1000, sql)
+
+
+# timer of the request being handled. Context follows the request into threads its queries run in:
+# sync_to_async copies it to the ORM thread of async views and to their serialization pool
+current_timer = ContextVar('current_timer', default=None)
+
+
+def time_query(execute, sql, params, many, context):
+    """ Execute wrapper of every connection, passes queries to timer of the current request if any """
+    timer = current_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+def install_timer(connection):
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+@receiver(connection_created)
+def install_created_timer(sender, connection, **kwargs):
+    """ Connections are per thread, those of ORM and pool threads are created there """
+    install_timer(connection)
+
+
+def get_view_labels(request):
+    """ (view, action) of resolved request: viewset class and its action, or view class and method """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved', request.method.lower()
+    view = getattr(match.func, 'cls', None) or getattr(match.func, 'view_class', None)
+    method = request.method.lower()
+    actions = getattr(match.func, 'actions', None) or {}
+    return getattr(view, '__name__', match.url_name or 'unknown'), actions.get(method, method)
+
+
+class InstrumentationMiddleware:
+    """ Counts every request, and for sampled ones (API_METRICS_SAMPLE_RATE) records duration, SQL count and time,
+        time outside SQL and response size into in-process histograms exposed on /metrics.
+        Queries are timed by time_query in whatever thread runs them, under WSGI and ASGI alike """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # marks instance as coroutine function for the handler, as MiddlewareMixin does
+        self._is_coroutine = asyncio.coroutines._is_coroutine if asyncio.iscoroutinefunction(get_response) else None
+
+    def __call__(self, request):
+        if self._is_coroutine:
+            return self.__acall__(request)
+        # connections of this thread opened before the receiver was connected
+        for connection in connections.all():
+            install_timer(connection)
+        timer = QueryTimer()
+        token = current_timer.set(timer)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        self.record(request, response, time.perf_counter() - start, timer)
+        return response
+
+    async def __acall__(self, request):
+        timer = QueryTimer()
+        token = current_timer.set(timer)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        self.record(request, response, time.perf_counter() - start, timer)
+        return response
+
+    def record(self, request, response, duration, timer):
+        labels = get_view_labels(request)
+        metrics.requests_total.inc(labels + (request.method, response.status_code))
+        if timer.slow:
+            metrics.slow_queries_total.inc(labels, timer.slow)
+        if random.random() < settings.API_METRICS_SAMPLE_RATE:
+            size = None if response.streaming else len(response.content)
+            metrics.record(labels, duration, timer.count, timer.duration, size)
+
+
+class ReplicaMiddleware:
+    """ Lets safe requests read from replicas, see api/routers.py. Writing requests are pinned to the primary, and
+        after a successful one the client gets a cookie pinning its requests for API_REPLICA_STICKY_SECONDS, so it
+        reads its own writes whatever replication lag is """
+    sync_capable = True
+    async_capable = True
+    cookie_name = 'api_primary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._is_coroutine = asyncio.coroutines._is_coroutine if asyncio.iscoroutinefunction(get_response) else None
+
+    def __call__(self, request):
+        if self._is_coroutine:
+            return self.__acall__(request)
+        read_replica.set(self.pick_replica(request))
+        return self.stick(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        read_replica.set(self.pick_replica(request))
+        return self.stick(request, await self.get_response(request))
+
+    def pick_replica(self, request):
+        """ Random alias of API_READ_REPLICAS the request reads from, None if it is pinned to the primary """
+        if not settings.API_READ_REPLICAS or request.method not in SAFE_METHODS or self.is_sticky(request):
+            return None
+        return random.choice(settings.API_READ_REPLICAS)
+
+    @classmethod
+    def is_sticky(cls, request):
+        """ Whether the client wrote within API_REPLICA_STICKY_SECONDS and reads from the primary """
+        return bool(settings.API_READ_REPLICAS) and cls.cookie_name in request.COOKIES
+
+    def stick(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            response.set_cookie(self.cookie_name, '1', max_age=settings.API_REPLICA_STICKY_SECONDS, httponly=True,
+                                samesite='Lax')
+        return response
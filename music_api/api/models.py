@@ -1,11 +1,10 @@
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 
 
 class StripCharFieldsMixin:
     def clean(self):
-        print('Обрееезка')
         for field in self._meta.fields:
             if isinstance(field, models.CharField):
                 value = getattr(self, field.name)
@@ -13,23 +12,51 @@ class StripCharFieldsMixin:
                     setattr(self, field.name, value.strip())
 
 
+class LoadedArtistMixin:
+    """ Remembers artist_id as loaded from database, so a move to another artist is known on save,
+        see api/signals.py """
+    loaded_artist_id = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.loaded_artist_id = instance.__dict__.get('artist_id')
+        return instance
+
+
 # Create your models here.
 class Artist(models.Model, StripCharFieldsMixin):
     class Meta:
         verbose_name = 'Artist'
         verbose_name_plural = 'Artists'
+        indexes = [
+            # keyset of /changes/ feed, see api/changes.py
+            models.Index(fields=['updated_at', 'id'], name='artist_updated_idx'),
+        ]
 
     name = models.CharField(verbose_name='name', max_length=255, null=False, blank=False, unique=True)
+    # maintained by api/signals.py, repaired by 'recount_counters' command
+    albums_count = models.PositiveIntegerField(default=0, editable=False)
+    tracks_count = models.PositiveIntegerField(default=0, editable=False)
+
+    # conditional GET validator and change feed key, touched when representation changes, see api/signals.py
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
 
 
-class Album(models.Model, StripCharFieldsMixin):
+class Album(LoadedArtistMixin, models.Model, StripCharFieldsMixin):
     class Meta:
         verbose_name = 'Album'
         verbose_name_plural = 'Albums'
         unique_together = ('artist', 'name')
+        indexes = [
+            models.Index(fields=['artist', '-id'], name='album_artist_id_idx'),
+            models.Index(fields=['year'], name='album_year_idx'),
+            models.Index(fields=['name'], name='album_name_idx'),
+            models.Index(fields=['updated_at', 'id'], name='album_updated_idx'),
+        ]
 
     name = models.CharField(verbose_name='name', max_length=255, null=False, blank=False)
     artist = models.ForeignKey('Artist', related_name='albums', on_delete=models.CASCADE, null=False, blank=False)
@@ -37,19 +64,35 @@ class Album(models.Model, StripCharFieldsMixin):
     year = models.SmallIntegerField(verbose_name='Release year', validators=[MinValueValidator(1860),
                                                                              MaxValueValidator(
                                                                                  limit_value=timezone.now().year)])
+    # maintained by api/signals.py, repaired by 'recount_counters' command
+    tracks_count = models.PositiveIntegerField(default=0, editable=False)
+
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
 
 
-class Track(models.Model, StripCharFieldsMixin):
+class Track(LoadedArtistMixin, models.Model, StripCharFieldsMixin):
     class Meta:
         verbose_name = 'Track'
         verbose_name_plural = 'Tracks'
+        indexes = [
+            models.Index(fields=['artist', '-id'], name='track_artist_id_idx'),
+            models.Index(fields=['name'], name='track_name_idx'),
+            models.Index(fields=['updated_at', 'id'], name='track_updated_idx'),
+        ]
 
     name = models.CharField(verbose_name='name', max_length=255, null=False, blank=False)
     artist = models.ForeignKey('Artist', related_name='tracks', on_delete=models.CASCADE, null=False, blank=False)
 
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def save(self, *args, **kwargs):
+        # post_save rebuilds tracklists of its albums, they must change with the name
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return self.name
 
@@ -59,10 +102,38 @@ class AlbumTrack(models.Model, StripCharFieldsMixin):
         verbose_name = 'Album Track'
         verbose_name_plural = 'Album Tracks'
         unique_together = ('album', 'order')
+        indexes = [
+            # tracklist is read from index only
+            models.Index(fields=['album', 'order', 'track'], name='albumtrack_album_order_idx'),
+        ]
 
-    order = models.SmallIntegerField(null=False, blank=False, validators=[MinValueValidator(1)])
+    # public position in album. With 'gapped' ALBUM_TRACK_ORDERING keeps sparse rank, see api/ordering.py
+    order = models.IntegerField(null=False, blank=False, validators=[MinValueValidator(1)])
     track = models.ForeignKey('Track', related_name='album_track', on_delete=models.CASCADE, null=False)
     album = models.ForeignKey('Album', related_name='tracks', on_delete=models.CASCADE, null=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def save(self, *args, **kwargs):
+        # pre_save reserves order under album lock, the row must be written in the same transaction
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return str(self.track)
+
+
+class AlbumTracklist(models.Model):
+    """ Tracklist of album as retrieve shows it, rebuilt in transactions changing it, see api/tracklists.py """
+    album = models.OneToOneField('Album', related_name='tracklist', on_delete=models.CASCADE, primary_key=True)
+    tracks = models.JSONField()
+
+
+class Tombstone(models.Model):
+    """ Deleted artist, album or track. Feeds /changes/ with updated_at of live rows, see api/changes.py """
+    class Meta:
+        indexes = [models.Index(fields=['deleted_at', 'id'], name='tombstone_deleted_idx')]
+
+    # model name of deleted object
+    kind = models.CharField(max_length=16)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
@@ -0,0 +1,191 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.http import Http404
+
+from .models import Album, AlbumTrack
+
+
+class DenseOrdering:
+    """ Order column keeps public position 1..N. Insert and delete shift all following tracks.
+        Writers of one album are serialized by lock(), writers of different albums don't wait for each other """
+    step = 1
+    # rows per statement of multi-album writes
+    batch_size = 1000
+
+    def lock(self, album_id):
+        """ Locks album row until the end of the current transaction, must be called inside one.
+            Returns tracks_count of the album, None if it doesn't exist.
+            SQLite has no row locks: there the no-op write takes the database write lock before anything is read,
+            so two writers never deadlock upgrading their read locks """
+        albums = Album.objects.filter(pk=album_id)
+        if connection.features.has_select_for_update:
+            albums = albums.select_for_update()
+        else:
+            albums.update(tracks_count=F('tracks_count'))
+        return albums.values_list('tracks_count', flat=True).first()
+
+    def lock_many(self, album_ids):
+        """ Locks album rows in id order, so writers of several albums don't deadlock each other. See lock() """
+        album_ids = sorted(album_ids)
+        for start in range(0, len(album_ids), self.batch_size):
+            albums = Album.objects.filter(pk__in=album_ids[start:start + self.batch_size]).order_by('pk')
+            if connection.features.has_select_for_update:
+                list(albums.select_for_update().values_list('pk', flat=True))
+            else:
+                albums.update(tracks_count=F('tracks_count'))
+
+    def clamp(self, position, tracks_count):
+        """ Position is validated before the lock is taken, concurrent deletes may have moved the end of album """
+        return position if tracks_count is None else min(position, tracks_count + 1)
+
+    def shift(self, album_id, step, **filters):
+        """ Shifts order of album tracks matching filters by step. Takes two statements whatever album size is.
+            Rows are moved to negative range first, so ('album', 'order') stays unique after every row update """
+        queryset = AlbumTrack.objects.filter(album=album_id)
+        queryset.filter(**filters).update(order=-(F('order') + step))
+        queryset.filter(order__lt=0).update(order=-F('order'))
+
+    def reserve(self, album_id, position, count=1):
+        """ Frees place for count tracks starting from position. Returns position of the first one and values
+            for order column. Album stays locked until the caller's transaction ends, rows must be inserted in it """
+        with transaction.atomic(savepoint=False):
+            position = self.clamp(position, self.lock(album_id))
+            self.shift(album_id, count, order__gte=position)
+        return position, list(range(position, position + count))
+
+    def release(self, album_id, order, count=1):
+        """ Closes the gap left after deleting count tracks starting from order. Album must be locked before
+            the rows were deleted, see lock_album_order in api/signals.py """
+        with transaction.atomic(savepoint=False):
+            self.shift(album_id, -count, order__gt=order)
+
+    def renumber(self, album_id, pks, free_position=None, free_count=0):
+        """ Writes order of album tracks as they follow in pks, leaving free_count places before free_position.
+            Takes constant number of statements. Album must be locked before pks were read """
+        objects = []
+        for position, pk in enumerate(pks, start=1):
+            if free_position is not None and position >= free_position:
+                position += free_count
+            objects.append(AlbumTrack(pk=pk, order=-position * self.step))
+        with transaction.atomic(savepoint=False):
+            AlbumTrack.objects.bulk_update(objects, ['order'], batch_size=self.batch_size)
+            AlbumTrack.objects.filter(album=album_id, order__lt=0).update(order=-F('order'))
+
+    def rebalance(self, album_id, free_position=None, free_count=0):
+        with transaction.atomic(savepoint=False):
+            self.lock(album_id)
+            pks = AlbumTrack.objects.filter(album=album_id).order_by('order').values_list('pk', flat=True)
+            self.renumber(album_id, list(pks), free_position, free_count)
+
+    def reorder(self, album_id, arrange):
+        """ Renumbers album tracks in the order arrange(pks) returns, pks are given in current order.
+            arrange runs under the album lock, so it checks the same tracklist it changes.
+            Takes constant number of statements """
+        with transaction.atomic(savepoint=False):
+            self.lock(album_id)
+            pks = AlbumTrack.objects.filter(album=album_id).order_by('order').values_list('pk', flat=True)
+            self.renumber(album_id, arrange(list(pks)))
+
+    def compact(self, album_ids):
+        """ Closes gaps left in albums by rows deleted without release(), every album once whatever number of
+            rows it lost. Only rows whose order changes are written. Takes a read, an update per batch_size changed
+            rows and a flip per batch_size albums. Albums must be locked """
+        album_ids = sorted(album_ids)
+        for start in range(0, len(album_ids), self.batch_size):
+            batch = album_ids[start:start + self.batch_size]
+            rows = AlbumTrack.objects.filter(album__in=batch).order_by('album', 'order')
+            objects, previous, position = [], None, 0
+            for pk, album_id, order in rows.values_list('pk', 'album', 'order'):
+                position = position + 1 if album_id == previous else 1
+                previous = album_id
+                if order != position * self.step:
+                    objects.append(AlbumTrack(pk=pk, order=-position * self.step))
+            if objects:
+                with transaction.atomic(savepoint=False):
+                    AlbumTrack.objects.bulk_update(objects, ['order'], batch_size=self.batch_size)
+                    AlbumTrack.objects.filter(album__in=batch, order__lt=0).update(order=-F('order'))
+
+    def with_positions(self, queryset):
+        return queryset
+
+    def get_by_position(self, queryset, position):
+        try:
+            return queryset.get(order=position)
+        except (AlbumTrack.DoesNotExist, ValueError):
+            raise Http404
+
+    async def aget_by_position(self, queryset, position):
+        try:
+            return await queryset.aget(order=position)
+        except (AlbumTrack.DoesNotExist, ValueError):
+            raise Http404
+
+
+class GappedOrdering(DenseOrdering):
+    """ Order column keeps sparse rank, public position is computed from it.
+        Insert writes only the new row while there is free space between neighbours, otherwise
+        album is rebalanced first. Delete writes nothing """
+
+    def __init__(self, step):
+        self.step = step
+
+    def reserve(self, album_id, position, count=1):
+        with transaction.atomic(savepoint=False):
+            position = self.clamp(position, self.lock(album_id))
+            if not (orders := self._between(album_id, position, count)):
+                self.rebalance(album_id, position, count)
+                orders = self._between(album_id, position, count)
+        return position, orders
+
+    def release(self, album_id, order, count=1):
+        pass
+
+    def compact(self, album_ids):
+        pass
+
+    def _between(self, album_id, position, count):
+        orders = AlbumTrack.objects.filter(album=album_id).order_by('order').values_list('order', flat=True)
+        if position > 1:
+            bounds = list(orders[position - 2:position])
+        else:
+            bounds = [0] + list(orders[:1])
+        low = bounds[0] if bounds else 0
+        high = bounds[1] if len(bounds) > 1 else low + self.step * (count + 1)
+        gap = (high - low) // (count + 1)
+        if gap < 1:
+            return None
+        return [low + gap * index for index in range(1, count + 1)]
+
+    def with_positions(self, queryset):
+        return queryset.annotate(position=Window(RowNumber(), partition_by=[F('album_id')], order_by=F('order').asc()))
+
+    def get_by_position(self, queryset, position):
+        try:
+            position = int(position)
+            instance = queryset.order_by('order')[position - 1] if position > 0 else None
+        except (ValueError, IndexError):
+            instance = None
+        if instance is None:
+            raise Http404
+        instance.position = position
+        return instance
+
+    async def aget_by_position(self, queryset, position):
+        try:
+            position = int(position)
+            instances = [obj async for obj in queryset.order_by('order')[position - 1:position]] if position > 0 else []
+        except ValueError:
+            instances = []
+        if not instances:
+            raise Http404
+        instances[0].position = position
+        return instances[0]
+
+
+def get_album_ordering():
+    """ Returns ordering strategy chosen by ALBUM_TRACK_ORDERING setting: 'dense' (default) or 'gapped' """
+    if settings.ALBUM_TRACK_ORDERING == 'gapped':
+        return GappedOrdering(settings.ALBUM_TRACK_ORDER_GAP)
+    return DenseOrdering()
@@ -0,0 +1,39 @@
+from contextvars import ContextVar
+
+from django.core.signals import request_finished
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.dispatch import receiver
+
+# alias of API_READ_REPLICAS the reads of current request go to, the primary while None. Out of requests it is
+# always None, ReplicaMiddleware picks one replica for the whole request when it may read from replicas, so its
+# queries see the same state. Async views copy it into their ORM threads with the rest of request context
+read_replica = ContextVar('read_replica', default=None)
+
+
+@receiver(request_finished)
+def unpin_finished_request(**kwargs):
+    """ Streamed responses read after the middleware returns, so the request is released when it is sent """
+    read_replica.set(None)
+
+
+class ReplicaRouter:
+    """ Sends reads to the replica picked for the request and writes to the primary. Reads go to the primary
+        when the request is pinned to it, see ReplicaMiddleware, or inside a transaction, which must see its own
+        writes and lock rows it reads """
+
+    def db_for_read(self, model, **hints):
+        alias = read_replica.get()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # replicas get schema by replication, see 'sync_replicas' command for SQLite
+        return db == DEFAULT_DB_ALIAS
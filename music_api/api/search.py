@@ -0,0 +1,92 @@
+import re
+
+from django.db import connection
+
+from .models import Artist, Album, Track
+
+# entity kind code, part of search row key
+KINDS = {Artist: 1, Album: 2, Track: 3}
+MODELS = {code: model for model, code in KINDS.items()}
+
+
+def get_tokens(query):
+    """ Words of search query. Every word is matched as prefix """
+    return re.findall(r'\w+', query.lower())
+
+
+class SqliteSearch:
+    """ FTS5 table with names of artists, albums and tracks. Rowid encodes kind and id of the entity,
+        so rows are replaced and removed by key. Kept in sync by api/signals.py """
+    table = 'api_search'
+
+    def install(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1 FROM sqlite_master WHERE name = %s', [self.table])
+            if cursor.fetchone():
+                return
+            cursor.execute(f"CREATE VIRTUAL TABLE {self.table} USING fts5(name, prefix='2 3')")
+        self.rebuild()
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            for model, kind in KINDS.items():
+                cursor.execute(f'INSERT INTO {self.table}(rowid, name) '
+                               f'SELECT id * 4 + {kind}, name FROM {model._meta.db_table}')
+
+    def index(self, model, instances):
+        rows = [(instance.pk * 4 + KINDS[model], instance.name) for instance in instances]
+        with connection.cursor() as cursor:
+            cursor.executemany(f'INSERT OR REPLACE INTO {self.table}(rowid, name) VALUES (%s, %s)', rows)
+
+    def remove(self, model, pks):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(pk * 4 + KINDS[model],) for pk in pks])
+
+    def search(self, tokens, limit):
+        # whole word matches both phrases and ranks above the longer words it is a prefix of
+        match = ' AND '.join(f'("{token}" OR "{token}"*)' for token in tokens)
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT rowid, name, -rank FROM {self.table} WHERE {self.table} MATCH %s '
+                           f'ORDER BY rank, length(name) LIMIT %s', [match, limit])
+            return [{'type': MODELS[key % 4]._meta.model_name, 'id': key // 4, 'name': name, 'score': score}
+                    for key, name, score in cursor.fetchall()]
+
+
+class PostgresSearch:
+    """ GIN indexes on tsvector of names right in the entity tables, nothing to sync """
+    vector = "to_tsvector('simple', name)"
+
+    def install(self):
+        with connection.cursor() as cursor:
+            for model in KINDS:
+                table = model._meta.db_table
+                cursor.execute(f'CREATE INDEX IF NOT EXISTS {table}_name_search ON {table} USING GIN ({self.vector})')
+
+    def rebuild(self):
+        pass
+
+    def index(self, model, instances):
+        pass
+
+    def remove(self, model, pks):
+        pass
+
+    def search(self, tokens, limit):
+        query = ' & '.join(f'({token} | {token}:*)' for token in tokens)
+        # ORDER BY of a union takes output columns only, not expressions
+        selects = [f"SELECT {kind} AS kind, id, name, ts_rank({self.vector}, query) AS score, "
+                   f"length(name) AS name_length "
+                   f"FROM {model._meta.db_table}, to_tsquery('simple', %s) query WHERE {self.vector} @@ query"
+                   for model, kind in KINDS.items()]
+        with connection.cursor() as cursor:
+            cursor.execute(' UNION ALL '.join(selects) + ' ORDER BY score DESC, name_length LIMIT %s',
+                           [query] * len(selects) + [limit])
+            return [{'type': MODELS[kind]._meta.model_name, 'id': pk, 'name': name, 'score': score}
+                    for kind, pk, name, score, _ in cursor.fetchall()]
+
+
+def get_search_backend():
+    if connection.vendor == 'postgresql':
+        return PostgresSearch()
+    return SqliteSearch()
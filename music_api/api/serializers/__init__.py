@@ -1,3 +1,4 @@
 from .artist import *
 from .track import *
 from .album import *
+from .fast import *
@@ -1,13 +1,59 @@
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
 
+from .bulk import BulkCreateListSerializer
 from .track import AlbumTrackSerializer
 from .mixins import ContextUtilsMixin
-from ..models import Album
+from ..models import Album, Artist
+from ..tracklists import get_snapshot, prefetch_tracks
+
+
+class AlbumListSerializer(BulkCreateListSerializer):
+    def validate_batch(self, items):
+        for item in items:
+            # artist id taken from URL comes as string
+            item['artist_id'] = int(item['artist_id'])
+        artist_ids = {item['artist_id'] for item in items}
+        names = {item['name'] for item in items}
+        existing_artists = set(Artist.objects.filter(pk__in=artist_ids).values_list('pk', flat=True))
+        existing_albums = set(Album.objects.filter(artist_id__in=artist_ids, name__in=names).
+                              values_list('artist_id', 'name'))
+        errors, seen = [], set()
+        for item in items:
+            key = (item['artist_id'], item['name'])
+            if key[0] not in existing_artists:
+                errors.append({'artist_id': ['Artist not found']})
+            elif key in existing_albums or key in seen:
+                errors.append({'name': ['Album with this name already exists at artist']})
+            else:
+                errors.append({})
+            seen.add(key)
+        return errors
+
+    def prepare_representation(self, instances):
+        artists = Artist.objects.in_bulk({instance.artist_id for instance in instances})
+        for instance in instances:
+            instance.artist = artists[instance.artist_id]
+
+
+class TracklistSerializer(serializers.ListSerializer):
+    """ Tracklist of album from its snapshot if the view selected it, see api/tracklists.py.
+        Otherwise from album tracks, prefetched by the view or loaded here """
+
+    def __init__(self, **kwargs):
+        super().__init__(child=AlbumTrackSerializer(), source='*', read_only=True, **kwargs)
+
+    def to_representation(self, album):
+        tracks = get_snapshot(album)
+        if tracks is None:
+            prefetch_related_objects([album], prefetch_tracks())
+            tracks = super().to_representation(album.tracks.all())
+        return tracks
 
 
 class ArtistAlbumRetrieveSerializer(serializers.ModelSerializer):
     tracks_count = serializers.IntegerField(read_only=True, default=0)
-    tracks = AlbumTrackSerializer(read_only=True, many=True)
+    tracks = TracklistSerializer()
 
     class Meta:
         model = Album
@@ -32,9 +78,11 @@ class ArtistAlbumSerializer(serializers.ModelSerializer, ContextUtilsMixin):
         model = Album
         fields = ['id', 'name', 'year', 'tracks_count']
         depth = 1
+        list_serializer_class = AlbumListSerializer
 
     def validate(self, attrs):
-        attrs.update({'artist_id': self.get_artist_id()})
+        if artist_id := self.get_artist_id():
+            attrs.update({'artist_id': artist_id})
         return attrs
 
 
@@ -46,3 +94,4 @@ class AlbumSerializer(ArtistAlbumSerializer):
         model = Album
         fields = ['id', 'name', 'year', 'artist_name', 'artist_id', 'tracks_count']
         depth = 1
+        list_serializer_class = AlbumListSerializer
@@ -1,8 +1,30 @@
 from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
 
+from .bulk import BulkCreateListSerializer
 from ..models import Artist
 
 
+class ArtistListSerializer(BulkCreateListSerializer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # uniqueness is checked for the whole batch in validate_batch
+        name_field = self.child.fields['name']
+        name_field.validators = [item for item in name_field.validators if not isinstance(item, UniqueValidator)]
+
+    def validate_batch(self, items):
+        names = [item['name'] for item in items]
+        existing = set(Artist.objects.filter(name__in=names).values_list('name', flat=True))
+        errors, seen = [], set()
+        for name in names:
+            if name in existing or name in seen:
+                errors.append({'name': ['artist with this name already exists.']})
+            else:
+                errors.append({})
+            seen.add(name)
+        return errors
+
+
 class ArtistSerializer(serializers.ModelSerializer):
     tracks_count = serializers.IntegerField(read_only=True, default=0)
     albums_count = serializers.IntegerField(read_only=True, default=0)
@@ -10,3 +32,4 @@ class ArtistSerializer(serializers.ModelSerializer):
     class Meta:
         model = Artist
         fields = ['id', 'name', 'tracks_count', 'albums_count']
+        list_serializer_class = ArtistListSerializer
@@ -0,0 +1,40 @@
+from django.db import transaction
+from rest_framework import serializers
+
+from ..signals import bulk_created
+
+
+class BulkCreateListSerializer(serializers.ListSerializer):
+    """ List serializer which validates the batch together and creates it with bulk_create inside one transaction.
+        Childs may override:
+        - validate_batch: checks requiring database, one query for the whole batch
+        - build_instance: unsaved model instance from validated item
+        - prepare_representation: loads relations used by child representation for all created instances
+     """
+    batch_size = 500
+
+    def to_internal_value(self, data):
+        validated_data = super().to_internal_value(data)
+        errors = self.validate_batch(validated_data)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return validated_data
+
+    def validate_batch(self, items):
+        """ Returns list of errors in the same structure as per item validation: empty dict for valid item """
+        return [{} for _ in items]
+
+    def build_instance(self, item):
+        return self.child.Meta.model(**item)
+
+    def prepare_representation(self, instances):
+        pass
+
+    def create(self, validated_data):
+        with transaction.atomic():
+            model = self.child.Meta.model
+            instances = model.objects.bulk_create([self.build_instance(item) for item in validated_data],
+                                                  batch_size=self.batch_size)
+            bulk_created.send(sender=model, instances=instances)
+        self.prepare_representation(instances)
+        return instances
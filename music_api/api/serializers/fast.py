@@ -0,0 +1,74 @@
+from ..models import AlbumTrack
+from ..tracklists import read_tracklists
+
+
+class FastListSerializer:
+    """ Builds list representation straight from .values_list() rows, bypassing serializer fields machinery.
+        Output must be equal to the one of the viewset serializer_class. Childs must define:
+        - fields: pairs of (output key, values_list() lookup) in serializer fields order, 'id' first
+     """
+    fields = ()
+
+    def __init__(self):
+        # rows are named tuples of distinct lookups, keyset pagination reads 'id' of the last one by name. Items
+        # are built by zipping keys with row values picked by index
+        self.lookups = list(dict.fromkeys(lookup for _, lookup in self.fields))
+        self.keys = [key for key, _ in self.fields]
+        self.indexes = [self.lookups.index(lookup) for _, lookup in self.fields]
+        self.plain = self.indexes == list(range(len(self.lookups)))
+
+    def get_queryset(self, queryset):
+        return queryset.prefetch_related(None).values_list(*self.lookups, named=True)
+
+    def to_representation(self, rows):
+        rows = list(rows)
+        self.prepare(rows)
+        return [self.to_item(row) for row in rows]
+
+    def prepare(self, rows):
+        """ Loads child rows for the whole page """
+
+    def to_item(self, row):
+        if self.plain:
+            return dict(zip(self.keys, row))
+        return dict(zip(self.keys, [row[index] for index in self.indexes]))
+
+
+class ArtistFastListSerializer(FastListSerializer):
+    fields = (('id', 'id'), ('name', 'name'), ('tracks_count', 'tracks_count'), ('albums_count', 'albums_count'))
+
+
+class AlbumFastListSerializer(FastListSerializer):
+    fields = (('id', 'id'), ('name', 'name'), ('year', 'year'), ('artist_name', 'artist__name'),
+              ('tracks_count', 'tracks_count'))
+
+
+class TrackFastListSerializer(FastListSerializer):
+    fields = (('id', 'id'), ('name', 'name'), ('albums', 'id'), ('artist_id', 'artist_id'),
+              ('artist_name', 'artist__name'))
+
+    def prepare(self, rows):
+        """ Albums of every track, deduplicated as in ArtistTrackSerializer.get_albums """
+        self.albums = {}
+        album_tracks = AlbumTrack.objects.filter(track_id__in=[row[0] for row in rows]).\
+            values_list('track_id', 'album_id', 'album__name')
+        for track_id, album_id, album_name in album_tracks:
+            self.albums.setdefault(track_id, {})[album_id] = {'id': album_id, 'name': album_name}
+
+    def to_item(self, row):
+        item = super().to_item(row)
+        item['albums'] = list(self.albums.get(row[0], {}).values())
+        return item
+
+
+class AlbumTracklistFastListSerializer(AlbumFastListSerializer):
+    """ Albums with ordered tracklists. Orders are positions 1..N as API shows them """
+    fields = AlbumFastListSerializer.fields + (('tracks', 'id'),)
+
+    def prepare(self, rows):
+        self.tracks = read_tracklists([row[0] for row in rows])
+
+    def to_item(self, row):
+        item = super().to_item(row)
+        item['tracks'] = self.tracks.get(row[0], [])
+        return item
@@ -1,3 +1,7 @@
+from rest_framework.exceptions import NotFound
+
+from ..models import Album
+
 
 class ContextUtilsMixin:
     """ Caution: for serializers using data from request. Such serializers shouldnt be used for validate  """
@@ -24,11 +28,32 @@ class ContextUtilsMixin:
         except StopIteration:
             return None
 
+    def get_parent(self, name):
+        """ Parent object of nested view, loaded once per request, see NestedParentMixin.
+            None when view has no parent with such name """
+        view = self.context.get('view')
+        if getattr(view, 'parent_name', None) == name:
+            return view.get_parent()
+        return None
+
     def get_artist_id(self):
-        """ Returns value from request URL if it exists """
+        """ Returns value from request URL if it exists. Nested views check that artist exists """
+        if artist := self.get_parent('artist'):
+            return artist.pk
         if self.current_basename.endswith('artists') and self.request_kwargs.get('pk'):
             return self.request_kwargs.get('pk')
         try:
             return next(value for key, value in self.request_kwargs.items() if key.endswith('artists_pk'))
         except (StopIteration, AttributeError):
             return None
+
+    def get_album(self):
+        """ Returns album from request URL. Loaded once and shared through serializer context """
+        if album := self.get_parent('album'):
+            return album
+        if 'album' not in self.context:
+            album = Album.objects.filter(pk=self.get_album_id()).first()
+            if album is None:
+                raise NotFound('Album not found')
+            self.context['album'] = album
+        return self.context['album']
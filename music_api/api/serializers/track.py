@@ -1,9 +1,30 @@
-from django.db.models import Prefetch
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from rest_framework import serializers
 from rest_framework.fields import empty
 
+from .bulk import BulkCreateListSerializer
 from .mixins import ContextUtilsMixin
-from ..models import Track, AlbumTrack, Album
+from ..models import Track, AlbumTrack, Artist, Album
+from ..ordering import get_album_ordering
+from ..signals import bulk_created, tracks_reordered
+
+
+class TrackListSerializer(BulkCreateListSerializer):
+    def validate_batch(self, items):
+        for item in items:
+            # artist id taken from URL comes as string
+            item['artist_id'] = int(item['artist_id'])
+        existing = set(Artist.objects.filter(pk__in={item['artist_id'] for item in items}).
+                       values_list('pk', flat=True))
+        return [{} if item['artist_id'] in existing else {'artist_id': ['Artist not found']} for item in items]
+
+    def prepare_representation(self, instances):
+        artists = Artist.objects.in_bulk({instance.artist_id for instance in instances})
+        for instance in instances:
+            instance.artist = artists[instance.artist_id]
+        prefetch = Prefetch('album_track', queryset=AlbumTrack.objects.select_related('album'))
+        prefetch_related_objects(instances, prefetch)
 
 
 class ArtistTrackSerializer(serializers.ModelSerializer, ContextUtilsMixin):
@@ -13,6 +34,7 @@ class ArtistTrackSerializer(serializers.ModelSerializer, ContextUtilsMixin):
         model = Track
         fields = ['id', 'name', 'albums']
         depth = 1
+        list_serializer_class = TrackListSerializer
 
     def validate(self, attrs):
         if artist_id := self.get_artist_id():
@@ -52,6 +74,35 @@ class TrackSerializer(ArtistTrackSerializer):
         model = Track
         fields = ArtistTrackSerializer.Meta.fields + ['artist_id', 'artist_name']
         depth = 1
+        list_serializer_class = TrackListSerializer
+
+
+class AlbumTrackListSerializer(BulkCreateListSerializer):
+    def create(self, validated_data):
+        """ Inserts tracks as one contiguous block of orders. Tracks with scattered orders are
+            created one by one, as each of them moves the following ones """
+        if not validated_data:
+            return []
+        start = validated_data[0]['order']
+        if [item['order'] for item in validated_data] != list(range(start, start + len(validated_data))):
+            return super(BulkCreateListSerializer, self).create(validated_data)
+        album_id = validated_data[0]['album_id']
+        with transaction.atomic():
+            new_tracks = Track.objects.bulk_create([Track(**item['track']) for item in validated_data
+                                                    if 'track' in item], batch_size=self.batch_size)
+            bulk_created.send(sender=Track, instances=new_tracks)
+            tracks = Track.objects.in_bulk({item['track_id'] for item in validated_data if 'track_id' in item})
+            new_tracks = iter(new_tracks)
+            instances = []
+            start, orders = get_album_ordering().reserve(album_id, start, len(validated_data))
+            for position, (item, order) in enumerate(zip(validated_data, orders), start=start):
+                track = next(new_tracks) if 'track' in item else tracks[item['track_id']]
+                instance = AlbumTrack(album_id=album_id, track=track, order=order)
+                instance.position = position
+                instances.append(instance)
+            AlbumTrack.objects.bulk_create(instances, batch_size=self.batch_size)
+            bulk_created.send(sender=AlbumTrack, instances=instances)
+        return instances
 
 
 class AlbumTrackSerializer(serializers.ModelSerializer, ContextUtilsMixin):
@@ -64,35 +115,43 @@ class AlbumTrackSerializer(serializers.ModelSerializer, ContextUtilsMixin):
         extra_kwargs = {
             'order': {'required': False},
         }
+        list_serializer_class = AlbumTrackListSerializer
 
     def __init__(self, instance=None, data=empty, **kwargs):
         super().__init__(instance, data, **kwargs)
         if data is not empty and not instance:
-            prefetch = Prefetch('tracks', queryset=AlbumTrack.objects.filter(album=self.get_album_id()).
-                                select_related('track').order_by('-order'))
-
-            self._album = Album.objects.filter(pk=self.get_album_id()).prefetch_related(prefetch)[0]
+            self._album = self.get_album()
             if isinstance(self.initial_data, list):
                 orders = [x.get('order') for x in self.initial_data]
                 if any(orders) and not all(orders):
                     raise serializers.ValidationError('Order must be at all tracks or at no one at all')
                 if not any(orders):
-                    start_order = self._album.tracks.first().order + 1 if self._album.tracks.first() else 1
-                    for order, track in enumerate(self.initial_data, start=start_order):
+                    for order, track in enumerate(self.initial_data, start=self._album.tracks_count + 1):
                         track.update({'order': order})
-                new_objects_count = len(self.initial_data)
+                items = self.initial_data
             else:
-                new_objects_count = 1
-            if queryset := self._album.tracks.all():
-                self._max_order = queryset.first().order + new_objects_count
-            else:
-                self._max_order = new_objects_count
+                items = [self.initial_data]
+            # orders are public positions 1..N whatever ordering strategy stores in the column
+            self._max_order = self._album.tracks_count + len(items)
+            self._artist_track_ids = self.get_artist_track_ids(items)
+
+    def get_artist_track_ids(self, items):
+        """ Ids of album artist tracks referenced by items. One query for the whole list """
+        track_ids = {str(item.get('id')) for item in items if isinstance(item, dict) and item.get('id')}
+        track_ids = [int(track_id) for track_id in track_ids if track_id.isdigit()]
+        if not track_ids:
+            return set()
+        return set(Track.objects.filter(pk__in=track_ids, artist_id=self._album.artist_id).
+                   values_list('pk', flat=True))
 
     def to_representation(self, instance):
-        return super().to_representation(instance)
+        data = super().to_representation(instance)
+        if 'order' in data:
+            data['order'] = getattr(instance, 'position', instance.order)
+        return data
 
     def fill_track_data(self, track):
-        track.update({'artist_id': self._album.artist.id})
+        track.update({'artist_id': self._album.artist_id})
 
     def validate(self, attrs):
         track_id = attrs.get('track_id')
@@ -103,9 +162,7 @@ class AlbumTrackSerializer(serializers.ModelSerializer, ContextUtilsMixin):
             raise serializers.ValidationError('name, id: only one variable allowed. Name for create, '
                                               'track id for add existing track')
         if track_id:
-            try:
-                self._album.tracks.get(pk=track_id)
-            except Track.DoesNotExist:
+            if track_id not in self._artist_track_ids:
                 raise serializers.ValidationError('id: Track Not Found')
         else:
             self.fill_track_data(track)
@@ -125,3 +182,63 @@ class AlbumTrackSerializer(serializers.ModelSerializer, ContextUtilsMixin):
             track = Track.objects.create(**track_data)
             obj = AlbumTrack.objects.create(track=track, **validated_data)
         return obj
+
+
+def reorder_album_tracks(album, arrange):
+    """ Renumbers tracks of album as arrange(pks) returns them, see DenseOrdering.reorder """
+    with transaction.atomic():
+        get_album_ordering().reorder(album.pk, arrange)
+        tracks_reordered.send(sender=Album, instances=[album])
+    return album
+
+
+class AlbumTrackOrderSerializer(serializers.Serializer, ContextUtilsMixin):
+    """ Complete new tracklist of album from URL: current positions of all its tracks in the desired order.
+        {"order": [3, 1, 2]} puts the third track first """
+    order = serializers.ListField(child=serializers.IntegerField(min_value=1))
+
+    def arrange(self, pks):
+        positions = self.validated_data['order']
+        if sorted(positions) != list(range(1, len(pks) + 1)):
+            raise serializers.ValidationError({'order': [f'Every position 1..{len(pks)} must be listed once']})
+        return [pks[position - 1] for position in positions]
+
+    def create(self, validated_data):
+        return reorder_album_tracks(self.get_album(), self.arrange)
+
+
+def apply_moves(pks, moves):
+    """ pks after moves applied one after another. Positions are checked against the current tracklist,
+        ValidationError has errors per move """
+    errors = [{key: [f'Ensure this value is less than or equal to {len(pks)}.'] for key in ('from', 'to')
+               if move[key] > len(pks)} for move in moves]
+    if any(errors):
+        raise serializers.ValidationError(errors)
+    for move in moves:
+        pks.insert(move['to'] - 1, pks.pop(move['from'] - 1))
+    return pks
+
+
+class AlbumTrackMoveListSerializer(serializers.ListSerializer):
+    def create(self, validated_data):
+        return reorder_album_tracks(self.child.get_album(), lambda pks: apply_moves(pks, validated_data))
+
+
+class AlbumTrackMoveSerializer(serializers.Serializer, ContextUtilsMixin):
+    """ Moves track of album from URL: {"from": 3, "to": 1}. Tracks between shift by one """
+
+    class Meta:
+        list_serializer_class = AlbumTrackMoveListSerializer
+
+    def get_fields(self):
+        # 'from' is a keyword, it can't be declared as class attribute
+        return {'from': serializers.IntegerField(min_value=1), 'to': serializers.IntegerField(min_value=1)}
+
+    def arrange(self, pks):
+        try:
+            return apply_moves(pks, [self.validated_data])
+        except serializers.ValidationError as exc:
+            raise serializers.ValidationError(exc.detail[0])
+
+    def create(self, validated_data):
+        return reorder_album_tracks(self.get_album(), self.arrange)
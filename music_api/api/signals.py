@@ -1,29 +1,310 @@
-from django.db import transaction
-from django.db.models import F
-from django.db.models.signals import pre_save, post_delete
-from django.dispatch import receiver
-from .models import AlbumTrack
+from django.db.models import QuerySet
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, post_migrate
+from django.dispatch import receiver, Signal
+from django.utils import timezone
+from . import cache, tracklists
+from .counters import change_counter, count_by
+from .models import Artist, Album, Track, AlbumTrack, Tombstone
+from .ordering import get_album_ordering
+from .search import get_search_backend
 
-
-def update_album_order(queryset, step):
-    queryset = queryset.select_for_update()
-    with transaction.atomic():
-        for album_track in queryset:
-            album_track.order = F('order') + step
-            album_track.save(update_fields=['order'])
+# sent after rows are inserted bypassing save(): sender is model, 'instances' are created objects
+bulk_created = Signal()
+# sent after rows are updated bypassing save(): sender is model, 'instances' are updated objects with pk, foreign
+# keys and names loaded
+bulk_updated = Signal()
+# sent after rows are deleted bypassing delete(), see api/deletion.py: sender is model, 'instances' are deleted
+# objects with pk and foreign keys loaded, 'origin' is the model whose deletion took them if any
+bulk_deleted = Signal()
+# sent after tracks of albums are renumbered bypassing save(): sender is Album, 'instances' are albums
+tracks_reordered = Signal()
 
 
 @receiver(pre_save, sender=AlbumTrack)
 def update_order_increase(sender, instance: AlbumTrack, **kwargs):
-    pre_save.disconnect(update_order_increase, sender=sender)
-    queryset = AlbumTrack.objects.filter(album=instance.album_id, order__gte=instance.order).order_by('-order')
-    update_album_order(queryset, 1)
-    pre_save.connect(update_order_increase, sender=sender)
+    """ Order set on new instance is public position. Replaces it with value for order column """
+    if instance._state.adding:
+        instance.position, orders = get_album_ordering().reserve(instance.album_id, instance.order)
+        instance.order = orders[0]
+
+
+def is_album_deleted(instance: AlbumTrack, origin):
+    """ Tracks go with their album, itself or with its artist, there is no order or tracklist left to keep.
+        Origin is the deleted instance, or the QuerySet for queryset deletes: album tracks it collects through
+        albums or artists are all on albums it deletes, as tracks of an artist are only on its albums """
+    if isinstance(origin, QuerySet):
+        return origin.model in (Album, Artist)
+    return isinstance(origin, Artist) or isinstance(origin, Album) and origin.pk == instance.album_id
+
+
+@receiver(pre_delete, sender=AlbumTrack)
+def lock_album_order(sender, instance: AlbumTrack, origin=None, **kwargs):
+    """ Album is locked before the row is deleted, so release() never waits for a writer that waits for this row.
+        Order read before the lock may have been shifted by concurrent writers, it is read again under the lock.
+        Raises AlbumTrack.DoesNotExist if the row is already deleted. Deletion runs in transaction,
+        the lock is held until it ends """
+    if not is_album_deleted(instance, origin):
+        get_album_ordering().lock(instance.album_id)
+        instance.order = AlbumTrack.objects.values_list('order', flat=True).get(pk=instance.pk)
+
+
+@receiver(post_delete, sender=AlbumTrack)
+def update_order_decrease(sender, instance: AlbumTrack, origin=None, **kwargs):
+    if not is_album_deleted(instance, origin):
+        get_album_ordering().release(instance.album_id, instance.order)
+
+
+# parent counter of every child model: (model, parent field, counter field)
+COUNTERS = {
+    Album: [(Artist, 'artist_id', 'albums_count')],
+    Track: [(Artist, 'artist_id', 'tracks_count')],
+    AlbumTrack: [(Album, 'album_id', 'tracks_count')],
+}
+
+
+def update_counters(sender, instances, sign, origin=None):
+    """ Counters of origin model are left, its rows go too """
+    for model, parent_field, counter_field in COUNTERS.get(sender, []):
+        if model is not origin:
+            change_counter(model, counter_field, count_by(instances, parent_field, sign))
+
+
+@receiver(pre_save, sender=Album)
+@receiver(pre_save, sender=Track)
+def remember_moved_artist(sender, instance, **kwargs):
+    """ Sets moved_from_artist_id to the previous artist when saved album or track changes it, None otherwise """
+    instance.moved_from_artist_id = None
+    if instance._state.adding:
+        return
+    old = instance.loaded_artist_id
+    if old is None:
+        old = sender.objects.filter(pk=instance.pk).values_list('artist_id', flat=True).first()
+    if old is not None and old != instance.artist_id:
+        instance.moved_from_artist_id = old
+    instance.loaded_artist_id = instance.artist_id
+
+
+@receiver(post_save, sender=Album)
+@receiver(post_save, sender=Track)
+@receiver(post_save, sender=AlbumTrack)
+def increase_counters(sender, instance, created, **kwargs):
+    if created:
+        update_counters(sender, [instance], 1)
+    elif getattr(instance, 'moved_from_artist_id', None):
+        # counts go with album or track to its new artist
+        for model, parent_field, counter_field in COUNTERS[sender]:
+            change_counter(model, counter_field, {instance.moved_from_artist_id: -1, instance.artist_id: 1})
+
+
+@receiver(post_delete, sender=Album)
+@receiver(post_delete, sender=Track)
+@receiver(post_delete, sender=AlbumTrack)
+def decrease_counters(sender, instance, **kwargs):
+    update_counters(sender, [instance], -1)
+
 
+@receiver(bulk_created)
+def increase_bulk_counters(sender, instances, **kwargs):
+    update_counters(sender, instances, 1)
 
+
+@receiver(bulk_deleted)
+def decrease_bulk_counters(sender, instances, origin=None, **kwargs):
+    update_counters(sender, instances, -1, origin)
+
+
+def artist_scopes(instances):
+    """ Scopes of artists of albums or tracks, and of artists they were moved from """
+    return {f'artist:{pk}' for item in instances
+            for pk in (item.artist_id, getattr(item, 'moved_from_artist_id', None)) if pk}
+
+
+def cache_scopes(sender, instances, updated):
+    """ Cache generation scopes affected by change of instances. Dependent objects are looked up only
+        for updates, created objects have none and deleted ones invalidate them through cascade """
+    scopes = set()
+    if sender is Artist:
+        scopes |= {'artists', 'albums', 'tracks'} | {f'artist:{item.pk}' for item in instances}
+        if updated:
+            scopes |= {f'album:{pk}' for pk in Album.objects.filter(artist__in=instances).values_list('pk', flat=True)}
+    elif sender is Album:
+        scopes |= {'artists', 'albums', 'tracks'}
+        scopes |= {f'album:{item.pk}' for item in instances} | artist_scopes(instances)
+    elif sender is Track:
+        scopes |= {'artists', 'tracks'} | artist_scopes(instances)
+        if updated:
+            # album lists show track names with ?expand=tracks
+            scopes.add('albums')
+            album_ids = AlbumTrack.objects.filter(track__in=instances).values_list('album_id', flat=True)
+            scopes |= {f'album:{pk}' for pk in album_ids}
+    elif sender is AlbumTrack:
+        album_ids = {item.album_id for item in instances}
+        artist_ids = Album.objects.filter(pk__in=album_ids).values_list('artist_id', flat=True)
+        scopes |= {'albums', 'tracks'} | {f'album:{pk}' for pk in album_ids} | {f'artist:{pk}' for pk in artist_ids}
+    return scopes
+
+
+@receiver(post_save, sender=Artist)
+@receiver(post_save, sender=Album)
+@receiver(post_save, sender=Track)
+@receiver(post_save, sender=AlbumTrack)
+def invalidate_saved(sender, instance, created, **kwargs):
+    cache.bump(cache_scopes(sender, [instance], updated=not created))
+
+
+@receiver(post_delete, sender=Artist)
+@receiver(post_delete, sender=Album)
+@receiver(post_delete, sender=Track)
 @receiver(post_delete, sender=AlbumTrack)
-def update_order_decrease(sender, instance: AlbumTrack, **kwargs):
-    pre_save.disconnect(update_order_increase, sender=sender)
-    queryset = AlbumTrack.objects.filter(album=instance.album_id, order__gt=instance.order).order_by('order')
-    update_album_order(queryset, -1)
-    pre_save.connect(update_order_increase, sender=sender)
+def invalidate_deleted(sender, instance, **kwargs):
+    cache.bump(cache_scopes(sender, [instance], updated=False))
+
+
+@receiver(bulk_created)
+@receiver(bulk_deleted)
+def invalidate_bulk(sender, instances, **kwargs):
+    cache.bump(cache_scopes(sender, instances, updated=False))
+
+
+@receiver(bulk_updated)
+def invalidate_bulk_updated(sender, instances, **kwargs):
+    cache.bump(cache_scopes(sender, instances, updated=True))
+
+
+@receiver(tracks_reordered)
+def invalidate_reordered(sender, instances, **kwargs):
+    """ Order is shown in album tracklists only """
+    scopes = {'albums'} | {f'album:{item.pk}' for item in instances}
+    cache.bump(scopes | {f'artist:{item.artist_id}' for item in instances})
+
+
+def touch(*querysets):
+    now = timezone.now()
+    for queryset in querysets:
+        queryset.update(updated_at=now)
+
+
+@receiver(post_save, sender=Artist)
+def touch_artist_dependents(sender, instance, created, **kwargs):
+    """ Albums and tracks show artist name """
+    if not created:
+        touch(Album.objects.filter(artist=instance), Track.objects.filter(artist=instance))
+
+
+@receiver(post_save, sender=Album)
+def touch_album_dependents(sender, instance, created, **kwargs):
+    """ Tracks show names of their albums """
+    if not created:
+        touch(Track.objects.filter(album_track__album=instance))
+
+
+@receiver(bulk_updated, sender=Album)
+def touch_bulk_album_dependents(sender, instances, **kwargs):
+    touch(Track.objects.filter(album_track__album__in=[item.pk for item in instances]))
+
+
+@receiver(post_save, sender=Track)
+def touch_track_dependents(sender, instance, created, **kwargs):
+    """ Albums show names of their tracks """
+    if not created:
+        touch(Album.objects.filter(tracks__track=instance))
+
+
+@receiver(post_save, sender=AlbumTrack)
+def touch_album_track_saved(sender, instance, created, **kwargs):
+    """ Tracks show their albums. Album itself is touched with tracks_count """
+    touch(Track.objects.filter(pk=instance.track_id))
+
+
+@receiver(post_delete, sender=AlbumTrack)
+def touch_album_track_deleted(sender, instance, **kwargs):
+    touch(Track.objects.filter(pk=instance.track_id))
+
+
+@receiver(bulk_created, sender=AlbumTrack)
+@receiver(bulk_deleted, sender=AlbumTrack)
+def touch_album_tracks_bulk(sender, instances, **kwargs):
+    touch(Track.objects.filter(pk__in={item.track_id for item in instances}))
+
+
+@receiver(tracks_reordered)
+def touch_reordered(sender, instances, **kwargs):
+    touch(Album.objects.filter(pk__in=[item.pk for item in instances]))
+
+
+@receiver(post_save, sender=AlbumTrack)
+def rebuild_saved_tracklist(sender, instance, **kwargs):
+    tracklists.rebuild([instance.album_id])
+
+
+@receiver(post_delete, sender=AlbumTrack)
+def rebuild_deleted_tracklist(sender, instance, origin=None, **kwargs):
+    if not is_album_deleted(instance, origin):
+        tracklists.rebuild([instance.album_id])
+
+
+@receiver(bulk_created, sender=AlbumTrack)
+@receiver(bulk_deleted, sender=AlbumTrack)
+def rebuild_bulk_tracklists(sender, instances, origin=None, **kwargs):
+    if origin is not Album:
+        tracklists.rebuild({item.album_id for item in instances})
+
+
+@receiver(tracks_reordered)
+def rebuild_reordered_tracklists(sender, instances, **kwargs):
+    tracklists.rebuild([item.pk for item in instances])
+
+
+@receiver(post_save, sender=Track)
+def rebuild_track_tracklists(sender, instance, created, **kwargs):
+    """ Tracklists show track names """
+    if not created:
+        tracklists.rebuild(AlbumTrack.objects.filter(track=instance).values_list('album_id', flat=True))
+
+
+@receiver(post_migrate)
+def install_search(sender, **kwargs):
+    if sender.name == 'api':
+        get_search_backend().install()
+
+
+@receiver(post_save, sender=Artist)
+@receiver(post_save, sender=Album)
+@receiver(post_save, sender=Track)
+def index_saved(sender, instance, **kwargs):
+    get_search_backend().index(sender, [instance])
+
+
+@receiver(post_delete, sender=Artist)
+@receiver(post_delete, sender=Album)
+@receiver(post_delete, sender=Track)
+def unindex_deleted(sender, instance, **kwargs):
+    get_search_backend().remove(sender, [instance.pk])
+
+
+@receiver(bulk_created)
+@receiver(bulk_updated)
+def index_bulk_saved(sender, instances, **kwargs):
+    if sender in (Artist, Album, Track):
+        get_search_backend().index(sender, instances)
+
+
+@receiver(bulk_deleted)
+def unindex_bulk_deleted(sender, instances, **kwargs):
+    if sender in (Artist, Album, Track):
+        get_search_backend().remove(sender, [instance.pk for instance in instances])
+
+
+@receiver(post_delete, sender=Artist)
+@receiver(post_delete, sender=Album)
+@receiver(post_delete, sender=Track)
+def record_tombstone(sender, instance, **kwargs):
+    """ Cascade deletes send this for every deleted row too, so /changes/ sees them """
+    Tombstone.objects.create(kind=sender._meta.model_name, object_id=instance.pk)
+
+
+@receiver(bulk_deleted)
+def record_bulk_tombstones(sender, instances, **kwargs):
+    if sender in (Artist, Album, Track):
+        Tombstone.objects.bulk_create([Tombstone(kind=sender._meta.model_name, object_id=instance.pk)
+                                       for instance in instances], batch_size=1000)
@@ -1,3 +1,1681 @@
-from django.test import TestCase
+import csv
+import inspect
+import itertools
+import json
+import os
+import random
+import re
+import statistics
+import tempfile
+import time
+from collections import Counter
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.signals import request_finished
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+
+from . import cache, metrics
+from .changes import Cursor
+from .counters import recount_artists, recount_albums
+from .deletion import raw_delete
+from .middleware import ReplicaMiddleware, get_view_labels
+from .models import Artist, Album, Track, AlbumTrack, AlbumTracklist, Tombstone
+from .ordering import DenseOrdering, GappedOrdering, get_album_ordering
+from .routers import ReplicaRouter
+from .search import PostgresSearch, get_search_backend
+from .views.export import ExportView
+from .views.mixins import CachedResponseMixin
+
+SEEDED_TABLES = [model._meta.db_table for model in (Artist, Album, Track, AlbumTrack)]
+# latency of endpoints is recorded to this file on first run and compared with on the next ones, wall-clock
+# timings depend on the machine, so they are checked only when it is set
+LATENCY_BASELINE = os.environ.get('API_LATENCY_BASELINE')
+LATENCY_TOLERANCE = float(os.environ.get('API_LATENCY_TOLERANCE', 3))
+
+
+@override_settings(API_CACHE_ENABLED=False)
+class CountersTest(TestCase):
+    """ Counter columns follow creates, deletes and moves to another artist without recount """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('user'))
+        self.old, self.new = Artist.objects.create(name='old'), Artist.objects.create(name='new')
+
+    def counts(self, artist):
+        artist = Artist.objects.get(pk=artist.pk)
+        return artist.albums_count, artist.tracks_count
+
+    def test_move(self):
+        album = self.client.post('/albums/', {'name': 'album', 'year': 2000, 'artist_id': self.old.pk},
+                                 format='json').json()
+        tracks = [self.client.post('/tracks/', {'name': f'track {i}', 'artist_id': self.old.pk},
+                                   format='json').json() for i in range(2)]
+        self.client.post(f'/albums/{album["id"]}/tracks/', {'id': tracks[0]['id']}, format='json')
+        self.assertEqual(self.counts(self.old), (1, 2))
+        self.client.patch(f'/tracks/{tracks[0]["id"]}/', {'artist_id': self.new.pk}, format='json')
+        self.client.patch(f'/albums/{album["id"]}/', {'artist_id': self.new.pk}, format='json')
+        self.assertEqual(self.counts(self.old), (0, 1))
+        self.assertEqual(self.counts(self.new), (1, 1))
+        # saving again without a move changes nothing
+        self.client.patch(f'/tracks/{tracks[0]["id"]}/', {'name': 'renamed'}, format='json')
+        self.assertEqual(self.counts(self.new), (1, 1))
+        self.assertEqual(self.client.get(f'/artists/{self.new.pk}/').json()['tracks_count'], 1)
+        self.assertEqual(self.client.delete(f'/tracks/{tracks[0]["id"]}/').status_code, 204)
+        self.assertEqual(self.client.delete(f'/albums/{album["id"]}/').status_code, 204)
+        self.assertEqual(self.counts(self.new), (0, 0))
+        self.assertEqual(self.counts(self.old), (0, 1))
+        self.assertEqual(recount_artists() + recount_albums(), 0)
+
+    def test_create_delete(self):
+        album = Album.objects.create(name='album', artist=self.old, year=2000)
+        track = Track.objects.create(name='track', artist=self.old)
+        AlbumTrack.objects.create(album=album, track=track, order=1)
+        self.assertEqual(self.counts(self.old), (1, 1))
+        self.assertEqual(Album.objects.get(pk=album.pk).tracks_count, 1)
+        track.delete()
+        self.assertEqual(self.counts(self.old), (1, 0))
+        self.assertEqual(Album.objects.get(pk=album.pk).tracks_count, 0)
+        self.assertEqual(recount_artists() + recount_albums(), 0)
+
+    def test_delete_catalog(self):
+        """ Artist goes with albums and tracks, its tracks leave albums of other artists, which close the gap """
+        albums = [Album.objects.create(name=f'album {i}', artist=self.old, year=2000) for i in range(2)]
+        other = Album.objects.create(name='other', artist=self.new, year=2000)
+        for i in range(3):
+            track = Track.objects.create(name=f'track {i}', artist=self.old)
+            AlbumTrack.objects.create(album=albums[i % 2], track=track, order=1)
+            AlbumTrack.objects.create(album=other, track=track, order=i + 1)
+        kept = Track.objects.create(name='kept', artist=self.new)
+        AlbumTrack.objects.create(album=other, track=kept, order=2)
+        deleted = {'artist': [self.old.pk], 'album': [album.pk for album in albums],
+                   'track': list(Track.objects.filter(artist=self.old).values_list('pk', flat=True))}
+        self.assertEqual(self.client.delete(f'/artists/{self.old.pk}/').status_code, 204)
+        self.assertFalse(Album.objects.filter(artist=self.old.pk).exists())
+        self.assertFalse(Track.objects.filter(artist=self.old.pk).exists())
+        self.assertEqual(self.client.get(f'/albums/{other.pk}/tracks/').json(),
+                         [{'order': 1, 'id': kept.pk, 'name': 'kept'}])
+        self.assertEqual(self.counts(self.new), (1, 1))
+        self.assertEqual(recount_artists() + recount_albums(), 0)
+        for kind, pks in deleted.items():
+            self.assertCountEqual(Tombstone.objects.filter(kind=kind).values_list('object_id', flat=True), pks)
+        self.assertEqual(self.client.delete(f'/albums/{other.pk}/').status_code, 204)
+        self.assertEqual(self.counts(self.new), (0, 1))
+        self.assertFalse(AlbumTracklist.objects.exists())
+        self.assertEqual(self.client.get(f'/tracks/{kept.pk}/').json()['albums'], [])
+
+
+class ResponseCacheTest(TestCase):
+    """ With the cache on, every kind of write invalidates responses showing what it changed: after it
+        each route answers as without cache, and the routes of changed objects miss """
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('user'))
+        self.artist = Artist.objects.create(name='artist')
+        self.album = Album.objects.create(name='album', artist=self.artist, year=2000)
+        self.tracks = [Track.objects.create(name=f'track {i}', artist=self.artist) for i in range(3)]
+        for order, track in enumerate(self.tracks, start=1):
+            AlbumTrack.objects.create(album=self.album, track=track, order=order)
+
+    def urls(self):
+        artist, album, track = self.artist.pk, self.album.pk, self.tracks[0].pk
+        return ['/artists/', f'/artists/{artist}/', '/albums/', '/albums/?expand=tracks', f'/albums/{album}/',
+                '/tracks/', f'/tracks/{track}/', f'/albums/{album}/tracks/', f'/artists/{artist}/albums/',
+                f'/artists/{artist}/albums/{album}/', f'/artists/{artist}/tracks/']
+
+    def assertInvalidated(self, write, misses):
+        urls = self.urls()
+        for url in urls:
+            self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+        responses = {url: self.client.get(url) for url in urls}
+        for url, response in responses.items():
+            with self.subTest(url=url), override_settings(API_CACHE_ENABLED=False):
+                expected = self.client.get(url)
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(response.json(), expected.json())
+        for url in misses:
+            self.assertEqual(responses[url]['X-Cache'], 'MISS', url)
+
+    def test_create(self):
+        self.assertInvalidated(lambda: self.client.post('/tracks/', {'name': 'new', 'artist_id': self.artist.pk},
+                                                        format='json'),
+                               ['/tracks/', f'/artists/{self.artist.pk}/tracks/', f'/artists/{self.artist.pk}/'])
+
+    def test_update(self):
+        self.assertInvalidated(lambda: self.client.patch(f'/artists/{self.artist.pk}/', {'name': 'renamed'},
+                                                         format='json'),
+                               ['/artists/', '/albums/', '/tracks/', f'/albums/{self.album.pk}/'])
+        self.assertInvalidated(lambda: self.client.patch(f'/albums/{self.album.pk}/', {'name': 'renamed'},
+                                                         format='json'),
+                               ['/albums/', f'/albums/{self.album.pk}/', f'/tracks/{self.tracks[0].pk}/'])
+        self.assertInvalidated(lambda: self.client.patch(f'/tracks/{self.tracks[0].pk}/', {'name': 'renamed'},
+                                                         format='json'),
+                               ['/albums/?expand=tracks', f'/albums/{self.album.pk}/', f'/tracks/{self.tracks[0].pk}/'])
+
+    def test_delete(self):
+        album_tracks = f'/albums/{self.album.pk}/tracks/'
+        self.assertInvalidated(lambda: self.client.delete(f'{album_tracks}2/'),
+                               [album_tracks, f'/albums/{self.album.pk}/', '/albums/?expand=tracks'])
+        self.assertInvalidated(lambda: self.client.delete(f'/tracks/{self.tracks[2].pk}/'),
+                               ['/tracks/', album_tracks, f'/artists/{self.artist.pk}/'])
+
+    def test_bulk(self):
+        album_tracks = f'/albums/{self.album.pk}/tracks/'
+        self.assertInvalidated(lambda: self.client.post(album_tracks, [{'name': 'new 1'}, {'name': 'new 2'}],
+                                                        format='json'),
+                               [album_tracks, '/tracks/', f'/albums/{self.album.pk}/', '/albums/'])
+        self.assertInvalidated(lambda: self.client.post('/tracks/bulk-delete/', {'ids': [self.tracks[1].pk]},
+                                                        format='json'),
+                               [album_tracks, '/tracks/', f'/artists/{self.artist.pk}/', '/albums/'])
+
+    def test_reorder(self):
+        album_tracks = f'/albums/{self.album.pk}/tracks/'
+        self.assertInvalidated(lambda: self.client.put(f'{album_tracks}order/', {'order': [3, 2, 1]}, format='json'),
+                               [album_tracks, f'/albums/{self.album.pk}/', '/albums/?expand=tracks'])
+        self.assertInvalidated(lambda: self.client.post(f'{album_tracks}move/', {'from': 1, 'to': 3}, format='json'),
+                               [album_tracks, f'/albums/{self.album.pk}/'])
+
+    def test_import(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalog.csv')
+            with open(path, 'w') as file:
+                file.write('artist,album,year,track\nartist,album,2000,imported\nartist,other,2001,imported 2\n')
+            self.assertInvalidated(lambda: call_command('import_catalog', path, stdout=StringIO()),
+                                   ['/albums/', '/tracks/', f'/albums/{self.album.pk}/', f'/artists/{self.artist.pk}/'])
+
+    def test_conditional_hit(self):
+        """ Validators are cached with the response, a hit answers with ETag and 304 without queries """
+        for url in self.urls():
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                with CaptureQueriesContext(connection) as context:
+                    response = self.client.get(url)
+                    not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual((response['X-Cache'], response['ETag']), ('HIT', etag))
+                self.assertEqual((not_modified.status_code, not_modified['X-Cache']), (304, 'HIT'))
+                self.assertEqual(len(context.captured_queries), 0)
+
+
+@override_settings(API_CACHE_ENABLED=False)
+class ConditionalGetTest(TestCase):
+    """ 304 for matching validators, answered before anything is serialized. List pages are validated by keys
+        of their rows, without aggregating the table """
+
+    @classmethod
+    def setUpTestData(cls):
+        artists = Artist.objects.bulk_create(Artist(name=f'artist {i}') for i in range(30))
+        Album.objects.create(name='album', artist=artists[0], year=2000)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_list(self):
+        # page number pages count rows, keyset pages don't
+        for url, queries in [('/artists/', 2), ('/artists/?cursor=', 1), ('/artists/?name=artist 3', 2),
+                             ('/albums/?expand=tracks', 2), (f'/artists/{Artist.objects.first().pk}/albums/', 1)]:
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connection) as context:
+                    response = self.client.get(url)
+                self.assertFalse([query for query in context.captured_queries if 'MAX(' in query['sql']])
+                etag = response['ETag']
+                with self.assertNumQueries(queries), \
+                        mock.patch('rest_framework.serializers.ListSerializer.to_representation') as serialize:
+                    self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+                serialize.assert_not_called()
+        url = '/artists/?cursor='
+        etag = self.client.get(url)['ETag']
+        artist = Artist.objects.order_by('-id').first()
+        self.client.force_authenticate(User.objects.create_user('user'))
+        self.client.patch(f'/artists/{artist.pk}/', {'name': 'renamed'}, format='json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_retrieve(self):
+        artist = Artist.objects.first()
+        url = f'/artists/{artist.pk}/'
+        Artist.objects.filter(pk=artist.pk).update(updated_at=timezone.now() - timedelta(seconds=5))
+        response = self.client.get(url)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+    def test_retrieve_same_second(self):
+        """ Last-Modified of a row written in the current second is not given, a later write in the same second
+            would get the same one """
+        url = f'/artists/{Artist.objects.first().pk}/'
+        response = self.client.get(url)
+        self.assertNotIn('Last-Modified', response)
+        since = http_date(time.time() + 60)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=since).status_code, 200)
+
+
+@override_settings(API_CACHE_ENABLED=False)
+class QueryPlanAuditTest(TestCase):
+    """ Runs EXPLAIN for every query of read endpoints on seeded tables. Filtered query must not scan
+        a whole table: it means some filter or nested scope has no index """
+    urls = [
+        '/artists/', '/artists/3/', '/artists/?name=artist 3',
+        '/albums/', '/albums/5/', '/albums/?artist__name=artist 3', '/albums/?year=2000', '/albums/?name=album 7',
+        '/tracks/', '/tracks/9/', '/tracks/?artist__name=artist 3', '/tracks/?name=track 4',
+        '/artists/3/albums/', '/artists/3/albums/3/', '/artists/3/tracks/', '/artists/3/tracks/3/',
+        '/albums/5/tracks/', '/albums/5/tracks/2/', '/albums/?cursor=',
+        '/changes/', f'/changes/?since={Cursor(timezone.now() - timedelta(days=1), 1, 0).encode()}',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        artists = Artist.objects.bulk_create(Artist(name=f'artist {i}') for i in range(500))
+        albums = Album.objects.bulk_create(Album(name=f'album {i}', artist=artists[i % 500], year=1990 + i % 30)
+                                           for i in range(2000))
+        tracks = Track.objects.bulk_create(Track(name=f'track {i}', artist=artists[i % 500]) for i in range(10000))
+        AlbumTrack.objects.bulk_create(AlbumTrack(album=albums[i % 2000], track=track, order=i // 2000 + 1)
+                                       for i, track in enumerate(tracks))
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # small test tables are cheaper to scan, planner must show whether an index exists at all
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute(f'EXPLAIN {sql}')
+                return [row[0] for row in cursor.fetchall()]
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def full_scans(self, plan):
+        if connection.vendor == 'postgresql':
+            pattern = r'Seq Scan on (\w+)'
+        else:
+            pattern = r'^SCAN (\w+)$'
+        matches = (re.search(pattern, line.strip()) for line in plan)
+        return [match.group(1) for match in matches if match and match.group(1) in SEEDED_TABLES]
+
+    def test_filtered_queries_use_indexes(self):
+        for url in self.urls:
+            with self.subTest(url=url), CaptureQueriesContext(connection) as context:
+                self.client.get(url)
+                for query in context.captured_queries:
+                    sql = query['sql']
+                    if not sql.startswith('SELECT') or ' WHERE ' not in sql:
+                        continue
+                    plan = self.explain(sql)
+                    self.assertFalse(self.full_scans(plan), f'{sql}\n' + '\n'.join(plan))
+
+
+@override_settings(API_CACHE_ENABLED=False)
+class NestedParentQueriesTest(TestCase):
+    """ Parent of nested route is not loaded for non-empty reads and loaded once for writes """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.artist = Artist.objects.create(name='artist')
+        cls.other_artist = Artist.objects.create(name='other artist')
+        cls.album = Album.objects.create(name='album', artist=cls.artist, year=2000)
+        for order in (1, 2):
+            track = Track.objects.create(name=f'track {order}', artist=cls.artist)
+            AlbumTrack.objects.create(album=cls.album, track=track, order=order)
+        cls.user = User.objects.create_user('user')
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_reads(self):
+        # validators, rows and prefetched children when they are in output, album retrieve joins tracklist snapshot
+        for url, queries in [
+            (f'/artists/{self.artist.pk}/albums/', 2),
+            (f'/artists/{self.artist.pk}/albums/{self.album.pk}/', 2),
+            (f'/artists/{self.artist.pk}/tracks/', 3),
+            (f'/albums/{self.album.pk}/tracks/', 2),
+            (f'/albums/{self.album.pk}/tracks/2/', 2),
+            (f'/artists/{self.artist.pk}/albums/{self.album.pk}/tracks/', 2),
+        ]:
+            with self.subTest(url=url), self.assertNumQueries(queries):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_missing_parent(self):
+        # album track routes validate by the album row, other lists by keys of their page
+        for url, detail, queries in [
+            ('/artists/0/albums/', 'Artist not found', 3),
+            ('/artists/0/tracks/', 'Artist not found', 3),
+            ('/albums/0/tracks/', 'Album not found', 3),
+            (f'/artists/{self.other_artist.pk}/albums/{self.album.pk}/tracks/', 'Album not found', 3),
+        ]:
+            with self.subTest(url=url), self.assertNumQueries(queries):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.data['detail'], detail)
+        self.assertEqual(self.client.get(f'/artists/{self.other_artist.pk}/albums/').data, [])
+
+    def test_writes_load_parent_once(self):
+        self.client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(f'/albums/{self.album.pk}/tracks/', [{'name': 'new 1'}, {'name': 'new 2'}],
+                                        format='json')
+        self.assertEqual(response.status_code, 201)
+        album_queries = [query['sql'] for query in context.captured_queries
+                         if query['sql'].startswith('SELECT "api_album"."id", "api_album"."name"')]
+        self.assertEqual(len(album_queries), 1, album_queries)
+        with self.assertNumQueries(1):
+            response = self.client.post('/artists/0/albums/', {'name': 'album', 'year': 2000}, format='json')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(API_CACHE_ENABLED=False)
+class SparseFieldsTest(TestCase):
+    """ ?fields= and ?expand= change output and drop joins and prefetches of relations left out of it """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.artist = Artist.objects.create(name='artist')
+        cls.album = Album.objects.create(name='album', artist=cls.artist, year=2000)
+        for order in (1, 2):
+            track = Track.objects.create(name=f'track {order}', artist=cls.artist)
+            AlbumTrack.objects.create(album=cls.album, track=track, order=order)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json(), [query['sql'] for query in context.captured_queries]
+
+    def test_trimmed_output_drops_relations(self):
+        for url, keys, absent in [
+            ('/tracks/?fields=id,name', ['id', 'name'], ['JOIN', 'api_albumtrack']),
+            (f'/artists/{self.artist.pk}/tracks/?fields=id', ['id'], ['JOIN', 'api_albumtrack']),
+            ('/albums/?fields=id,name', ['id', 'name'], ['JOIN', 'api_albumtrack']),
+            (f'/albums/{self.album.pk}/?fields=name,year', ['name', 'year'], ['JOIN', 'api_albumtrack']),
+            (f'/albums/{self.album.pk}/tracks/?fields=order,id', ['order', 'id'], ['api_track"']),
+        ]:
+            with self.subTest(url=url):
+                data, queries = self.get(url)
+                item = data['results'][0] if isinstance(data, dict) and 'results' in data else \
+                    data[0] if isinstance(data, list) else data
+                self.assertEqual(list(item), keys)
+                self.assertFalse([sql for sql in queries for part in absent if part in sql], queries)
+
+    def test_expand(self):
+        data, queries = self.get('/albums/?expand=tracks')
+        self.assertEqual([track['id'] for track in data['results'][0]['tracks']],
+                         list(AlbumTrack.objects.order_by('order').values_list('track_id', flat=True)))
+        default, default_queries = self.get('/albums/')
+        self.assertNotIn('tracks', default['results'][0])
+        self.assertEqual(len(queries), len(default_queries) + 1)
+
+    def test_unknown_fields(self):
+        for url in ['/artists/?fields=id,bogus', '/albums/?expand=name']:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 400)
+
+
+class SparseFieldsCacheTest(TestCase):
+    """ Expanded relations are invalidated with the response cache on """
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('user'))
+        artist = Artist.objects.create(name='artist')
+        album = Album.objects.create(name='album', artist=artist, year=2000)
+        self.track = Track.objects.create(name='track', artist=artist)
+        AlbumTrack.objects.create(album=album, track=self.track, order=1)
+
+    def test_track_rename(self):
+        url = '/albums/?expand=tracks'
+        self.client.get(url)
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/tracks/{self.track.pk}/', {'name': 'renamed'}, format='json')
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['results'][0]['tracks'][0]['name'], 'renamed')
+
+
+@override_settings(API_CACHE_ENABLED=False)
+class FastListSerializerTest(TestCase):
+    """ Fast list serializers render the same as model serializers of their viewsets """
+
+    def setUp(self):
+        self.client = APIClient()
+        artists = [Artist.objects.create(name=f'artist {i}') for i in range(3)]
+        albums = [Album.objects.create(name=f'album {i}', artist=artists[i % 2], year=2000 + i) for i in range(4)]
+        tracks = [Track.objects.create(name=f'track {i}', artist=artists[i % 2]) for i in range(6)]
+        # a track on two albums and twice on one, a track and an album without each other
+        for album, track in [(0, 0), (0, 1), (1, 0), (1, 2), (1, 0), (2, 3), (2, 4)]:
+            AlbumTrack.objects.create(album=albums[album], track=tracks[track], order=1)
+
+    def test_lists(self):
+        for url in ['/artists/', '/artists/?name=artist 1', '/albums/', '/albums/?year=2001', '/tracks/',
+                    '/tracks/?page=2', '/tracks/?artist__name=artist 0']:
+            with self.subTest(url=url):
+                with override_settings(API_FAST_LIST_SERIALIZERS=False):
+                    expected = self.client.get(url).json()
+                with override_settings(API_FAST_LIST_SERIALIZERS=True):
+                    self.assertEqual(self.client.get(url).json(), expected)
+
+    def test_export(self):
+        """ Export of albums has tracklists as ?expand=tracks shows them """
+        for resource, url in [('artists', '/artists/'), ('albums', '/albums/?expand=tracks'), ('tracks', '/tracks/')]:
+            with self.subTest(resource=resource):
+                response = self.client.get(f'/export/{resource}.ndjson')
+                exported = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+                expected = sorted(self.client.get(url).json()['results'], key=lambda item: item['id'])
+                self.assertEqual(exported, expected)
+
+
+@override_settings(API_CACHE_ENABLED=False)
+class BatchRetrieveTest(TestCase):
+    """ batch/ action keeps order of ids, reports missing ones and answers in retrieve shape """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.artist = Artist.objects.create(name='artist')
+        cls.tracks = [Track.objects.create(name=f'track {i}', artist=cls.artist) for i in range(3)]
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_order_and_missing(self):
+        ids = [self.tracks[2].pk, 0, self.tracks[0].pk]
+        for response in [self.client.get(f'/tracks/batch/?ids={",".join(map(str, ids))}'),
+                         self.client.post('/tracks/batch/', {'ids': ids}, format='json')]:
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertEqual(data['results'][0], self.client.get(f'/tracks/{ids[0]}/').json())
+            self.assertEqual([item and item['id'] for item in data['results']], [ids[0], None, ids[2]])
+            self.assertEqual(data['missing'], [0])
+
+    def test_invalid_ids(self):
+        with override_settings(API_BATCH_MAX_IDS=2):
+            for query in ['', '?ids=', '?ids=1,x', '?ids=1,2,3']:
+                with self.subTest(query=query):
+                    self.assertEqual(self.client.get(f'/tracks/batch/{query}').status_code, 400)
+
+
+@override_settings(API_CACHE_ENABLED=False)
+class KeysetPaginationTest(TestCase):
+    """ ?cursor= walks lists by id without COUNT and OFFSET, every page costs the same """
+
+    @classmethod
+    def setUpTestData(cls):
+        artists = Artist.objects.bulk_create(Artist(name=f'artist {i}') for i in range(2))
+        cls.tracks = Track.objects.bulk_create(Track(name=f'track {i}', artist=artists[i % 2]) for i in range(450))
+
+    def walk(self, url):
+        """ Ids of every page following 'next' and queries per page """
+        ids, counts = [], []
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                data = self.client.get(url).json()
+            self.assertNotIn('count', data)
+            self.assertFalse(any('COUNT(' in query['sql'] or 'OFFSET' in query['sql']
+                                 for query in context.captured_queries))
+            ids += [item['id'] for item in data['results']]
+            counts.append(len(context.captured_queries))
+            url = data['next']
+        return ids, counts
+
+    def test_walk(self):
+        for fast in (False, True):
+            with self.subTest(fast=fast), override_settings(API_FAST_LIST_SERIALIZERS=fast):
+                ids, counts = self.walk('/tracks/?cursor=')
+                self.assertEqual(ids, sorted((track.pk for track in self.tracks), reverse=True))
+                self.assertEqual(len(counts), 3)
+                self.assertEqual(len(set(counts)), 1)
+                ids, _ = self.walk('/tracks/?cursor=&artist__name=artist 1')
+                self.assertEqual(ids, sorted((track.pk for track in self.tracks[1::2]), reverse=True))
+
+    def test_previous(self):
+        first = self.client.get('/tracks/?cursor=').json()
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).json()
+        self.assertEqual(self.client.get(second['previous']).json()['results'], first['results'])
+        self.assertEqual(self.client.get('/tracks/', {'cursor': 'nonsense'}).status_code, 404)
+        # page numbers still work without cursor
+        self.assertEqual(self.client.get('/tracks/?page=3').json()['count'], 450)
+
+
+@override_settings(API_CACHE_ENABLED=False)
+class BulkCreateTest(TestCase):
+    """ List payloads are validated together and inserted by bulk_create with constant queries, responses
+        are shaped as single creates """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('user'))
+        self.artist = Artist.objects.create(name='artist')
+
+    def post(self, url, payload):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(url, payload, format='json')
+        return response, len(context.captured_queries)
+
+    def test_create(self):
+        for url, item in [('/artists/', {}), ('/tracks/', {'artist_id': self.artist.pk}),
+                          ('/albums/', {'artist_id': self.artist.pk, 'year': 2000}),
+                          (f'/artists/{self.artist.pk}/tracks/', {}),
+                          (f'/artists/{self.artist.pk}/albums/', {'year': 2001})]:
+            with self.subTest(url=url):
+                counts = []
+                for size in (2, 10):
+                    payload = [{'name': f'{url} {size} {i}', **item} for i in range(size)]
+                    response, queries = self.post(url, payload)
+                    self.assertEqual(response.status_code, 201, response.content)
+                    counts.append(queries)
+                    single = self.client.post(url, {'name': f'{url} {size} single', **item}, format='json').json()
+                    self.assertEqual([item.keys() for item in response.json()], [single.keys()] * size)
+                    self.assertEqual([item['name'] for item in response.json()], [item['name'] for item in payload])
+                self.assertEqual(counts[0], counts[1])
+        artist = Artist.objects.get(pk=self.artist.pk)
+        self.assertEqual((artist.tracks_count, artist.albums_count), (28, 28))
+        self.assertEqual(recount_artists() + recount_albums(), 0)
+        self.assertEqual(self.client.get('/search/', {'q': '/tracks/ 10 9'}).json()['results'][0]['type'], 'track')
+
+    def test_album_tracks(self):
+        album = Album.objects.create(name='album', artist=self.artist, year=2000)
+        url = f'/albums/{album.pk}/tracks/'
+        self.post(url, [{'name': 'first'}, {'name': 'last'}])
+        existing = Track.objects.create(name='existing', artist=self.artist)
+        response, _ = self.post(url, [{'name': 'new', 'order': 2}, {'id': existing.pk, 'order': 3}])
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual([(item['order'], item['name']) for item in response.json()], [(2, 'new'), (3, 'existing')])
+        self.assertEqual([item['name'] for item in self.client.get(url).json()], ['first', 'new', 'existing', 'last'])
+        self.assertEqual(Album.objects.get(pk=album.pk).tracks_count, 4)
+        # scattered orders go one by one, each moving the following tracks
+        response, _ = self.post(url, [{'name': 'one', 'order': 1}, {'name': 'five', 'order': 5}])
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual([item['name'] for item in self.client.get(url).json()],
+                         ['one', 'first', 'new', 'existing', 'five', 'last'])
+
+    def test_empty(self):
+        album = Album.objects.create(name='album', artist=self.artist, year=2000)
+        for url in ('/artists/', '/tracks/', f'/albums/{album.pk}/tracks/'):
+            with self.subTest(url=url):
+                response, _ = self.post(url, [])
+                self.assertEqual(response.status_code, 201, response.content)
+                self.assertEqual(response.json(), [])
+
+    def test_invalid(self):
+        """ Nothing is created when any item is invalid, errors keep per-item structure """
+        response, _ = self.post('/artists/', [{'name': 'new'}, {'name': 'artist'}, {'name': 'new'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([bool(errors) for errors in response.json()], [False, True, True])
+        response, _ = self.post('/tracks/', [{'name': 'track', 'artist_id': self.artist.pk},
+                                             {'name': 'track', 'artist_id': 0}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), [{}, {'artist_id': ['Artist not found']}])
+        self.assertEqual((Artist.objects.count(), Track.objects.count()), (1, 0))
+
+
+@override_settings(API_CACHE_ENABLED=False)
+class AlbumTrackValidationTest(TestCase):
+    """ Album track batches are validated with constant queries: the album is loaded once and referenced
+        tracks are resolved together, they must belong to the album artist """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('user'))
+        artist, other = Artist.objects.create(name='artist'), Artist.objects.create(name='other')
+        self.album = Album.objects.create(name='album', artist=artist, year=2000)
+        self.url = f'/albums/{self.album.pk}/tracks/'
+        self.tracks = Track.objects.bulk_create(Track(name=f'track {i}', artist=artist) for i in range(20))
+        self.foreign = Track.objects.create(name='foreign', artist=other)
+
+    def test_queries(self):
+        """ Attaching 2 and 10 existing tracks takes the same number of queries """
+        counts = []
+        for tracks in (self.tracks[:2], self.tracks[2:12]):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post(self.url, [{'id': track.pk} for track in tracks], format='json')
+            self.assertEqual(response.status_code, 201, response.content)
+            counts.append(len(context.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(Album.objects.get(pk=self.album.pk).tracks_count, 12)
+
+    def test_invalid(self):
+        payload = [{'id': self.tracks[0].pk}, {'id': self.foreign.pk}, {'id': 0}, {'name': 'new'},
+                   {'id': self.tracks[1].pk, 'name': 'both'}, {}]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertLessEqual(len(context.captured_queries), 3)
+        errors = response.json()
+        self.assertEqual(len(errors), len(payload))
+        self.assertEqual([bool(item) for item in errors], [False, True, True, False, True, True])
+        self.assertIn('id: Track Not Found', str(errors[1]))
+        self.assertFalse(AlbumTrack.objects.exists())
+        self.assertEqual(self.client.post('/albums/0/tracks/', [{'name': 'new'}], format='json').status_code, 404)
+
+
+@override_settings(API_CACHE_ENABLED=False)
+class DenseOrderingTest(TestCase):
+    """ Inserts and deletes shift following tracks by set-based statements, whatever album size is """
+
+    @classmethod
+    def setUpTestData(cls):
+        artist = Artist.objects.create(name='artist')
+        cls.albums = [Album.objects.create(name=f'album {size}', artist=artist, year=2000) for size in (5, 40)]
+        for album in cls.albums:
+            tracks = Track.objects.bulk_create(Track(name=f'track {order}', artist=artist)
+                                               for order in range(1, int(album.name.split()[-1]) + 1))
+            AlbumTrack.objects.bulk_create(AlbumTrack(album=album, track=track, order=order)
+                                           for order, track in enumerate(tracks, start=1))
+        recount_albums()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('user'))
+
+    def orders(self, album):
+        return list(AlbumTrack.objects.filter(album=album).order_by('order').values_list('order', 'track__name'))
+
+    def test_insert_delete(self):
+        counts = {}
+        for album in self.albums:
+            url, size = f'/albums/{album.pk}/tracks/', int(album.name.split()[-1])
+            with CaptureQueriesContext(connection) as insert:
+                response = self.client.post(url, {'name': 'new', 'order': 2}, format='json')
+            self.assertEqual(response.status_code, 201, response.content)
+            orders = self.orders(album)
+            self.assertEqual([order for order, _ in orders], list(range(1, size + 2)))
+            self.assertEqual([name for _, name in orders[:3]], ['track 1', 'new', 'track 2'])
+            with CaptureQueriesContext(connection) as delete:
+                self.assertEqual(self.client.delete(f'{url}1/').status_code, 204)
+            orders = self.orders(album)
+            self.assertEqual([order for order, _ in orders], list(range(1, size + 1)))
+            self.assertEqual(orders[0][1], 'new')
+            counts[size] = len(insert.captured_queries), len(delete.captured_queries)
+        self.assertEqual(counts[5], counts[40])
+
+    def test_compact(self):
+        """ Gaps left by rows deleted without release() are closed once per album """
+        for album in self.albums:
+            rows = AlbumTrack.objects.filter(album=album, order__in=[1, 3])
+            raw_delete(AlbumTrack, list(rows.values_list('pk', flat=True)))
+        with CaptureQueriesContext(connection) as context:
+            DenseOrdering().compact([album.pk for album in self.albums])
+        # read, update of moved rows, flip of their sign
+        self.assertEqual(len(context.captured_queries), 3)
+        for album in self.albums:
+            size = int(album.name.split()[-1])
+            self.assertEqual([order for order, _ in self.orders(album)], list(range(1, size - 1)))
+            self.assertEqual([name for _, name in self.orders(album)[:2]], ['track 2', 'track 4'])
+
+
+@override_settings(API_CACHE_ENABLED=False, ALBUM_TRACK_ORDERING='gapped', ALBUM_TRACK_ORDER_GAP=4)
+class GappedOrderingTest(TestCase):
+    """ Gapped ordering writes only the inserted row while neighbours have free ranks between them, and nothing
+        on delete. API shows positions 1..N """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('user'))
+        artist = Artist.objects.create(name='artist')
+        self.album = Album.objects.create(name='album', artist=artist, year=2000)
+        self.url = f'/albums/{self.album.pk}/tracks/'
+        for order in range(1, 4):
+            self.client.post(self.url, {'name': f'track {order}'}, format='json')
+
+    def ranks(self):
+        return dict(AlbumTrack.objects.filter(album=self.album).values_list('track__name', 'order'))
+
+    def names(self):
+        tracks = self.client.get(self.url).json()
+        self.assertEqual([item['order'] for item in tracks], list(range(1, len(tracks) + 1)))
+        return [item['name'] for item in tracks]
+
+    def test_insert_delete(self):
+        self.assertEqual(self.ranks(), {'track 1': 4, 'track 2': 8, 'track 3': 12})
+        self.client.post(self.url, {'name': 'new', 'order': 2}, format='json')
+        ranks = self.ranks()
+        self.assertEqual(self.names(), ['track 1', 'new', 'track 2', 'track 3'])
+        self.assertEqual({name: rank for name, rank in ranks.items() if name != 'new'},
+                         {'track 1': 4, 'track 2': 8, 'track 3': 12})
+        self.assertEqual(self.client.get(f'{self.url}2/').json()['name'], 'new')
+        self.assertEqual(self.client.delete(f'{self.url}1/').status_code, 204)
+        self.assertEqual(self.names(), ['new', 'track 2', 'track 3'])
+        self.assertEqual(self.ranks(), {name: rank for name, rank in ranks.items() if name != 'track 1'})
+        self.assertEqual(Album.objects.get(pk=self.album.pk).tracks_count, 3)
+
+    def test_rebalance(self):
+        """ Album is renumbered when there is no free rank left between neighbours """
+        for i in range(3):
+            self.client.post(self.url, {'name': f'new {i}', 'order': 2}, format='json')
+        self.assertEqual(self.names(), ['track 1', 'new 2', 'new 1', 'new 0', 'track 2', 'track 3'])
+        ranks = sorted(self.ranks().values())
+        self.assertEqual(len(set(ranks)), 6)
+        call_command('rebalance_album_tracks', self.album.pk, stdout=StringIO())
+        self.assertEqual(sorted(self.ranks().values()), [4, 8, 12, 16, 20, 24])
+        self.assertEqual(self.names(), ['track 1', 'new 2', 'new 1', 'new 0', 'track 2', 'track 3'])
+        self.assertIsInstance(get_album_ordering(), GappedOrdering)
+
+
+@override_settings(API_CACHE_ENABLED=False)
+class AlbumTrackReorderTest(TestCase):
+    """ PUT tracks/order/ and POST tracks/move/ renumber the tracklist at once, with both ordering strategies """
+
+    @classmethod
+    def setUpTestData(cls):
+        artist = Artist.objects.create(name='artist')
+        cls.album = Album.objects.create(name='album', artist=artist, year=2000)
+        for order in range(1, 6):
+            track = Track.objects.create(name=f'track {order}', artist=artist)
+            AlbumTrack.objects.create(album=cls.album, track=track, order=order)
+        recount_albums()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('user'))
+
+    def names(self, response):
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual([item['order'] for item in response.json()], [1, 2, 3, 4, 5])
+        self.assertEqual(response.json(), self.client.get(f'/albums/{self.album.pk}/tracks/').json())
+        return [int(item['name'].split()[-1]) for item in response.json()]
+
+    def test_reorder(self):
+        url = f'/albums/{self.album.pk}/tracks/'
+        for ordering in ('dense', 'gapped'):
+            with self.subTest(ordering=ordering), override_settings(ALBUM_TRACK_ORDERING=ordering):
+                call_command('rebalance_album_tracks', self.album.pk, stdout=StringIO())
+                etag = self.client.get(url)['ETag']
+                self.assertEqual(self.names(self.client.put(f'{url}order/', {'order': [5, 4, 3, 2, 1]},
+                                                            format='json')), [5, 4, 3, 2, 1])
+                self.assertNotEqual(self.client.get(url)['ETag'], etag)
+                self.assertEqual(self.names(self.client.post(f'{url}move/', {'from': 1, 'to': 5}, format='json')),
+                                 [4, 3, 2, 1, 5])
+                moves = [{'from': 5, 'to': 1}, {'from': 2, 'to': 3}]
+                self.assertEqual(self.names(self.client.post(f'{url}move/', moves, format='json')), [5, 3, 4, 2, 1])
+                self.assertEqual(self.names(self.client.put(f'{url}order/', {'order': [5, 4, 2, 3, 1]},
+                                                            format='json')), [1, 2, 3, 4, 5])
+
+    def test_invalid(self):
+        url = f'/albums/{self.album.pk}/tracks/'
+        for method, path, payload in [('put', 'order/', {'order': [1, 2, 3]}), ('put', 'order/', {'order': [1] * 5}),
+                                      ('put', 'order/', {}), ('post', 'move/', {'from': 6, 'to': 1}),
+                                      ('post', 'move/', [{'from': 1, 'to': 2}, {'from': 1, 'to': 0}])]:
+            with self.subTest(method=method, payload=payload):
+                response = getattr(self.client, method)(f'{url}{path}', payload, format='json')
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.put('/albums/0/tracks/order/', {'order': []}, format='json').status_code, 404)
+        self.assertEqual(self.client.put(f'{url}1/', {'name': 'x'}, format='json').status_code, 405)
+        self.assertEqual(self.names(self.client.get(url)), [1, 2, 3, 4, 5])
+
+
+@override_settings(API_CACHE_ENABLED=False)
+class TracklistSnapshotTest(TestCase):
+    """ Album retrieve serves tracklist snapshot, it follows every change of album tracks and track names """
+
+    @classmethod
+    def setUpTestData(cls):
+        artist = Artist.objects.create(name='artist')
+        cls.albums = [Album.objects.create(name=f'album {i}', artist=artist, year=2000) for i in range(2)]
+        for order in range(1, 5):
+            track = Track.objects.create(name=f'track {order}', artist=artist)
+            AlbumTrack.objects.create(album=cls.albums[0], track=track, order=order)
+        AlbumTrack.objects.create(album=cls.albums[1], track=track, order=1)
+        recount_albums()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('user'))
+
+    def assertSnapshots(self):
+        for album in self.albums:
+            tracks = self.client.get(f'/albums/{album.pk}/tracks/').json()
+            self.assertEqual(AlbumTracklist.objects.get(album=album).tracks, tracks)
+            self.assertEqual(self.client.get(f'/albums/{album.pk}/').json()['tracks'], tracks)
+
+    def test_changes(self):
+        url = f'/albums/{self.albums[0].pk}/tracks/'
+        for ordering in ('dense', 'gapped'):
+            with self.subTest(ordering=ordering), override_settings(ALBUM_TRACK_ORDERING=ordering):
+                call_command('rebalance_album_tracks', stdout=StringIO())
+                self.assertEqual(self.client.post(url, {'name': 'new', 'order': 2}, format='json').status_code, 201)
+                self.assertSnapshots()
+                self.assertEqual(self.client.delete(f'{url}1/').status_code, 204)
+                self.assertSnapshots()
+                self.client.post(f'{url}move/', {'from': 1, 'to': 4}, format='json')
+                self.assertSnapshots()
+                # track on both albums
+                track_id = self.client.get(url).json()[0]['id']
+                response = self.client.post(f'/albums/{self.albums[1].pk}/tracks/', {'id': track_id}, format='json')
+                self.assertEqual(response.status_code, 201)
+                self.client.patch(f'/tracks/{track_id}/', {'name': f'renamed {ordering}'}, format='json')
+                self.assertSnapshots()
+                self.client.post('/tracks/bulk-delete/', {'ids': [track_id]}, format='json')
+                self.assertSnapshots()
+                self.assertEqual(self.client.delete(f'/tracks/{Track.objects.last().pk}/').status_code, 204)
+                self.assertSnapshots()
+
+    def test_queryset_deletes(self):
+        """ Cascades of queryset deletes don't rebuild snapshots of albums they delete """
+        other = Album.objects.create(name='other', artist=Artist.objects.create(name='other'), year=2000)
+        AlbumTrack.objects.create(album=other, track=Track.objects.create(name='other', artist=other.artist), order=1)
+        Album.objects.filter(pk=self.albums[1].pk).delete()
+        self.albums = self.albums[:1]
+        self.assertSnapshots()
+        Artist.objects.filter(pk=self.albums[0].artist_id).delete()
+        self.assertEqual(list(AlbumTracklist.objects.values_list('album', flat=True)), [other.pk])
+        self.assertEqual(Album.objects.get().tracks_count, 1)
+
+    def test_turned_off(self):
+        url = f'/albums/{self.albums[0].pk}/'
+        with override_settings(API_TRACKLIST_SNAPSHOTS=0):
+            self.client.post(f'{url}tracks/', {'name': 'new'}, format='json')
+            self.assertFalse(AlbumTracklist.objects.filter(album=self.albums[0]).exists())
+            self.assertEqual(len(self.client.get(url).json()['tracks']), 5)
+        # albums without snapshot are served from their tracks until it is rebuilt
+        with self.assertNumQueries(3):
+            self.assertEqual([item['name'] for item in self.client.get(url).json()['tracks']][-1], 'new')
+        call_command('rebuild_tracklists', self.albums[0].pk, 0, stdout=StringIO())
+        self.assertSnapshots()
+
+
+@override_settings(API_CACHE_ENABLED=False)
+class RawDeleteTest(TestCase):
+    """ raw_delete relies on private QuerySet._raw_delete(using): one DELETE, no signals, nothing collected.
+        Fails when a Django release changes it """
+
+    def setUp(self):
+        artist = Artist.objects.create(name='artist')
+        self.tracks = Track.objects.bulk_create(Track(name=f'track {i}', artist=artist) for i in range(3))
+
+    def test_private_api(self):
+        self.assertEqual(list(inspect.signature(QuerySet._raw_delete).parameters), ['self', 'using'])
+        receiver = mock.Mock()
+        post_delete.connect(receiver, sender=Track)
+        self.addCleanup(post_delete.disconnect, receiver, sender=Track)
+        with CaptureQueriesContext(connection) as context:
+            raw_delete(Track, [track.pk for track in self.tracks[:2]])
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertTrue(context.captured_queries[0]['sql'].startswith('DELETE'))
+        self.assertFalse(receiver.called)
+        self.assertEqual(list(Track.objects.values_list('pk', flat=True)), [self.tracks[2].pk])
+
+    def test_unchecked_version(self):
+        with mock.patch('api.deletion.django.VERSION', (99, 0, 0, 'final', 0)):
+            with self.assertRaises(ImproperlyConfigured):
+                raw_delete(Track, [self.tracks[0].pk])
+        self.assertEqual(Track.objects.count(), 3)
+
+
+class BulkDeleteTest(TestCase):
+    """ POST tracks/bulk-delete/ removes tracks by ids or filter, albums keep 1..N order and counters """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.artist = Artist.objects.create(name='artist')
+        cls.albums = [Album.objects.create(name=f'album {i}', artist=cls.artist, year=2000) for i in range(2)]
+        cls.tracks = [Track.objects.create(name=f'song {i}', artist=cls.artist) for i in range(6)]
+        for album in cls.albums:
+            for order, track in enumerate(cls.tracks, start=1):
+                AlbumTrack.objects.create(album=album, track=track, order=order)
+        recount_artists()
+        recount_albums()
+        get_search_backend().rebuild()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('user'))
+
+    def tracklist(self, album):
+        """ Track numbers of the album in order, checks order is 1..N and tracks_count """
+        rows = list(AlbumTrack.objects.filter(album=album).order_by('order').values_list('order', 'track__name'))
+        self.assertEqual([order for order, _ in rows], list(range(1, len(rows) + 1)))
+        self.assertEqual(Album.objects.get(pk=album.pk).tracks_count, len(rows))
+        return [int(name.split()[-1]) for _, name in rows]
+
+    def test_delete_by_ids(self):
+        ids = [self.tracks[1].pk, self.tracks[4].pk, 0]
+        response = self.client.post('/tracks/bulk-delete/', {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json(), {'deleted': 2})
+        for album in self.albums:
+            self.assertEqual(self.tracklist(album), [0, 2, 3, 5])
+        self.assertEqual(Artist.objects.get(pk=self.artist.pk).tracks_count, 4)
+        self.assertEqual(Tombstone.objects.filter(kind='track').count(), 2)
+        found = {item['id'] for item in self.client.get('/search/?q=song').json()['results']
+                 if item['type'] == 'track'}
+        self.assertEqual(found, {track.pk for track in self.tracks} - set(ids))
+
+    def test_delete_by_filter(self):
+        Track.objects.filter(pk=self.tracks[2].pk).update(name='song x')
+        response = self.client.post('/tracks/bulk-delete/?name=song x', format='json')
+        self.assertEqual(response.json(), {'deleted': 1})
+        self.assertEqual(self.tracklist(self.albums[0]), [0, 1, 3, 4, 5])
+
+    def test_album_tracks(self):
+        url = f'/albums/{self.albums[0].pk}/tracks/bulk-delete/'
+        response = self.client.post(url, {'ids': [self.tracks[0].pk, self.tracks[5].pk]}, format='json')
+        self.assertEqual(response.json(), {'deleted': 2})
+        self.assertEqual(self.tracklist(self.albums[0]), [1, 2, 3, 4])
+        self.assertEqual(self.tracklist(self.albums[1]), [0, 1, 2, 3, 4, 5])
+        self.assertEqual(Track.objects.count(), 6)
+
+    def test_destroy(self):
+        """ DELETE of a single track, album or artist goes through the same statements, with everything
+            bulk_deleted receivers keep """
+        album, other = self.albums
+        self.assertEqual(self.client.delete(f'/tracks/{self.tracks[3].pk}/').status_code, 204)
+        for item in self.albums:
+            self.assertEqual(self.tracklist(item), [0, 1, 2, 4, 5])
+        self.assertEqual(AlbumTracklist.objects.get(album=other).tracks,
+                         self.client.get(f'/albums/{other.pk}/tracks/').json())
+        self.assertEqual(self.client.delete(f'/albums/{album.pk}/').status_code, 204)
+        self.assertEqual(self.tracklist(other), [0, 1, 2, 4, 5])
+        self.assertFalse(AlbumTracklist.objects.filter(album=album).exists())
+        self.assertEqual(recount_artists() + recount_albums(), 0)
+        self.assertEqual(self.client.delete(f'/artists/{self.artist.pk}/').status_code, 204)
+        for model in (Album, Track, AlbumTrack, AlbumTracklist):
+            self.assertFalse(model.objects.exists())
+        self.assertEqual(Counter(Tombstone.objects.values_list('kind', flat=True)),
+                         {'track': 6, 'album': 2, 'artist': 1})
+        self.assertEqual(self.client.get('/search/?q=song').json()['results'], [])
+        self.assertEqual(self.client.delete(f'/tracks/{self.tracks[0].pk}/').status_code, 404)
+
+    def test_destroy_concurrent(self):
+        """ Row deleted by another request after it was read answers 404 """
+        with mock.patch('api.views.album.delete_albums', return_value=0):
+            self.assertEqual(self.client.delete(f'/albums/{self.albums[0].pk}/').status_code, 404)
+
+    def test_invalid(self):
+        for payload in [{}, {'ids': []}, {'ids': ['x']}, {'ids': 1}]:
+            with self.subTest(payload=payload):
+                self.assertEqual(self.client.post('/tracks/bulk-delete/', payload, format='json').status_code, 400)
+        with override_settings(API_BULK_DELETE_MAX_IDS=2):
+            response = self.client.post('/tracks/bulk-delete/', {'ids': [1, 2, 3]}, format='json')
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post('/albums/0/tracks/bulk-delete/', {'ids': [1]}, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Track.objects.count(), 6)
+
+    def test_invalid_filter(self):
+        # empty values are ignored by filters, they must not delete the whole table
+        for query in ['?name=', '?name=%20', '?artist__name=&name=', '?unknown=1']:
+            with self.subTest(query=query):
+                self.assertEqual(self.client.post(f'/tracks/bulk-delete/{query}', format='json').status_code, 400)
+        with override_settings(API_BULK_DELETE_MAX_IDS=5):
+            response = self.client.post('/tracks/bulk-delete/?artist__name=artist', format='json')
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(Track.objects.count(), 6)
+        with override_settings(API_BULK_DELETE_MAX_IDS=6):
+            response = self.client.post('/tracks/bulk-delete/?artist__name=artist', format='json')
+            self.assertEqual(response.json(), {'deleted': 6})
+
+
+@override_settings(API_CACHE_ENABLED=False, API_CHANGES_LAG_SECONDS=0)
+class ChangesFeedTest(TestCase):
+    """ /changes/ returns every change once in keyset order, including cascade deletes """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('user'))
+
+    def read(self, since=None, limit=2):
+        """ Follows the feed while it has more, returns (type, id, deleted) of changes and the last cursor """
+        changes = []
+        while True:
+            params = {'limit': limit, **({'since': since} if since else {})}
+            with CaptureQueriesContext(connection) as context:
+                data = self.client.get('/changes/', params).json()
+            # one query per source and one prefetch per live kind on the page
+            self.assertLessEqual(len(context.captured_queries), 6)
+            changes += [(item['type'], item['id'], item['deleted']) for item in data['results']]
+            since = data['next']
+            if not data['has_more']:
+                return changes, since
+
+    def test_feed(self):
+        artist = self.client.post('/artists/', {'name': 'artist'}).json()
+        other = self.client.post('/artists/', {'name': 'other'}).json()
+        track = self.client.post('/tracks/', {'name': 'track', 'artist_id': artist['id']}).json()
+        album = self.client.post('/albums/', {'name': 'album', 'year': 2000, 'artist_id': artist['id']}).json()
+        self.client.post(f'/albums/{album["id"]}/tracks/', {'id': track['id']}, format='json')
+        changes, cursor = self.read()
+        self.assertCountEqual(changes, [('artist', artist['id'], False), ('artist', other['id'], False),
+                                        ('track', track['id'], False), ('album', album['id'], False)])
+        self.assertEqual(self.read(cursor)[0], [])
+
+        self.client.patch(f'/artists/{other["id"]}/', {'name': 'renamed'})
+        changes, cursor = self.read(cursor)
+        self.assertEqual(changes, [('artist', other['id'], False)])
+
+        self.client.delete(f'/artists/{artist["id"]}/')
+        changes, cursor = self.read(cursor)
+        self.assertCountEqual(changes, [('artist', artist['id'], True), ('track', track['id'], True),
+                                        ('album', album['id'], True)])
+
+    def test_idle(self):
+        """ Pages without changes move the cursor to their end, so polling clients never get expired """
+        old = Cursor(timezone.now() - timedelta(days=settings.API_CHANGES_RETENTION_DAYS - 1), 0, 0)
+        changes, cursor = self.read(old.encode())
+        self.assertEqual(changes, [])
+        self.assertGreater(Cursor.decode(cursor).time, old.time)
+        changes, cursor = self.read(cursor)
+        self.assertEqual(changes, [])
+        artist = self.client.post('/artists/', {'name': 'artist'}).json()
+        self.assertEqual(self.read(cursor)[0], [('artist', artist['id'], False)])
+        self.assertEqual(self.read()[0], [('artist', artist['id'], False)])
+        # cursor of an empty feed sees later changes too
+        Artist.objects.all().delete()
+        Tombstone.objects.all().delete()
+        changes, cursor = self.read()
+        self.assertEqual(changes, [])
+        other = self.client.post('/artists/', {'name': 'other'}).json()
+        self.assertEqual(self.read(cursor)[0], [('artist', other['id'], False)])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/changes/', {'since': 'nonsense'}).status_code, 400)
+        expired = Cursor(timezone.now() - timedelta(days=settings.API_CHANGES_RETENTION_DAYS + 1), 0, 0)
+        self.assertEqual(self.client.get('/changes/', {'since': expired.encode()}).status_code, 410)
+
+
+@override_settings(API_CACHE_ENABLED=False)
+class ExportTest(TestCase):
+    """ /export/ streams every row by chunks, related rows are read once per chunk """
+
+    @classmethod
+    def setUpTestData(cls):
+        artists = Artist.objects.bulk_create(Artist(name=f'artist, {i}') for i in range(3))
+        cls.albums = Album.objects.bulk_create(Album(name=f'album "{i}"', artist=artists[i % 3], year=2000)
+                                               for i in range(7))
+        tracks = Track.objects.bulk_create(Track(name=f'track {i}', artist=artists[0]) for i in range(5))
+        AlbumTrack.objects.bulk_create(AlbumTrack(album=cls.albums[0], track=track, order=order)
+                                       for order, track in enumerate(tracks, start=1))
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def export(self, resource, export_format, chunk_size=2):
+        with mock.patch.object(ExportView, 'chunk_size', chunk_size), \
+                CaptureQueriesContext(connection) as context:
+            response = self.client.get(f'/export/{resource}.{export_format}')
+            self.assertTrue(response.streaming)
+            content = b''.join(response.streaming_content).decode()
+        return response, content, len(context.captured_queries)
+
+    def test_ndjson(self):
+        response, content, queries = self.export('albums', 'ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="albums.ndjson"')
+        albums = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([album['id'] for album in albums], sorted(album.pk for album in self.albums))
+        self.assertEqual([track['order'] for track in albums[0]['tracks']], [1, 2, 3, 4, 5])
+        # tracklists are read once per chunk whatever number of tracks: 4 chunks of 2 albums against 1 of 100
+        _, _, one_chunk = self.export('albums', 'ndjson', chunk_size=100)
+        self.assertEqual(queries - one_chunk, 3)
+
+    def test_csv(self):
+        response, content, _ = self.export('albums', 'csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(StringIO(content)))
+        self.assertEqual(list(rows[0]), ['id', 'name', 'year', 'artist_name', 'tracks_count', 'tracks'])
+        self.assertEqual((rows[0]['name'], rows[0]['artist_name']), ('album "0"', 'artist, 0'))
+        self.assertEqual([track['name'] for track in json.loads(rows[0]['tracks'])],
+                         [f'track {i}' for i in range(5)])
+        self.assertEqual(json.loads(rows[1]['tracks']), [])
+        for resource in ('artists', 'tracks'):
+            self.assertEqual(len(list(csv.DictReader(StringIO(self.export(resource, 'csv')[1])))),
+                             {'artists': 3, 'tracks': 5}[resource])
+        self.assertEqual(self.client.get('/export/albums.xml').status_code, 404)
+
+
+@override_settings(API_CACHE_ENABLED=False)
+class MetricsTest(TestCase):
+    """ InstrumentationMiddleware counts every request and records sampled ones, /metrics exposes them.
+        Metrics are kept per process, so tests compare them before and after requests """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('user'))
+        Artist.objects.create(name='artist')
+
+    def test_labels(self):
+        factory = RequestFactory()
+        self.assertEqual(get_view_labels(factory.get('/artists/')), ('unresolved', 'get'))
+        for path, method, labels in (('/artists/', 'get', ('ArtistViewSet', 'list')),
+                                     ('/artists/1/', 'delete', ('ArtistViewSet', 'destroy')),
+                                     ('/metrics', 'get', ('MetricsView', 'get'))):
+            with self.subTest(path=path):
+                response = getattr(self.client, method)(path)
+                self.assertEqual(get_view_labels(response.wsgi_request), labels)
+
+    def test_requests(self):
+        key = ('ArtistViewSet', 'list', 'GET', 200)
+        total = metrics.requests_total.values.get(key, 0)
+        count = metrics.request_duration.values.get(key[:2], [0])[-1]
+        with override_settings(API_METRICS_SAMPLE_RATE=0):
+            self.client.get('/artists/')
+        self.assertEqual(metrics.requests_total.values[key], total + 1)
+        self.assertEqual(metrics.request_duration.values.get(key[:2], [0])[-1], count)
+        with override_settings(API_METRICS_SAMPLE_RATE=1):
+            self.client.get('/artists/')
+        self.assertEqual(metrics.requests_total.values[key], total + 2)
+        for histogram in metrics.HISTOGRAMS:
+            with self.subTest(histogram=histogram.name):
+                self.assertEqual(histogram.values.get(key[:2], [0])[-1], count + 1)
+        missing = ('ArtistViewSet', 'retrieve', 'GET', 404)
+        self.client.get('/artists/0/')
+        self.assertGreaterEqual(metrics.requests_total.values[missing], 1)
+
+    def test_slow_queries(self):
+        labels = ('ArtistViewSet', 'list')
+        slow = metrics.slow_queries_total.values.get(labels, 0)
+        self.client.get('/artists/')
+        self.assertEqual(metrics.slow_queries_total.values.get(labels, 0), slow)
+        with override_settings(API_SLOW_QUERY_MS=0), self.assertLogs('api.middleware', 'WARNING'):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get('/artists/')
+        self.assertEqual(metrics.slow_queries_total.values[labels], slow + len(queries))
+
+    def test_expose(self):
+        with override_settings(API_METRICS_SAMPLE_RATE=1):
+            self.client.get('/artists/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        key = ('ArtistViewSet', 'list', 'GET', 200)
+        self.assertIn('api_requests_total{view="ArtistViewSet",action="list",method="GET",status="200"} '
+                      f'{metrics.requests_total.values[key]}\n', text)
+        count = metrics.request_duration.values[key[:2]][-1]
+        self.assertIn(f'api_request_duration_seconds_bucket{{view="ArtistViewSet",action="list",le="+Inf"}} {count}\n',
+                      text)
+        self.assertIn(f'api_request_duration_seconds_count{{view="ArtistViewSet",action="list"}} {count}\n', text)
+        for name in ('api_slow_queries_total', 'api_cache_hits_total', 'api_cache_misses_total'):
+            self.assertIn(f'# TYPE {name} counter\n', text)
+
+
+@override_settings(API_CACHE_ENABLED=False)
+class SearchTest(TestCase):
+    """ /search/ matches words of names as prefixes across kinds, the index follows every write """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('user'))
+        self.artist = Artist.objects.create(name='Blue Band')
+        self.album = Album.objects.create(name='Blues Collection', artist=self.artist, year=2000)
+        self.track = Track.objects.create(name='Blue Moon', artist=self.artist)
+
+    def search(self, q, **params):
+        response = self.client.get('/search/', {'q': q, **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [(item['type'], item['id']) for item in response.json()['results']]
+
+    def test_search(self):
+        self.assertEqual(set(self.search('blu')), {('artist', self.artist.pk), ('album', self.album.pk),
+                                                   ('track', self.track.pk)})
+        # whole word ranks above the longer word it is a prefix of
+        self.assertEqual(self.search('blue')[-1], ('album', self.album.pk))
+        self.assertEqual(self.search('BLUE moo'), [('track', self.track.pk)])
+        self.assertEqual(self.search('blue nothing'), [])
+        self.assertEqual(len(self.search('blu', limit=2)), 2)
+        for params in ({}, {'q': ' ,. '}, {'q': 'blue', 'limit': 'x'}, {'q': 'blue', 'limit': 0}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/search/', params).status_code, 400)
+
+    def test_postgres_query(self):
+        """ PostgreSQL orders a union by its output columns only, expressions there are rejected """
+        with mock.patch('api.search.connection') as conn:
+            cursor = conn.cursor.return_value.__enter__.return_value
+            cursor.fetchall.return_value = [(3, self.track.pk, 'Blue Moon', 0.5, 9)]
+            results = PostgresSearch().search(['blue', 'moo'], 10)
+        sql, params = cursor.execute.call_args.args
+        selects = sql.split(' ORDER BY ')[0].split(' UNION ALL ')
+        self.assertEqual(len(selects), 3)
+        for select in selects:
+            columns = re.findall(r' AS (\w+)', select)
+            self.assertEqual(columns, ['kind', 'score', 'name_length'])
+        order = re.search(r' ORDER BY (.*) LIMIT %s$', sql).group(1)
+        self.assertEqual([term.split()[0] for term in order.split(', ')], ['score', 'name_length'])
+        self.assertEqual(params, ['(blue | blue:*) & (moo | moo:*)'] * 3 + [10])
+        self.assertEqual(results, [{'type': 'track', 'id': self.track.pk, 'name': 'Blue Moon', 'score': 0.5}])
+
+    def test_index_follows_writes(self):
+        self.client.patch(f'/tracks/{self.track.pk}/', {'name': 'Red Sun'}, format='json')
+        self.assertEqual(self.search('moon'), [])
+        self.assertEqual(self.search('red'), [('track', self.track.pk)])
+        created = self.client.post('/tracks/', [{'name': 'Red Sky', 'artist_id': self.artist.pk}],
+                                   format='json').json()
+        self.assertEqual(set(self.search('red')), {('track', self.track.pk), ('track', created[0]['id'])})
+        self.client.delete(f'/artists/{self.artist.pk}/')
+        self.assertEqual(self.search('blu') + self.search('red'), [])
+
+
+@override_settings(API_CACHE_ENABLED=False)
+class ImportCatalogTest(TestCase):
+    """ import_catalog upserts artists, albums and album tracks, a file imported again adds nothing """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def import_catalog(self, lines, name='catalog.csv', **options):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as file:
+            file.write(''.join(f'{line}\n' for line in ['artist,album,year,track'] + lines))
+        call_command('import_catalog', path, stdout=StringIO(), **options)
+
+    def catalog(self):
+        return sorted(AlbumTrack.objects.values_list('album__artist__name', 'album__name', 'album__year', 'order',
+                                                     'track__name'))
+
+    def test_import_twice(self):
+        lines = ['band,first,2000,one', 'band,first,2000,two', 'band,second,2001,one', 'solo,first,2002,one',
+                 'band,first,2000,one']
+        self.import_catalog(lines, chunk_size=2)
+        catalog = self.catalog()
+        self.assertEqual(catalog, [('band', 'first', 2000, 1, 'one'), ('band', 'first', 2000, 2, 'two'),
+                                   ('band', 'second', 2001, 1, 'one'), ('solo', 'first', 2002, 1, 'one')])
+        counts = [model.objects.count() for model in (Artist, Album, Track, AlbumTrack)]
+        self.import_catalog(lines, chunk_size=3)
+        self.assertEqual(self.catalog(), catalog)
+        self.assertEqual([model.objects.count() for model in (Artist, Album, Track, AlbumTrack)], counts)
+        # album year changes, new track goes to the end
+        touched = Album.objects.get(name='second').updated_at
+        self.import_catalog(['band,second,2003,two', 'band,second,2003,one'])
+        album = Album.objects.get(name='second')
+        self.assertEqual(album.year, 2003)
+        self.assertGreater(album.updated_at, touched)
+        self.assertEqual([row[-1] for row in self.catalog() if row[1] == 'second'], ['one', 'two'])
+        self.assertEqual(recount_artists() + recount_albums(), 0)
+
+
+@override_settings(API_CACHE_ENABLED=False)
+class AsyncReadViewsTest(TransactionTestCase):
+    """ Async views answer the same as viewsets. Serialization runs in pool threads with their own connections,
+        so data is committed """
+
+    def setUp(self):
+        self.artist = Artist.objects.create(name='artist')
+        self.album = Album.objects.create(name='album', artist=self.artist, year=2000)
+        for order in (1, 2):
+            track = Track.objects.create(name=f'track {order}', artist=self.artist)
+            AlbumTrack.objects.create(album=self.album, track=track, order=order)
+        recount_artists()
+        recount_albums()
+        self.client = APIClient()
+
+    def test_same_responses(self):
+        track = Track.objects.first()
+        for url in ['/artists/', '/artists/?name=artist', f'/artists/{self.artist.pk}/', '/artists/0/',
+                    '/artists/?page=2', '/albums/', '/albums/?year=x', f'/albums/{self.album.pk}/', '/tracks/',
+                    f'/tracks/{track.pk}/', f'/albums/{self.album.pk}/tracks/', f'/albums/{self.album.pk}/tracks/2/',
+                    f'/albums/{self.album.pk}/tracks/3/', '/albums/0/tracks/']:
+            with self.subTest(url=url):
+                expected, response = self.client.get(url), self.client.get(f'/async{url}')
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(response.json(), expected.json())
+
+    def test_album_prefetch(self):
+        """ Tracklists are prefetched for album retrieve only, lists don't show them """
+        for url, lookups in [('/async/albums/', []), (f'/async/albums/{self.album.pk}/', ['tracks'])]:
+            with self.subTest(url=url), mock.patch('api.views.async_read.prefetch_related_objects') as prefetch:
+                self.assertEqual(self.client.get(url).status_code, 200)
+                self.assertEqual([lookup.prefetch_through for call in prefetch.call_args_list
+                                  for lookup in call.args[1:]], lookups)
+
+    def test_metrics(self):
+        """ Under ASGI queries run in the ORM thread and in pool threads, they are measured there """
+        labels = ('AsyncAlbumView', 'get')
+        queries, duration = (metrics.sql_queries.values.get(labels, [0, 0])[-2],
+                             metrics.sql_duration.values.get(labels, [0, 0])[-2])
+
+        async def get(url):
+            return await AsyncClient().get(url)
+
+        with override_settings(API_METRICS_SAMPLE_RATE=1):
+            # album row by async ORM, its tracks prefetched in the pool
+            response = async_to_sync(get)(f'/async/albums/{self.album.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(metrics.sql_queries.values[labels][-2], queries + 2)
+        self.assertGreater(metrics.sql_duration.values[labels][-2], duration)
+
+
+@override_settings(API_READ_REPLICAS=['replica_0', 'replica_1'])
+class ReplicaRoutingTest(TransactionTestCase):
+    """ Safe requests read from replicas, writes and reads following them from the primary. Routing is checked
+        without replica connections, aliases are only named """
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.router = ReplicaRouter()
+
+    def route(self, request, status=200, atomic=False):
+        """ (alias of reads, response) of request passed through ReplicaMiddleware """
+        aliases = []
+
+        def view(request):
+            if atomic:
+                with transaction.atomic():
+                    aliases.append(self.router.db_for_read(Track))
+            else:
+                aliases.append(self.router.db_for_read(Track))
+            return HttpResponse(status=status)
+
+        response = ReplicaMiddleware(view)(request)
+        request_finished.send(sender=self.__class__)
+        return aliases[0], response
+
+    def test_routing(self):
+        cookie = ReplicaMiddleware.cookie_name
+        alias, response = self.route(self.factory.get('/tracks/'))
+        self.assertIn(alias, settings.API_READ_REPLICAS)
+        self.assertNotIn(cookie, response.cookies)
+        self.assertEqual(self.route(self.factory.get('/tracks/'), atomic=True)[0], 'default')
+        alias, response = self.route(self.factory.post('/tracks/'), status=201)
+        self.assertEqual(alias, 'default')
+        self.assertEqual(response.cookies[cookie]['max-age'], settings.API_REPLICA_STICKY_SECONDS)
+        self.assertNotIn(cookie, self.route(self.factory.delete('/tracks/1/'), status=404)[1].cookies)
+        self.factory.cookies[cookie] = '1'
+        self.assertEqual(self.route(self.factory.get('/tracks/'))[0], 'default')
+        # out of requests, e.g. in management commands
+        self.assertEqual(self.router.db_for_read(Track), 'default')
+        self.assertEqual(self.router.db_for_write(Track), 'default')
+        with override_settings(API_READ_REPLICAS=[]):
+            self.assertEqual(self.route(self.factory.get('/tracks/'))[0], 'default')
+
+    def test_replica_per_request(self):
+        """ Every read of a request goes to one replica, requests spread over all of them """
+        requests = []
+
+        def view(request):
+            requests.append({self.router.db_for_read(model) for model in (Artist, Album, Track) for _ in range(5)})
+            return HttpResponse()
+
+        for _ in range(50):
+            ReplicaMiddleware(view)(self.factory.get('/tracks/'))
+            request_finished.send(sender=self.__class__)
+        self.assertTrue(all(len(aliases) == 1 for aliases in requests))
+        self.assertEqual(set.union(*requests), set(settings.API_READ_REPLICAS))
+
+    def test_cache(self):
+        """ Replica reads are not cached right after a write of their scope, replicas may not have it yet.
+            Clients pinned to the primary bypass the cache """
+        class View(CachedResponseMixin):
+            def get_cache_scopes(self):
+                return ['tracks']
+
+        cache.get_cache().clear()
+        reads = itertools.count()
+
+        def get():
+            def view(request):
+                return View().get_cached_response(lambda request: Response({'read': next(reads)}), request)
+            response = ReplicaMiddleware(view)(self.factory.get('/tracks/'))
+            request_finished.send(sender=self.__class__)
+            return response.get('X-Cache')
+
+        self.assertEqual([get(), get()], ['MISS', 'HIT'])
+        cache.bump(['tracks'])
+        self.assertEqual([get(), get()], ['MISS', 'MISS'])
+        # replicas caught up
+        cache.get_cache().delete(cache.bumped_key('tracks'))
+        self.assertEqual([get(), get()], ['MISS', 'HIT'])
+        self.factory.cookies[ReplicaMiddleware.cookie_name] = '1'
+        self.assertIsNone(get())
+        self.assertEqual(next(reads), 5)
+
+    def test_async(self):
+        """ ORM of async views runs in threads, they get the request context """
+        async def view(request):
+            return HttpResponse(await sync_to_async(self.router.db_for_read)(Track))
+
+        for request, replica in [(self.factory.get('/async/tracks/'), True),
+                                 (self.factory.post('/async/tracks/'), False)]:
+            with self.subTest(method=request.method):
+                response = async_to_sync(ReplicaMiddleware(view))(request)
+                self.assertEqual(response.content.decode() in settings.API_READ_REPLICAS, replica)
+
+
+@override_settings(API_CACHE_ENABLED=False)
+class AlbumOrderConcurrencyTest(TransactionTestCase):
+    """ Concurrent inserts and deletes keep order gap-free, see stress_album_order command """
+
+    def test_stress(self):
+        for ordering in ('dense', 'gapped'):
+            with self.subTest(ordering=ordering), override_settings(ALBUM_TRACK_ORDERING=ordering):
+                out = StringIO()
+                call_command('stress_album_order', albums=[1, 3], threads=4, operations=25, tracks=5, stdout=out)
+                self.assertIn('gap-free', out.getvalue())
+
+
+@override_settings(API_CACHE_ENABLED=False)
+class EndpointBudgetTest(TestCase):
+    """ Query budget and latency of every route on seeded catalog. Every variant of an endpoint (small and big
+        page, short and long payload, small and big parent) must take the same number of queries within budget.
+        When LATENCY_BASELINE is set, p50/p95 latency is written to it if it doesn't exist, otherwise p50 must
+        stay within LATENCY_TOLERANCE times of the baseline """
+    repeat = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        rand = random.Random(0)
+        artists = Artist.objects.bulk_create(Artist(name=f'artist {i}') for i in range(2000))
+        albums = Album.objects.bulk_create(Album(name=f'album {i}', artist=artists[i % 50], year=2000)
+                                           for i in range(300))
+        tracks, album_tracks = [], []
+        for album in albums:
+            for order in range(1, (100 if album is albums[0] else rand.randint(10, 100)) + 1):
+                track = Track(name=f'track {len(tracks)}', artist_id=album.artist_id)
+                tracks.append(track)
+                album_tracks.append(AlbumTrack(album=album, track=track, order=order))
+        Track.objects.bulk_create(tracks, batch_size=5000)
+        AlbumTrack.objects.bulk_create(album_tracks, batch_size=5000)
+        # single album with 10 tracks of its own artist
+        cls.small_album = Album.objects.create(name='small album', artist=artists[-1], year=2000)
+        for order in range(1, 11):
+            track = Track.objects.create(name=f'small track {order}', artist=artists[-1])
+            AlbumTrack.objects.create(album=cls.small_album, track=track, order=order)
+        # tracks on 20 albums each, and artists with catalogs of their own, deleted along with single rows
+        sizes = Counter(album_track.album_id for album_track in album_tracks)
+        cls.shared_tracks = Track.objects.bulk_create(Track(name=f'shared track {i}', artist=artists[0])
+                                                      for i in range(7))
+        AlbumTrack.objects.bulk_create(AlbumTrack(album=album, track=track, order=sizes[album.pk] + 1 + i)
+                                       for i, track in enumerate(cls.shared_tracks) for album in albums[100:120])
+        # the first artist has an album of 2 tracks, others have 5 albums of 20 tracks
+        cls.catalog_artists = Artist.objects.bulk_create(Artist(name=f'catalog artist {i}') for i in range(7))
+        for artist, (albums_count, tracks_count) in zip(cls.catalog_artists, [(1, 2)] + [(5, 20)] * 6):
+            catalog_albums = Album.objects.bulk_create(Album(name=f'catalog album {i}', artist=artist, year=2000)
+                                                       for i in range(albums_count))
+            catalog_tracks = Track.objects.bulk_create(Track(name=f'catalog track {i}', artist=artist)
+                                                       for i in range(albums_count * tracks_count))
+            AlbumTrack.objects.bulk_create(AlbumTrack(album=catalog_albums[i // tracks_count], track=track,
+                                                      order=i % tracks_count + 1)
+                                           for i, track in enumerate(catalog_tracks))
+        recount_artists()
+        recount_albums()
+        call_command('rebuild_tracklists', stdout=StringIO())
+        get_search_backend().rebuild()
+        cls.big_album, cls.big_artist, cls.small_artist = albums[0], artists[0], artists[-1]
+        cls.track = tracks[0]
+        cls.batch_ids = {model: [obj.pk for obj in objects[:500]]
+                         for model, objects in ((Artist, artists), (Album, albums), (Track, tracks))}
+        by_size = sorted(albums[200:], key=lambda album: sizes[album.pk])
+        cls.small_spare_albums, cls.big_spare_albums = by_size[:7], by_size[-7:]
+        cls.spare_tracks = tracks[-100:]
+        cls.bulk_tracks = tracks[-400:-100]
+        cls.bulk_albums = albums[150:200]
+        cls.user = User.objects.create_user('user')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.counter = itertools.count()
+
+    def endpoints(self):
+        """ (name, method, variants, budget). Variant is (url, payload), both may be callables of run number """
+        big_artist, small_artist = self.big_artist.pk, self.small_artist.pk
+        big_album, small_album = self.big_album.pk, self.small_album.pk
+        catalog_artists, spare_tracks, shared_tracks = map(iter, (self.catalog_artists, self.spare_tracks,
+                                                                  self.shared_tracks))
+        small_spare_albums, big_spare_albums = iter(self.small_spare_albums), iter(self.big_spare_albums)
+
+        bulk_tracks, bulk_albums, run_albums = iter(self.bulk_tracks), iter(self.bulk_albums), {}
+        bulk_album_tracks = {}
+        for album_id, track_id in AlbumTrack.objects.filter(album__in=self.bulk_albums).values_list('album', 'track'):
+            bulk_album_tracks.setdefault(album_id, []).append(track_id)
+
+        def bulk_album(n):
+            """ Album of run n, every run takes the next one """
+            if n not in run_albums:
+                run_albums[n] = next(bulk_albums).pk
+            return run_albums[n]
+
+        def take_ids(tracks, size):
+            return lambda n: {'ids': [next(tracks).pk for _ in range(size)]}
+
+        def reversed_positions(album):
+            return list(range(AlbumTrack.objects.filter(album=album).count(), 0, -1))
+
+        def names(key, size, **fields):
+            return lambda n: [{'name': f'{key} {n} {i}', **fields} for i in range(size)]
+
+        def batch(model, size):
+            return f'?ids={",".join(map(str, self.batch_ids[model][:size]))}'
+
+        # lists read keys of the page for their ETag before the page itself, see ConditionalGetMixin
+        return [
+            ('artists list', 'get', [('/artists/?name=artist 7', None), ('/artists/', None)], 4),
+            ('artists keyset list', 'get', [('/artists/?cursor=&name=artist 7', None), ('/artists/?cursor=', None)], 2),
+            ('artist retrieve', 'get', [(f'/artists/{big_artist}/', None)], 2),
+            ('artists batch', 'get', [(f'/artists/batch/{batch(Artist, size)}', None) for size in (2, 500)], 1),
+            ('artist create', 'post', [('/artists/', lambda n: {'name': f'new artist {n}'})], 5),
+            ('artist create list', 'post', [('/artists/', names('new artist', size)) for size in (2, 20)], 7),
+            ('artist update', 'patch', [(f'/artists/{small_artist}/', lambda n: {'name': f'renamed {n}'})], 7),
+            # deletes write tombstones of the change feed, rows going with the deleted one are removed by set-based
+            # statements: artist with an album of 2 tracks and with 5 albums of 20 tracks
+            ('artist delete', 'delete', [(lambda n: f'/artists/{next(catalog_artists).pk}/', None)] * 2, 26),
+            ('albums list', 'get', [('/albums/?name=album 7', None), ('/albums/', None)], 4),
+            ('albums list with tracks', 'get', [('/albums/?name=album 7&expand=tracks', None),
+                                                ('/albums/?expand=tracks', None)], 5),
+            ('album retrieve', 'get', [(f'/albums/{small_album}/', None), (f'/albums/{big_album}/', None)], 2),
+            ('albums batch', 'get', [(f'/albums/batch/{batch(Album, size)}', None) for size in (2, 100)], 2),
+            ('album create', 'post', [('/albums/', lambda n: {'name': f'new album {n}', 'year': 2000,
+                                                              'artist_id': small_artist})], 6),
+            ('album delete', 'delete', [(lambda n: f'/albums/{next(small_spare_albums).pk}/', None),
+                                        (lambda n: f'/albums/{next(big_spare_albums).pk}/', None)], 16),
+            ('tracks list', 'get', [('/tracks/?name=track 7', None), ('/tracks/', None)], 5),
+            ('tracks sparse list', 'get', [('/tracks/?name=track 7&fields=id,name', None),
+                                           ('/tracks/?fields=id,name', None)], 4),
+            ('track retrieve', 'get', [(f'/tracks/{self.track.pk}/', None)], 3),
+            ('tracks batch', 'get', [(f'/tracks/batch/{batch(Track, size)}', None) for size in (2, 500)], 2),
+            ('tracks batch post', 'post', [('/tracks/batch/', {'ids': self.batch_ids[Track][:size]})
+                                           for size in (2, 500)], 2),
+            ('track create', 'post', [('/tracks/', lambda n: {'name': f'new track {n}', 'artist_id': small_artist})],
+             7),
+            ('track create list', 'post', [('/tracks/', names('new track', size, artist_id=small_artist))
+                                           for size in (2, 20)], 10),
+            # track on one album and on 20 albums
+            ('track delete', 'delete', [(lambda n: f'/tracks/{next(spare_tracks).pk}/', None),
+                                        (lambda n: f'/tracks/{next(shared_tracks).pk}/', None)], 22),
+            ('tracks bulk delete', 'post', [('/tracks/bulk-delete/', take_ids(bulk_tracks, size))
+                                            for size in (2, 20)], 20),
+            ('artist albums', 'get', [(f'/artists/{small_artist}/albums/', None),
+                                      (f'/artists/{big_artist}/albums/', None)], 2),
+            ('artist album retrieve', 'get', [(f'/artists/{small_artist}/albums/{small_album}/', None),
+                                              (f'/artists/{big_artist}/albums/{big_album}/', None)], 2),
+            ('artist album create list', 'post', [(f'/artists/{small_artist}/albums/', names('new album', size,
+                                                                                             year=2000))
+                                                  for size in (2, 20)], 11),
+            ('artist tracks', 'get', [(f'/artists/{small_artist}/tracks/', None),
+                                      (f'/artists/{big_artist}/tracks/', None)], 3),
+            ('artist track create list', 'post', [(f'/artists/{small_artist}/tracks/', names('new track', size))
+                                                  for size in (2, 20)], 11),
+            ('album tracks', 'get', [(f'/albums/{small_album}/tracks/', None),
+                                     (f'/albums/{big_album}/tracks/', None)], 2),
+            ('album track retrieve', 'get', [(f'/albums/{small_album}/tracks/5/', None),
+                                             (f'/albums/{big_album}/tracks/50/', None)], 2),
+            ('artist album tracks', 'get', [(f'/artists/{small_artist}/albums/{small_album}/tracks/', None),
+                                            (f'/artists/{big_artist}/albums/{big_album}/tracks/', None)], 2),
+            # tracklists are reordered before anything is added to them
+            ('album track reorder', 'put', [(f'/albums/{album}/tracks/order/', {'order': reversed_positions(album)})
+                                            for album in (small_album, big_album)], 12),
+            ('album track move', 'post', [(f'/albums/{small_album}/tracks/move/', {'from': 1, 'to': 5}),
+                                          (f'/albums/{big_album}/tracks/move/', [{'from': 1, 'to': 50},
+                                                                                 {'from': 2, 'to': 1}])], 12),
+            ('album track create list', 'post', [(f'/albums/{small_album}/tracks/', names('new track', size))
+                                                 for size in (2, 20)], 18),
+            ('album track delete', 'delete', [(f'/albums/{small_album}/tracks/1/', None),
+                                              (f'/albums/{big_album}/tracks/1/', None)], 12),
+            ('album track bulk delete', 'post', [(lambda n: f'/albums/{bulk_album(n)}/tracks/bulk-delete/',
+                                                  lambda n, size=size: {'ids': bulk_album_tracks[bulk_album(n)][:size]})
+                                                 for size in (2, 20)], 15),
+            ('search', 'get', [('/search/?q=track 1', None)], 1),
+            ('export', 'get', [('/export/albums.ndjson', None), ('/export/albums.csv', None)], 2),
+            ('cache stats', 'get', [('/cache/stats/', None)], 0),
+        ]
+
+    def request(self, method, url, payload):
+        n = next(self.counter)
+        url = url(n) if callable(url) else url
+        payload = payload(n) if callable(payload) else payload
+        response = getattr(self.client, method)(url, payload, format='json')
+        if response.streaming:
+            b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 300, f'{method.upper()} {url}: {response.status_code}')
+        return response
+
+    def test_budgets(self):
+        for name, method, variants, budget in self.endpoints():
+            with self.subTest(endpoint=name):
+                counts = []
+                for url, payload in variants:
+                    with CaptureQueriesContext(connection) as context:
+                        self.request(method, url, payload)
+                    counts.append(len(context.captured_queries))
+                self.assertEqual(len(set(counts)), 1, f'queries depend on size: {counts}')
+                self.assertLessEqual(counts[0], budget)
+
+    @skipUnless(LATENCY_BASELINE, 'API_LATENCY_BASELINE is not set')
+    def test_latency(self):
+        latency = {}
+        for name, method, variants, _ in self.endpoints():
+            with self.subTest(endpoint=name):
+                url, payload = variants[-1]
+                timings = []
+                for _ in range(self.repeat):
+                    start = time.perf_counter()
+                    self.request(method, url, payload)
+                    timings.append((time.perf_counter() - start) * 1000)
+                latency[name] = {'p50': statistics.median(timings),
+                                 'p95': sorted(timings)[int(len(timings) * 0.95)]}
+        self.check_latency(latency)
+
+    def check_latency(self, latency):
+        if not os.path.exists(LATENCY_BASELINE):
+            with open(LATENCY_BASELINE, 'w') as file:
+                json.dump(latency, file, indent=2)
+            return
+        with open(LATENCY_BASELINE) as file:
+            baseline = json.load(file)
+        for name, timings in latency.items():
+            if name in baseline:
+                with self.subTest(endpoint=name):
+                    # 1 ms slack keeps sub-millisecond endpoints from failing on noise
+                    message = f'p50 is {timings["p50"]:.1f} ms, baseline {baseline[name]["p50"]:.1f} ms'
+                    self.assertLessEqual(timings['p50'], baseline[name]['p50'] * LATENCY_TOLERANCE + 1, message)
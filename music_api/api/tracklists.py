@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.db.models import Prefetch
+
+from .models import AlbumTrack, AlbumTracklist
+from .ordering import get_album_ordering
+
+# albums per statement of rebuild()
+BATCH_SIZE = 500
+
+
+def prefetch_tracks():
+    return Prefetch('tracks', queryset=get_album_ordering().with_positions(
+        AlbumTrack.objects.select_related('track').order_by('order')))
+
+
+def read_tracklists(album_ids):
+    """ {album id: tracklist} as AlbumTrackSerializer shows it, orders are positions 1..N whatever ordering
+        strategy stores. Albums without tracks are left out """
+    tracklists = {}
+    album_tracks = AlbumTrack.objects.filter(album_id__in=album_ids).order_by('album_id', 'order').\
+        values_list('album_id', 'track_id', 'track__name')
+    for album_id, track_id, track_name in album_tracks:
+        tracks = tracklists.setdefault(album_id, [])
+        tracks.append({'order': len(tracks) + 1, 'id': track_id, 'name': track_name})
+    return tracklists
+
+
+def rebuild(album_ids):
+    """ Writes snapshots of albums tracklists from their rows, in the transaction which changed them.
+        With API_TRACKLIST_SNAPSHOTS off drops them instead, so they are never stale when it is turned on """
+    album_ids = sorted(set(album_ids))
+    for start in range(0, len(album_ids), BATCH_SIZE):
+        batch = album_ids[start:start + BATCH_SIZE]
+        if not settings.API_TRACKLIST_SNAPSHOTS:
+            AlbumTracklist.objects.filter(album__in=batch).delete()
+            continue
+        tracklists = read_tracklists(batch)
+        AlbumTracklist.objects.bulk_create([AlbumTracklist(album_id=pk, tracks=tracklists.get(pk, []))
+                                            for pk in batch],
+                                           update_conflicts=True, unique_fields=['album'], update_fields=['tracks'])
+
+
+def get_snapshot(album):
+    """ Tracklist snapshot of album if it was selected with it and exists, None otherwise """
+    if not settings.API_TRACKLIST_SNAPSHOTS or not type(album).tracklist.is_cached(album):
+        return None
+    try:
+        return album.tracklist.tracks
+    except AlbumTracklist.DoesNotExist:
+        return None
@@ -3,6 +3,8 @@ from rest_framework_nested.routers import NestedSimpleRouter
 
 from . import swagger
 from .views import AlbumViewSet, TrackViewSet, ArtistViewSet, AlbumTrackViewSet, ArtistTrackViewSet, ArtistAlbumViewSet
+from .views import CacheStatsView, ChangesView, ExportView, MetricsView, SearchView
+from .views import AsyncArtistView, AsyncAlbumView, AsyncTrackView, AsyncAlbumTrackView
 from django.urls import include, path, re_path
 
 router = routers.DefaultRouter()
@@ -23,6 +25,17 @@ album_tracks_router.register(r'tracks', AlbumTrackViewSet, basename='album_track
 artist_album_tracks_router = NestedSimpleRouter(albums_router, r'albums', lookup='artist_albums')
 artist_album_tracks_router.register(r'tracks', AlbumTrackViewSet, basename='artist_album_tracks')
 
+# async read views for ASGI deployments, same responses as GET on the viewsets above
+async_urls = [
+    path('artists/', AsyncArtistView.as_view(), name='async_artists'),
+    path('artists/<int:pk>/', AsyncArtistView.as_view(), name='async_artist'),
+    path('albums/', AsyncAlbumView.as_view(), name='async_albums'),
+    path('albums/<int:pk>/', AsyncAlbumView.as_view(), name='async_album'),
+    path('albums/<int:albums_pk>/tracks/', AsyncAlbumTrackView.as_view(), name='async_album_tracks'),
+    path('albums/<int:albums_pk>/tracks/<int:pk>/', AsyncAlbumTrackView.as_view(), name='async_album_track'),
+    path('tracks/', AsyncTrackView.as_view(), name='async_tracks'),
+    path('tracks/<int:pk>/', AsyncTrackView.as_view(), name='async_track'),
+]
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -30,6 +43,13 @@ urlpatterns = [
     path('', include(artist_tracks_router.urls)),
     path('', include(artist_album_tracks_router.urls)),
     path('', include(album_tracks_router.urls)),
+    path('cache/stats/', CacheStatsView.as_view(), name='cache_stats'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
+    re_path(r'^export/(?P<resource>artists|albums|tracks)\.(?P<export_format>ndjson|csv)$', ExportView.as_view(),
+            name='export'),
+    path('search/', SearchView.as_view(), name='search'),
+    path('changes/', ChangesView.as_view(), name='changes'),
+    path('async/', include(async_urls)),
     path('', include(swagger)),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework'))
 ]
@@ -2,6 +2,9 @@ from django.conf import settings
 from django.db import connection, reset_queries
 import time
 import functools
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 def query_debugger(func):
@@ -17,9 +20,7 @@ def query_debugger(func):
 
         end_queries = len(connection.queries)
 
-        print(f"Function : {func.__name__}")
-        print(f"Number of Queries : {end_queries - start_queries}")
-        print(f"Finished in : {(end - start):.2f}s")
+        logger.debug('Function %s: %d queries in %.2fs', func.__name__, end_queries - start_queries, end - start)
         return result
     if settings.DEBUG:
         return inner_func
@@ -1,3 +1,8 @@
 from .album import *
 from .track import *
-from .artist import *
\ No newline at end of file
+from .artist import *
+from .stats import *
+from .export import *
+from .search import *
+from .async_read import *
+from .changes import *
@@ -1,39 +1,75 @@
-from django.db.models import Count, Prefetch
+from django.conf import settings
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets
-from rest_framework.exceptions import APIException
 
-from .mixins import AutoManySerializerMixin, DiscreteRetrieveSerializerMixin
+from .mixins import AutoManySerializerMixin, BatchRetrieveMixin, DiscreteRetrieveSerializerMixin, \
+    CachedResponseMixin, ConditionalGetMixin, FastListMixin, NestedParentMixin, SetBasedDestroyMixin, SparseFieldsMixin
 from .paginators import Paginator
-from ..models import Album, Artist, AlbumTrack
+from ..deletion import delete_albums
+from ..models import Album, Artist
 from ..serializers import AlbumSerializer, AlbumRetrieveSerializer, ArtistAlbumSerializer, ArtistAlbumRetrieveSerializer
+from ..serializers import AlbumFastListSerializer, AlbumTrackSerializer
+from ..tracklists import prefetch_tracks
 
+EXPANDABLE_TRACKS = {'tracks': (AlbumTrackSerializer, {'many': True, 'read_only': True})}
 
-class AlbumViewSet(AutoManySerializerMixin, DiscreteRetrieveSerializerMixin, viewsets.ModelViewSet):
+
+def with_tracks(view, queryset):
+    """ Retrieve takes tracklist snapshot along with album row, lists prefetch album tracks of the page """
+    if view.action == 'retrieve' and settings.API_TRACKLIST_SNAPSHOTS:
+        return queryset.select_related('tracklist')
+    return queryset.prefetch_related(prefetch_tracks())
+
+
+class AlbumViewSet(SparseFieldsMixin, BatchRetrieveMixin, CachedResponseMixin, ConditionalGetMixin, FastListMixin,
+                   SetBasedDestroyMixin, AutoManySerializerMixin, DiscreteRetrieveSerializerMixin,
+                   viewsets.ModelViewSet):
     serializer_class = AlbumSerializer
+    fast_list_serializer_class = AlbumFastListSerializer
     retrieve_serializer_class = AlbumRetrieveSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['artist__name', 'year', 'name']
     pagination_class = Paginator
+    expandable_fields = EXPANDABLE_TRACKS
+
+    def get_cache_scopes(self):
+        return ['albums'] if self.action == 'list' else [f'album:{self.kwargs["pk"]}']
 
     def get_queryset(self):
-        prefetch_tracks = Prefetch('tracks', queryset=AlbumTrack.objects.select_related('track').order_by('order'))
-        queryset = Album.objects.prefetch_related(prefetch_tracks)
-        queryset = queryset.annotate(tracks_count=Count('tracks')).order_by('-id')
-        return queryset
+        queryset = Album.objects.all()
+        if self.wants_field('artist_name'):
+            queryset = queryset.select_related('artist')
+        if self.wants_field('tracks'):
+            queryset = with_tracks(self, queryset)
+        return queryset.order_by('-id')
 
+    def perform_bulk_delete(self, queryset):
+        return delete_albums(queryset)
 
-class ArtistAlbumViewSet(AutoManySerializerMixin, DiscreteRetrieveSerializerMixin, viewsets.ModelViewSet):
+
+class ArtistAlbumViewSet(NestedParentMixin, SparseFieldsMixin, CachedResponseMixin, ConditionalGetMixin,
+                         SetBasedDestroyMixin, AutoManySerializerMixin, DiscreteRetrieveSerializerMixin,
+                         viewsets.ModelViewSet):
     serializer_class = ArtistAlbumSerializer
     retrieve_serializer_class = ArtistAlbumRetrieveSerializer
+    parent_name = 'artist'
+    expandable_fields = EXPANDABLE_TRACKS
+
+    def get_parent_queryset(self):
+        return Artist.objects.filter(pk=self.kwargs['artists_pk'])
+
+    def get_cache_scopes(self):
+        if self.action == 'list':
+            return [f'artist:{self.kwargs["artists_pk"]}']
+        return [f'artist:{self.kwargs["artists_pk"]}', f'album:{self.kwargs["pk"]}']
 
     def get_queryset(self):
-        kwargs = self.request.parser_context.get('kwargs')
-        artist_pk = kwargs.get('artists_pk')
         if getattr(self, 'swagger_fake_view', False):
             return Album.objects.prefetch_related('tracks')
-        if not Artist.objects.filter(pk=artist_pk).exists():
-            raise APIException('Artist not found')
-        prefetch_tracks = Prefetch('tracks', queryset=AlbumTrack.objects.select_related('track').order_by('order'))
-        queryset = Album.objects.filter(artist_id=artist_pk).prefetch_related(prefetch_tracks)
-        return queryset.annotate(tracks_count=Count('tracks')).order_by('-id')
+        queryset = Album.objects.filter(artist_id=self.kwargs['artists_pk'])
+        if self.wants_field('tracks'):
+            queryset = with_tracks(self, queryset)
+        return queryset.order_by('-id')
+
+    def perform_bulk_delete(self, queryset):
+        return delete_albums(queryset)
@@ -1,18 +1,26 @@
-from django.db.models import Count
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets
 
 from .paginators import Paginator
+from ..deletion import delete_artists
 from ..models import Artist
-from ..serializers import ArtistSerializer
-from .mixins import AutoManySerializerMixin
+from ..serializers import ArtistSerializer, ArtistFastListSerializer
+from .mixins import AutoManySerializerMixin, BatchRetrieveMixin, CachedResponseMixin, ConditionalGetMixin, \
+    FastListMixin, SetBasedDestroyMixin, SparseFieldsMixin
 
 
-class ArtistViewSet(AutoManySerializerMixin, viewsets.ModelViewSet):
+class ArtistViewSet(SparseFieldsMixin, BatchRetrieveMixin, CachedResponseMixin, ConditionalGetMixin, FastListMixin,
+                    SetBasedDestroyMixin, AutoManySerializerMixin, viewsets.ModelViewSet):
 
     serializer_class = ArtistSerializer
+    fast_list_serializer_class = ArtistFastListSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['name']
-    queryset = Artist.objects.annotate(albums_count=Count('albums', distinct=True),
-                                       tracks_count=Count('tracks', distinct=True)).order_by('-id').all()
+    queryset = Artist.objects.order_by('-id').all()
     pagination_class = Paginator
+
+    def get_cache_scopes(self):
+        return ['artists'] if self.action == 'list' else [f'artist:{self.kwargs["pk"]}']
+
+    def perform_bulk_delete(self, queryset):
+        return delete_artists(queryset)
@@ -0,0 +1,164 @@
+import math
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import Http404, HttpResponse
+from django.views import View
+from django_filters.filterset import filterset_factory
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .paginators import Paginator
+from ..models import Artist, Album, Track, AlbumTrack
+from ..ordering import get_album_ordering
+from ..serializers import ArtistSerializer, AlbumSerializer, AlbumRetrieveSerializer, TrackSerializer, \
+    AlbumTrackSerializer
+from ..tracklists import prefetch_tracks
+
+# prefetching and serialization of async views run here. Pool size bounds threads and database connections they hold
+executor = ThreadPoolExecutor(max_workers=settings.API_ASYNC_THREADS, thread_name_prefix='api-async')
+
+
+def run_in_pool(func, *args):
+    return sync_to_async(func, thread_sensitive=False, executor=executor)(*args)
+
+
+def json_response(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+class AsyncReadView(View):
+    """ Async variant of list and retrieve actions of a viewset, for ASGI deployments. Rows are fetched with
+        async ORM, prefetching, serialization and rendering run in bounded thread pool. Responses are the same
+        as sync viewsets give, except for caching and conditional GET. Child must define:
+        - serializer_class
+        - get_queryset: rows for URL kwargs, without prefetches
+        Child may define:
+        - retrieve_serializer_class, prefetch, filter_fields, paginated
+        - get_prefetch(many): prefetches of list or retrieve, prefetch for both by default
+     """
+    http_method_names = ['get', 'head', 'options']
+    serializer_class = None
+    retrieve_serializer_class = None
+    prefetch = []
+    filter_fields = []
+    paginated = True
+
+    def get_queryset(self, **kwargs):
+        raise NotImplementedError(f'{self.__class__.__name__}: not defined "get_queryset"')
+
+    async def get(self, request, pk=None, **kwargs):
+        queryset = self.get_queryset(**kwargs)
+        if pk is not None:
+            try:
+                instance = await self.get_object(queryset, pk)
+            except Http404:
+                return json_response({'detail': 'Not found.'}, status=404)
+            return await run_in_pool(self.serialize, [instance], self.retrieve_serializer_class, False)
+        if self.filter_fields:
+            filterset = filterset_factory(queryset.model, self.filter_fields)(request.GET, queryset=queryset)
+            if not filterset.is_valid():
+                return json_response(filterset.errors, status=400)
+            queryset = filterset.qs
+        if not self.paginated:
+            return await self.list(queryset, **kwargs)
+        return await self.paginated_list(request, queryset)
+
+    async def get_object(self, queryset, pk):
+        try:
+            return await queryset.aget(pk=pk)
+        except queryset.model.DoesNotExist:
+            raise Http404
+
+    async def list(self, queryset, **kwargs):
+        return await run_in_pool(self.serialize, [obj async for obj in queryset], self.serializer_class, True)
+
+    async def paginated_list(self, request, queryset):
+        """ Page number pagination as in Paginator """
+        count = await queryset.acount()
+        pages = max(math.ceil(count / Paginator.page_size), 1)
+        page = request.GET.get(Paginator.page_query_param, 1)
+        try:
+            page = pages if page in Paginator.last_page_strings else int(page)
+        except ValueError:
+            page = 0
+        if not 1 <= page <= pages:
+            return json_response({'detail': 'Invalid page.'}, status=404)
+        offset = (page - 1) * Paginator.page_size
+        objects = [obj async for obj in queryset[offset:offset + Paginator.page_size]]
+        url = request.build_absolute_uri()
+        previous = None
+        if page > 1:
+            previous = remove_query_param(url, 'page') if page == 2 else replace_query_param(url, 'page', page - 1)
+        envelope = OrderedDict([
+            ('count', count),
+            ('next', replace_query_param(url, 'page', page + 1) if page < pages else None),
+            ('previous', previous),
+        ])
+        return await run_in_pool(self.serialize, objects, self.serializer_class, True, envelope)
+
+    def get_prefetch(self, many):
+        return self.prefetch
+
+    def serialize(self, objects, serializer_class, many, envelope=None):
+        # pool threads outlive requests, their connections are checked as request signals do for others
+        close_old_connections()
+        if prefetch := self.get_prefetch(many):
+            prefetch_related_objects(objects, *prefetch)
+        data = serializer_class(objects if many else objects[0], many=many).data
+        if envelope is not None:
+            data = OrderedDict(envelope, results=data)
+        return json_response(data)
+
+
+class AsyncArtistView(AsyncReadView):
+    serializer_class = retrieve_serializer_class = ArtistSerializer
+    filter_fields = ['name']
+
+    def get_queryset(self, **kwargs):
+        return Artist.objects.order_by('-id')
+
+
+class AsyncAlbumView(AsyncReadView):
+    serializer_class = AlbumSerializer
+    retrieve_serializer_class = AlbumRetrieveSerializer
+    filter_fields = ['artist__name', 'year', 'name']
+
+    def get_prefetch(self, many):
+        """ Lists don't show tracks """
+        return [] if many else [prefetch_tracks()]
+
+    def get_queryset(self, **kwargs):
+        return Album.objects.select_related('artist').order_by('-id')
+
+
+class AsyncTrackView(AsyncReadView):
+    serializer_class = retrieve_serializer_class = TrackSerializer
+    filter_fields = ['artist__name', 'name']
+    prefetch = [Prefetch('album_track', queryset=AlbumTrack.objects.select_related('album'))]
+
+    def get_queryset(self, **kwargs):
+        return Track.objects.select_related('artist').order_by('-id')
+
+
+class AsyncAlbumTrackView(AsyncReadView):
+    serializer_class = retrieve_serializer_class = AlbumTrackSerializer
+    paginated = False
+
+    def get_queryset(self, albums_pk):
+        queryset = AlbumTrack.objects.filter(album=albums_pk).select_related('track', 'album').order_by('order')
+        return get_album_ordering().with_positions(queryset)
+
+    async def get_object(self, queryset, pk):
+        """ pk is public position of the track in album """
+        return await get_album_ordering().aget_by_position(queryset, pk)
+
+    async def list(self, queryset, albums_pk):
+        objects = [obj async for obj in queryset]
+        if not objects and not await Album.objects.filter(pk=albums_pk).aexists():
+            return json_response({'detail': 'Album not found'}, status=404)
+        return await run_in_pool(self.serialize, objects, self.serializer_class, True)
@@ -0,0 +1,86 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import prefetch_related_objects
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .album import prefetch_tracks
+from .track import prefetch_albums
+from ..changes import Cursor, get_changes
+from ..models import Artist, Album, Track, Tombstone
+from ..serializers import ArtistSerializer, AlbumRetrieveSerializer, TrackSerializer
+
+
+class CursorExpired(APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = 'Cursor is older than kept deletes, sync the whole catalog again'
+    default_code = 'cursor_expired'
+
+
+class ChangesView(APIView):
+    """ Feed of created, updated and deleted artists, albums and tracks: /changes/?since=<cursor>&limit=<n>.
+        Without since starts from the beginning. Live objects come with data in retrieve shape, deleted ones
+        with null. Follow 'next' while 'has_more', then poll with it. Changes of the last
+        API_CHANGES_LAG_SECONDS are held back, so transactions still running don't get skipped """
+    default_limit = 500
+    max_limit = 1000
+    # (kind, serializer class, prefetches of the page) per live source of api/changes.py
+    kinds = {
+        Artist: ('artist', ArtistSerializer, []),
+        Album: ('album', AlbumRetrieveSerializer, [prefetch_tracks]),
+        Track: ('track', TrackSerializer, [prefetch_albums]),
+    }
+
+    def get(self, request):
+        cursor = self.get_cursor()
+        try:
+            limit = min(int(request.query_params.get('limit', self.default_limit)), self.max_limit)
+        except ValueError:
+            raise ValidationError({'limit': 'A valid integer is required'})
+        if limit < 1:
+            raise ValidationError({'limit': 'Ensure this value is greater than or equal to 1'})
+        until = timezone.now() - timedelta(seconds=settings.API_CHANGES_LAG_SECONDS)
+        changes, has_more = get_changes(cursor, limit, until)
+        data = self.serialize([change.row for change in changes])
+        results = []
+        for change in changes:
+            if isinstance(change.row, Tombstone):
+                kind, pk, item = change.row.kind, change.row.object_id, None
+            else:
+                kind, pk, item = self.kinds[type(change.row)][0], change.pk, data[type(change.row), change.pk]
+            results.append({'type': kind, 'id': pk, 'deleted': item is None, 'changed_at': change.time, 'data': item})
+        if changes:
+            last = Cursor(*changes[-1][:3])
+        elif cursor is None or cursor.time < until:
+            # nothing changed up to until, idle clients move on and don't outlive retention
+            last = Cursor.after(until)
+        else:
+            last = cursor
+        return Response({'results': results, 'next': last.encode(), 'has_more': has_more})
+
+    def get_cursor(self):
+        token = self.request.query_params.get('since')
+        if not token:
+            return None
+        try:
+            cursor = Cursor.decode(token)
+        except ValueError as exc:
+            raise ValidationError({'since': str(exc)})
+        if cursor.time < timezone.now() - timedelta(days=settings.API_CHANGES_RETENTION_DAYS):
+            raise CursorExpired()
+        return cursor
+
+    def serialize(self, rows):
+        """ {(model, pk): data} of live rows, every kind is prefetched once for the page """
+        data = {}
+        for model, (kind, serializer_class, prefetches) in self.kinds.items():
+            objects = [row for row in rows if type(row) is model]
+            if objects:
+                prefetch_related_objects(objects, *[prefetch() for prefetch in prefetches])
+                data.update({(model, obj.pk): item
+                             for obj, item in zip(objects, serializer_class(objects, many=True).data)})
+        return data
@@ -0,0 +1,100 @@
+import csv
+import json
+import queue
+import threading
+from itertools import islice
+
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connections
+from django.http import StreamingHttpResponse
+from rest_framework.views import APIView
+
+from ..models import Artist, Album, Track
+from ..serializers import ArtistFastListSerializer, AlbumTracklistFastListSerializer, TrackFastListSerializer
+
+
+class Echo:
+    """ File-like object for csv.writer which returns written line instead of storing it """
+    def write(self, value):
+        return value
+
+
+def iterate_in_thread(iterator, maxsize=4):
+    """ Runs iterator in a worker thread and passes its items through bounded queue.
+        ASGI handler of Django 4.1 consumes streaming content inside event loop, where database queries
+        are not allowed, so export is produced in a thread and event loop only waits for ready chunks """
+    items = queue.Queue(maxsize)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                return items.put(item, timeout=1)
+            except queue.Full:
+                pass
+
+    def worker():
+        try:
+            for item in iterator:
+                put(item)
+                if stopped.is_set():
+                    break
+        except Exception as exc:
+            put(exc)
+        finally:
+            put(done)
+            connections.close_all()
+
+    threading.Thread(target=worker, daemon=True).start()
+    try:
+        while (item := items.get()) is not done:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+
+
+class ExportView(APIView):
+    """ Streams the whole resource as NDJSON or CSV. Rows are read with server-side cursor by chunks and
+        related rows are loaded once per chunk, so memory use doesn't depend on table size.
+        In CSV nested lists are written as JSON """
+    chunk_size = 2000
+    resources = {
+        'artists': (Artist, ArtistFastListSerializer),
+        'albums': (Album, AlbumTracklistFastListSerializer),
+        'tracks': (Track, TrackFastListSerializer),
+    }
+    content_types = {
+        'ndjson': 'application/x-ndjson',
+        'csv': 'text/csv',
+    }
+
+    def get(self, request, resource, export_format):
+        model, serializer_class = self.resources[resource]
+        serializer = serializer_class()
+        content = getattr(self, f'to_{export_format}')(self.iter_chunks(model, serializer), serializer)
+        if isinstance(request._request, ASGIRequest):
+            content = iterate_in_thread(content)
+        response = StreamingHttpResponse(content, content_type=self.content_types[export_format])
+        response['Content-Disposition'] = f'attachment; filename="{resource}.{export_format}"'
+        return response
+
+    def iter_chunks(self, model, serializer):
+        rows = serializer.get_queryset(model.objects.order_by('id')).iterator(chunk_size=self.chunk_size)
+        while chunk := list(islice(rows, self.chunk_size)):
+            yield serializer.to_representation(chunk)
+
+    def to_ndjson(self, chunks, serializer):
+        for chunk in chunks:
+            yield ''.join(json.dumps(item, ensure_ascii=False, separators=(',', ':')) + '\n' for item in chunk)
+
+    def to_csv(self, chunks, serializer):
+        writer = csv.writer(Echo())
+        columns = [key for key, _ in serializer.fields]
+        yield writer.writerow(columns)
+        for chunk in chunks:
+            yield ''.join(writer.writerow([json.dumps(item[column], ensure_ascii=False)
+                                           if isinstance(item[column], list) else item[column]
+                                           for column in columns]) for item in chunk)
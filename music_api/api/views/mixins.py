@@ -1,6 +1,38 @@
+import hashlib
+import math
+import time
+from functools import cached_property, lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 
+from .. import cache
+from ..middleware import ReplicaMiddleware
+from ..routers import read_replica
+
+
+def parse_ids(ids, name, max_ids):
+    """ List of int ids from list or comma separated string. Raises ValidationError keyed by name """
+    if isinstance(ids, str):
+        ids = [value for value in ids.split(',') if value.strip()]
+    try:
+        ids = [int(value) for value in ids or []]
+    except (TypeError, ValueError):
+        raise ValidationError({name: ['Ids must be integers']})
+    if not ids:
+        raise ValidationError({name: ['This field is required.']})
+    if len(ids) > max_ids:
+        raise ValidationError({name: [f'At most {max_ids} ids allowed']})
+    return ids
+
 
 class AutoManySerializerMixin:
     """ Provides feature which allow sending list of objects. Switchs serializer to 'many' """
@@ -8,13 +40,100 @@ class AutoManySerializerMixin:
         many = True if isinstance(request.data, list) else False
         serializer = self.get_serializer(data=request.data, many=many)
         if serializer.is_valid():
-            serializer.save()
+            with transaction.atomic():
+                serializer.save()
         else:
             return Response(serializer.errors,
                             status=status.HTTP_400_BAD_REQUEST)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
+class BatchRetrieveMixin:
+    """ Retrieves many objects by id in one request: GET batch/?ids=3,1,2 or POST batch/ with {"ids": [3, 1, 2]}.
+        Rows are fetched by one query with one prefetch per batch and serialized with retrieve serializer.
+        Results follow order of ids, missing objects are null there and listed in 'missing' """
+    batch_query_param = 'ids'
+
+    @action(detail=False, methods=['get', 'post'], permission_classes=[AllowAny])
+    def batch(self, request, *args, **kwargs):
+        ids = self.get_batch_ids()
+        objects = self.get_queryset().in_bulk(ids)
+        serializer = self.get_serializer(list(objects.values()), many=True)
+        data = dict(zip(objects, serializer.data))
+        return Response({'results': [data.get(pk) for pk in ids], 'missing': [pk for pk in ids if pk not in data]})
+
+    def get_batch_ids(self):
+        if self.request.method == 'POST':
+            ids = self.request.data.get(self.batch_query_param) if isinstance(self.request.data, dict) else None
+        else:
+            ids = self.request.query_params.get(self.batch_query_param)
+        return parse_ids(ids, self.batch_query_param, settings.API_BATCH_MAX_IDS)
+
+    def get_serializer_class(self):
+        if self.action == 'batch':
+            return getattr(self, 'retrieve_serializer_class', None) or self.serializer_class
+        return super().get_serializer_class()
+
+
+class BulkDeleteMixin:
+    """ Deletes many objects in one request: POST bulk-delete/ with {"ids": [3, 1, 2]}, or with filter query
+        parameters of list action, e.g. bulk-delete/?artist__name=X. Rows are removed by set-based statements,
+        see api/deletion.py. Responds with number of deleted objects. Child must define:
+        - perform_bulk_delete(queryset): deletes rows of queryset, returns their number
+        Child may define:
+        - bulk_delete_id_field: field matched by ids, pk by default
+        - get_bulk_delete_base_queryset: rows that may be deleted, plain get_queryset by default
+     """
+    bulk_delete_id_field = 'pk'
+
+    @action(detail=False, methods=['post'], url_path='bulk-delete')
+    def bulk_delete(self, request, *args, **kwargs):
+        return Response({'deleted': self.perform_bulk_delete(self.get_bulk_delete_queryset())})
+
+    def perform_bulk_delete(self, queryset):
+        raise NotImplementedError(f'{self.__class__.__name__}: not defined "perform_bulk_delete"')
+
+    def get_bulk_delete_base_queryset(self):
+        return self.get_queryset().select_related(None).prefetch_related(None).order_by()
+
+    def get_bulk_delete_queryset(self):
+        ids = self.request.data.get('ids') if isinstance(self.request.data, dict) else None
+        # filters ignore empty values, they would match every row
+        filters = [name for name in getattr(self, 'filterset_fields', None) or []
+                   if self.request.query_params.get(name, '').strip()]
+        if ids is None and not filters:
+            raise ValidationError({'ids': ['Ids or filter is required']})
+        queryset = self.get_bulk_delete_base_queryset()
+        if filters:
+            filtered = self.filter_queryset(queryset)
+            if filtered.query.where == queryset.query.where:
+                raise ValidationError({'filter': ['Filter does not narrow rows to delete']})
+            queryset = filtered
+        if ids is not None:
+            ids = parse_ids(ids, 'ids', settings.API_BULK_DELETE_MAX_IDS)
+            return queryset.filter(**{f'{self.bulk_delete_id_field}__in': ids})
+        max_ids = settings.API_BULK_DELETE_MAX_IDS
+        if queryset.values('pk')[:max_ids + 1].count() > max_ids:
+            raise ValidationError({'filter': [f'Filter matches more than {max_ids} rows, at most {max_ids} allowed']})
+        return queryset
+
+
+class SetBasedDestroyMixin:
+    """ Destroy action deletes the object with everything cascading from it by set-based statements of
+        api/deletion.py, so it takes the same number of queries whatever number of rows goes with it.
+        Child must define:
+        - perform_bulk_delete(queryset): deletes rows of queryset, returns their number
+     """
+
+    def perform_destroy(self, instance):
+        if not self.perform_bulk_delete(type(instance).objects.filter(pk=instance.pk)):
+            # deleted by a concurrent request after it was read
+            raise NotFound
+
+    def perform_bulk_delete(self, queryset):
+        raise NotImplementedError(f'{self.__class__.__name__}: not defined "perform_bulk_delete"')
+
+
 class DiscreteRetrieveSerializerMixin:
     """ Define discrete serializer for retrieve action. Child must contain attribute:
         - retrieve_serializer_class
@@ -27,3 +146,226 @@ class DiscreteRetrieveSerializerMixin:
         if self.action == 'retrieve':
             return self.retrieve_serializer_class
         return super().get_serializer_class()
+
+
+class CachedResponseMixin:
+    """ Caches data of list and retrieve responses. Key is built from path with query and generations of scopes
+        the response depends on, see api/cache.py. Clients pinned to the primary after their writes bypass the
+        cache, and responses read from a replica are not stored until replicas may have caught up with the last
+        write of their scopes. Validators of ConditionalGetMixin following it are stored with the data, so a hit
+        answers conditional requests without queries. Child must contain method:
+        - get_cache_scopes
+     """
+    def get_cache_scopes(self):
+        raise NotImplementedError(f'{self.__class__.__name__}: not defined "get_cache_scopes"')
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        if not settings.API_CACHE_ENABLED or ReplicaMiddleware.is_sticky(request):
+            return handler(request, *args, **kwargs)
+        scopes = self.get_cache_scopes()
+        key = cache.response_key(request.get_full_path(), scopes)
+        entry = cache.get_cache().get(key)
+        cache.count(hit=entry is not None)
+        if entry is None:
+            response = handler(request, *args, **kwargs)
+            stale = read_replica.get() is not None and cache.recently_bumped(scopes)
+            if response.status_code == status.HTTP_200_OK and not stale:
+                validators = getattr(self, 'response_validators', None)
+                cache.get_cache().set(key, {'data': response.data, 'validators': validators})
+        elif entry['validators'] is not None:
+            response = self.get_validated_response(entry['validators'], lambda *args, **kwargs: Response(entry['data']),
+                                                   request, *args, **kwargs)
+        else:
+            response = Response(entry['data'])
+        response['X-Cache'] = 'MISS' if entry is None else 'HIT'
+        return response
+
+
+class ConditionalGetMixin:
+    """ Answers list and retrieve with 304 when ETag / Last-Modified of the response match request, before
+        anything is serialized. Retrieve validators are taken from updated_at of the row by one aggregate query.
+        List pages are validated by keys of their rows: pk and updated_at of the page the paginator takes, with
+        count and links, read without joins and prefetches, while an aggregate over every filtered row would cost
+        more than the page. Preceded by CachedResponseMixin, validators are read once per cached response.
+        Child may override:
+        - get_validator_queryset: rows whose changes are reflected in the response, None to validate by page keys
+     """
+    def get_validator_queryset(self):
+        if self.action != 'retrieve':
+            return None
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        return self.filter_queryset(self.get_queryset()).filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+
+    def list(self, request, *args, **kwargs):
+        return self.get_conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def get_conditional_response(self, handler, request, *args, **kwargs):
+        # kept for CachedResponseMixin, it stores them with the response data
+        self.response_validators = self.get_response_validators()
+        if self.response_validators is None:
+            # nothing to validate, empty nested lists check their parent
+            return handler(request, *args, **kwargs)
+        return self.get_validated_response(self.response_validators, handler, request, *args, **kwargs)
+
+    def get_response_validators(self):
+        """ Values the ETag is built from and last modified timestamp, or None when there are no rows """
+        queryset = self.get_validator_queryset()
+        if queryset is None:
+            return self.get_page_validators()
+        validators = queryset.order_by().aggregate(last_modified=Max('updated_at'), count=Count('pk'))
+        if not validators['count']:
+            return None
+        last_modified = validators['last_modified'].timestamp()
+        return [validators['count'], last_modified], last_modified
+
+    def get_page_validators(self):
+        # named rows, keyset pagination reads 'id' of the last one by name
+        queryset = self.filter_queryset(self.get_queryset()).select_related(None).prefetch_related(None).\
+            values_list('id', 'updated_at', named=True)
+        page = self.paginate_queryset(queryset)
+        keys = [tuple(row) for row in (queryset if page is None else page)]
+        if not keys:
+            return None
+        if page is not None:
+            keys = self.get_paginated_response(keys).data
+        return [keys], None
+
+    def get_validated_response(self, validators, handler, request, *args, **kwargs):
+        """ 304 when request matches validators, otherwise response of handler. Both get ETag and Last-Modified """
+        values, last_modified = validators
+        etag = self.get_etag(request, *values)
+        if last_modified is not None:
+            # Last-Modified has whole seconds: it is given once its second is over, so no later write shares it
+            last_modified = math.ceil(last_modified)
+            if last_modified >= time.time():
+                last_modified = None
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def get_etag(self, request, *validators):
+        version = '|'.join(map(str, [request.get_full_path(), request.accepted_renderer.format, *validators]))
+        return '"%s"' % hashlib.md5(version.encode()).hexdigest()
+
+
+class FastListMixin:
+    """ Serializes list action with fast_list_serializer_class when API_FAST_LIST_SERIALIZERS setting is on.
+        Response is the same as with serializer_class. Output changed by SparseFieldsMixin goes through
+        serializer_class """
+    fast_list_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        if not settings.API_FAST_LIST_SERIALIZERS or self.fast_list_serializer_class is None or \
+                self.is_output_changed():
+            return super().list(request, *args, **kwargs)
+        serializer = self.fast_list_serializer_class()
+        queryset = serializer.get_queryset(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer.to_representation(page))
+        return Response(serializer.to_representation(queryset))
+
+
+@lru_cache(maxsize=None)
+def get_readable_fields(serializer_class):
+    """ Names of output fields of serializer class. Fields are built once per class, not on every request """
+    return [name for name, field in serializer_class().fields.items() if not field.write_only]
+
+
+class SparseFieldsMixin:
+    """ Trims output of sparse_actions to fields named in ?fields=id,name and adds opt-in relations named
+        in ?expand=tracks. get_queryset should join and prefetch relations only if wants_field them,
+        so light responses cost light queries. Other actions always have full output. Child may define:
+        - expandable_fields: {name: (serializer class, kwargs)} of fields not shown by default
+     """
+    fields_query_param = 'fields'
+    expand_query_param = 'expand'
+    expandable_fields = {}
+    sparse_actions = ('list', 'retrieve', 'batch')
+
+    @cached_property
+    def default_output_fields(self):
+        return get_readable_fields(self.get_serializer_class())
+
+    @cached_property
+    def output_fields(self):
+        """ Names of output fields, None for full output of not trimmed actions """
+        if self.action not in self.sparse_actions or getattr(self, 'swagger_fake_view', False):
+            return None
+        default = self.default_output_fields
+        available = default + [name for name in self.expandable_fields if name not in default]
+        expand = self.parse_field_names(self.expand_query_param, list(self.expandable_fields))
+        fields = self.parse_field_names(self.fields_query_param, available)
+        return list(dict.fromkeys((default if fields is None else fields) + (expand or [])))
+
+    def parse_field_names(self, param, available):
+        if self.request is None or param not in self.request.query_params:
+            return None
+        names = [name.strip() for name in self.request.query_params[param].split(',') if name.strip()]
+        if not names:
+            return None
+        if unknown := [name for name in names if name not in available]:
+            raise ValidationError({param: [f'Unknown fields: {", ".join(unknown)}. '
+                                           f'Available: {", ".join(available) or "none"}']})
+        return names
+
+    def wants_field(self, name):
+        return self.output_fields is None or name in self.output_fields
+
+    def is_output_changed(self):
+        return self.output_fields is not None and self.output_fields != self.default_output_fields
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        if self.output_fields is None:
+            return serializer
+        fields = getattr(serializer, 'child', serializer).fields
+        for name in self.output_fields:
+            if name not in fields:
+                field_class, field_kwargs = self.expandable_fields[name]
+                fields[name] = field_class(**field_kwargs)
+        for name in [name for name in fields if name not in self.output_fields and not fields[name].write_only]:
+            fields.pop(name)
+        return serializer
+
+
+class NestedParentMixin:
+    """ Resolves parent object of nested route at most once per request. Reads don't load it: rows are filtered
+        by parent key from URL, parent is only checked when result is empty. Writes load it and serializers get it
+        through ContextUtilsMixin.get_parent. Missing parent gives 404. Child must contain:
+        - parent_name: name of parent in serializer context, e.g. 'artist'
+        - get_parent_queryset: parents matching URL
+     """
+    parent_name = None
+
+    def get_parent_queryset(self):
+        raise NotImplementedError(f'{self.__class__.__name__}: not defined "get_parent_queryset"')
+
+    def get_parent(self):
+        if not hasattr(self, '_parent'):
+            self._parent = self.get_parent_queryset().first()
+        if self._parent is None:
+            raise NotFound(f'{self.parent_name.capitalize()} not found')
+        return self._parent
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            data = response.data
+            if not (data.get('results') if isinstance(data, dict) else data):
+                self.get_parent()
+        return response
@@ -1,5 +1,33 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, CursorPagination
+
+
+class KeysetPaginator(CursorPagination):
+    """ Keyset pagination by '-id'. Pages are taken with 'id < last seen id', without COUNT and OFFSET,
+        so every page costs the same whatever depth is. May be set as pagination_class of viewset """
+    page_size = 200
+    ordering = '-id'
 
 
 class Paginator(PageNumberPagination):
+    """ Page number pagination. Switches to keyset pagination when request has 'cursor' query parameter,
+        empty 'cursor' gives the first page """
     page_size = 200
+    keyset_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if KeysetPaginator.cursor_query_param in request.query_params:
+            self.keyset_paginator = KeysetPaginator()
+            return self.keyset_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset_paginator is not None:
+            return self.keyset_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_schema_fields(self, view):
+        return super().get_schema_fields(view) + KeysetPaginator().get_schema_fields(view)
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + \
+            KeysetPaginator().get_schema_operation_parameters(view)
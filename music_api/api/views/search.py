@@ -0,0 +1,23 @@
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from ..search import get_search_backend, get_tokens
+
+
+class SearchView(APIView):
+    """ Ranked prefix search by names of artists, albums and tracks: /search/?q=<words>&limit=<n> """
+    default_limit = 20
+    max_limit = 100
+
+    def get(self, request):
+        tokens = get_tokens(request.query_params.get('q', ''))
+        if not tokens:
+            raise ValidationError({'q': 'Enter at least one word'})
+        try:
+            limit = min(int(request.query_params.get('limit', self.default_limit)), self.max_limit)
+        except ValueError:
+            raise ValidationError({'limit': 'A valid integer is required'})
+        if limit < 1:
+            raise ValidationError({'limit': 'Ensure this value is greater than or equal to 1'})
+        return Response({'results': get_search_backend().search(tokens, limit)})
@@ -0,0 +1,20 @@
+from django.http import HttpResponse
+from django.views import View
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .. import cache, metrics
+
+
+class CacheStatsView(APIView):
+    """ Hit and miss counters of response cache """
+
+    def get(self, request):
+        return Response(cache.get_stats())
+
+
+class MetricsView(View):
+    """ Request metrics of this process in Prometheus text format """
+
+    def get(self, request):
+        return HttpResponse(metrics.expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,58 +1,150 @@
 from django.db.models import Prefetch
+from django.http import Http404
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import viewsets
-from rest_framework.exceptions import APIException
-from .mixins import AutoManySerializerMixin, DiscreteRetrieveSerializerMixin
+from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from .mixins import AutoManySerializerMixin, BatchRetrieveMixin, BulkDeleteMixin, DiscreteRetrieveSerializerMixin, \
+    CachedResponseMixin, ConditionalGetMixin, FastListMixin, NestedParentMixin, SetBasedDestroyMixin, SparseFieldsMixin
 from .paginators import Paginator
+from ..deletion import delete_album_tracks, delete_tracks
+from ..ordering import get_album_ordering
 from ..models import AlbumTrack, Artist, Track, Album
-from ..serializers import ArtistTrackSerializer, TrackSerializer, AlbumTrackSerializer, ArtistTrackRetrieveSerializer
+from ..serializers import ArtistTrackSerializer, TrackSerializer, AlbumTrackSerializer, ArtistTrackRetrieveSerializer, \
+    TrackFastListSerializer, AlbumTrackOrderSerializer, AlbumTrackMoveSerializer
 
 
-class ArtistTrackViewSet(AutoManySerializerMixin, DiscreteRetrieveSerializerMixin, viewsets.ModelViewSet):
+def prefetch_albums():
+    return Prefetch('album_track', queryset=AlbumTrack.objects.select_related('album'))
+
+
+class ArtistTrackViewSet(NestedParentMixin, SparseFieldsMixin, CachedResponseMixin, ConditionalGetMixin,
+                         SetBasedDestroyMixin, AutoManySerializerMixin, DiscreteRetrieveSerializerMixin,
+                         viewsets.ModelViewSet):
     serializer_class = ArtistTrackSerializer
     retrieve_serializer_class = ArtistTrackRetrieveSerializer
+    parent_name = 'artist'
+
+    def get_parent_queryset(self):
+        return Artist.objects.filter(pk=self.kwargs['artists_pk'])
+
+    def get_cache_scopes(self):
+        return [f'artist:{self.kwargs["artists_pk"]}']
 
     def get_queryset(self):
-        kwargs = self.request.parser_context.get('kwargs')
-        artist_pk = kwargs.get('artists_pk')
-        prefetch_album_tracks = Prefetch('album_track',
-                                         queryset=AlbumTrack.objects.select_related('album'))
         if getattr(self, 'swagger_fake_view', False):
             return Track.objects.order_by('-id')
-        if artist_pk and not Artist.objects.filter(pk=artist_pk).exists():
-            raise APIException('Artist not found')
-        queryset = Track.objects.filter(artist=artist_pk).prefetch_related(prefetch_album_tracks).order_by('-id')
-        return queryset
+        queryset = Track.objects.filter(artist=self.kwargs['artists_pk'])
+        if self.wants_field('albums'):
+            queryset = queryset.prefetch_related(prefetch_albums())
+        return queryset.order_by('-id')
+
+    def perform_bulk_delete(self, queryset):
+        return delete_tracks(queryset)
 
 
-class TrackViewSet(AutoManySerializerMixin, viewsets.ModelViewSet):
+class TrackViewSet(SparseFieldsMixin, BatchRetrieveMixin, BulkDeleteMixin, CachedResponseMixin, ConditionalGetMixin,
+                   FastListMixin, SetBasedDestroyMixin, AutoManySerializerMixin, viewsets.ModelViewSet):
 
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['artist__name', 'name']
     serializer_class = TrackSerializer
+    fast_list_serializer_class = TrackFastListSerializer
     pagination_class = Paginator
 
+    def get_cache_scopes(self):
+        return ['tracks']
+
     def get_queryset(self):
-        prefetch = Prefetch('album_track', queryset=AlbumTrack.objects.select_related('album'))
-        queryset = Track.objects.prefetch_related(prefetch).order_by('-id').all()
-        return queryset
+        queryset = Track.objects.all()
+        if self.wants_field('artist_name'):
+            queryset = queryset.select_related('artist')
+        if self.wants_field('albums'):
+            queryset = queryset.prefetch_related(prefetch_albums())
+        return queryset.order_by('-id')
 
+    def perform_bulk_delete(self, queryset):
+        return delete_tracks(queryset)
 
-class AlbumTrackViewSet(AutoManySerializerMixin, viewsets.ModelViewSet):
 
+class AlbumTrackViewSet(NestedParentMixin, SparseFieldsMixin, BulkDeleteMixin, CachedResponseMixin,
+                        ConditionalGetMixin, AutoManySerializerMixin, mixins.CreateModelMixin,
+                        mixins.RetrieveModelMixin, mixins.DestroyModelMixin, mixins.ListModelMixin,
+                        viewsets.GenericViewSet):
+    """ Tracks are not edited, only added, deleted and reordered """
     serializer_class = AlbumTrackSerializer
     lookup_field = 'order'
-    http_method_names = ['get', 'post', 'delete', 'head', 'options', 'trace']
+    parent_name = 'album'
+    # bulk-delete/ takes track ids, every occurrence of a track in the album goes
+    bulk_delete_id_field = 'track_id'
+    action_serializer_classes = {'order': AlbumTrackOrderSerializer, 'move': AlbumTrackMoveSerializer}
+
+    def get_album_pk(self):
+        return next(value for key, value in self.kwargs.items() if key.endswith('albums_pk'))
+
+    def get_album_filters(self):
+        """ Album from URL, under /artists/{id}/albums/ it must belong to the artist """
+        filters = {'pk': self.get_album_pk()}
+        if 'artists_pk' in self.kwargs:
+            filters['artist_id'] = self.kwargs['artists_pk']
+        return filters
+
+    def get_parent_queryset(self):
+        return Album.objects.filter(**self.get_album_filters())
+
+    def get_cache_scopes(self):
+        return [f'album:{self.get_album_pk()}']
+
+    def get_validator_queryset(self):
+        """ Album is touched on every change of its tracklist """
+        return self.get_parent_queryset()
 
     def get_queryset(self):
-        kwargs = self.request.parser_context.get('kwargs')
-        album_pk = next(value for key, value in kwargs.items() if key.endswith('albums_pk'))
-        artist_pk = self.request.parser_context.get('kwargs').get('artists_pk')
         if getattr(self, 'swagger_fake_view', False):
             return AlbumTrack.objects.order_by('order')
-        if album_pk and not Album.objects.filter(pk=album_pk).exists():
-            raise APIException('Album not found')
-        if artist_pk and not Artist.objects.filter(pk=artist_pk).exists():
-            raise APIException('Artist not found')
-        queryset = AlbumTrack.objects.filter(album=album_pk).select_related('track', 'album').order_by('order')
-        return queryset
+        album_filters = {f'album__{key}': value for key, value in self.get_album_filters().items()}
+        queryset = AlbumTrack.objects.filter(**album_filters).select_related('album').order_by('order')
+        if self.wants_field('name'):
+            queryset = queryset.select_related('track')
+        return get_album_ordering().with_positions(queryset)
+
+    def get_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        obj = get_album_ordering().get_by_position(queryset, self.kwargs[self.lookup_field])
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    def get_serializer_class(self):
+        return self.action_serializer_classes.get(self.action) or super().get_serializer_class()
+
+    @action(detail=False, methods=['put'])
+    def order(self, request, *args, **kwargs):
+        """ Replaces order of the whole tracklist: {"order": [3, 1, 2]} lists current positions in the new order.
+            Responds with the new tracklist """
+        return self.rearrange(self.get_serializer(data=request.data))
+
+    @action(detail=False, methods=['post'])
+    def move(self, request, *args, **kwargs):
+        """ Moves track: {"from": 3, "to": 1}, or a list of such moves applied one after another.
+            Responds with the new tracklist """
+        return self.rearrange(self.get_serializer(data=request.data, many=isinstance(request.data, list)))
+
+    def rearrange(self, serializer):
+        """ Tracklist is checked and renumbered in one transaction under album lock """
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        tracks = AlbumTrackSerializer(self.get_queryset(), many=True, context=self.get_serializer_context())
+        return Response(tracks.data, status=status.HTTP_200_OK)
+
+    def get_bulk_delete_base_queryset(self):
+        return AlbumTrack.objects.filter(album=self.get_parent())
+
+    def perform_bulk_delete(self, queryset):
+        return delete_album_tracks(queryset)
+
+    def perform_destroy(self, instance):
+        try:
+            instance.delete()
+        except AlbumTrack.DoesNotExist:
+            # deleted by a concurrent request after it was read
+            raise Http404
@@ -41,7 +41,6 @@ INSTALLED_APPS = [
     'django_filters',
     'rest_framework',
     'api',
-    "debug_toolbar"
 ]
 
 MIDDLEWARE = [
@@ -52,9 +51,21 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
 
+# Request metrics on /metrics and slow query log. Histograms are kept per process
+API_METRICS_ENABLED = int(os.environ.get("API_METRICS_ENABLED", default=1))
+# share of requests recorded into histograms, requests and slow queries are counted always
+API_METRICS_SAMPLE_RATE = float(os.environ.get("API_METRICS_SAMPLE_RATE", default=0.1))
+API_SLOW_QUERY_MS = float(os.environ.get("API_SLOW_QUERY_MS", default=200))
+
+if API_METRICS_ENABLED:
+    MIDDLEWARE.insert(0, 'api.middleware.InstrumentationMiddleware')
+
+if DEBUG:
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.append('debug_toolbar.middleware.DebugToolbarMiddleware')
+
 ROOT_URLCONF = 'music_api.urls'
 
 TEMPLATES = [
@@ -88,9 +99,39 @@ DATABASES = {
         "PASSWORD": os.environ.get("SQL_PASSWORD", "password"),
         "HOST": os.environ.get("SQL_HOST", "localhost"),
         "PORT": os.environ.get("SQL_PORT", "5432"),
+        # Persistent connections: every worker thread keeps one connection per alias for that many seconds
+        # (0 closes it after every request), so connections of a worker are its threads times aliases.
+        # Health check makes sure a kept connection still works before a request uses it
+        "CONN_MAX_AGE": int(os.environ.get("SQL_CONN_MAX_AGE", default=60)),
+        "CONN_HEALTH_CHECKS": bool(int(os.environ.get("SQL_CONN_HEALTH_CHECKS", default=1))),
     }
 }
 
+# Read replicas: space separated hosts, or database files with SQLite, become aliases replica_0, replica_1...
+# with the rest of settings from default. Safe requests read from them, see api/routers.py and api/middleware.py
+for number, replica in enumerate(os.environ.get("SQL_REPLICAS", "").split()):
+    key = "NAME" if DATABASES["default"]["ENGINE"].endswith("sqlite3") else "HOST"
+    DATABASES[f"replica_{number}"] = dict(DATABASES["default"], **{key: replica}, TEST={"MIRROR": "default"})
+
+API_READ_REPLICAS = [alias for alias in DATABASES if alias != "default"]
+# seconds a client reads from the primary after its write, longer than replication lag is expected to get
+API_REPLICA_STICKY_SECONDS = int(os.environ.get("API_REPLICA_STICKY_SECONDS", default=5))
+
+if API_READ_REPLICAS:
+    DATABASE_ROUTERS = ['api.routers.ReplicaRouter']
+    MIDDLEWARE.insert(0, 'api.middleware.ReplicaMiddleware')
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "api": {"handlers": ["console"], "level": os.environ.get("API_LOG_LEVEL", "INFO")},
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -134,6 +175,49 @@ STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Response cache of read endpoints. Works with local memory (per process) or file backend (shared by workers):
+# API_CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache API_CACHE_LOCATION=/var/tmp/music_api
+API_CACHE_ENABLED = int(os.environ.get("API_CACHE_ENABLED", default=1))
+API_CACHE_ALIAS = "api"
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    API_CACHE_ALIAS: {
+        "BACKEND": os.environ.get("API_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.environ.get("API_CACHE_LOCATION", "api"),
+        "TIMEOUT": int(os.environ.get("API_CACHE_TIMEOUT", 300)),
+        "OPTIONS": {"MAX_ENTRIES": int(os.environ.get("API_CACHE_MAX_ENTRIES", 10000))},
+    },
+}
+
+# Threads of async read views for prefetching and serialization, every one may hold a database connection
+API_ASYNC_THREADS = int(os.environ.get("API_ASYNC_THREADS", default=8))
+
+# Max number of ids in one batch retrieve request, /artists/batch/?ids=1,2,3
+API_BATCH_MAX_IDS = int(os.environ.get("API_BATCH_MAX_IDS", default=500))
+
+# Max number of ids in one bulk delete request, POST /tracks/bulk-delete/ {"ids": [1, 2, 3]}
+API_BULK_DELETE_MAX_IDS = int(os.environ.get("API_BULK_DELETE_MAX_IDS", default=10000))
+
+# /changes/ holds back changes of the last seconds, so rows of running transactions are not skipped.
+# Deletes are kept for retention days, older cursors must sync the whole catalog, see 'prune_tombstones' command
+API_CHANGES_LAG_SECONDS = float(os.environ.get("API_CHANGES_LAG_SECONDS", default=5))
+API_CHANGES_RETENTION_DAYS = int(os.environ.get("API_CHANGES_RETENTION_DAYS", default=30))
+
+# Build list responses of artists, albums and tracks from .values() rows instead of model serializers
+API_FAST_LIST_SERIALIZERS = int(os.environ.get("API_FAST_LIST_SERIALIZERS", default=0))
+
+# Album track ordering strategy: 'dense' keeps order column 1..N, 'gapped' keeps sparse ranks
+# with ALBUM_TRACK_ORDER_GAP between neighbours, so inserts and deletes do not rewrite other tracks
+ALBUM_TRACK_ORDERING = os.environ.get("ALBUM_TRACK_ORDERING", "dense")
+ALBUM_TRACK_ORDER_GAP = int(os.environ.get("ALBUM_TRACK_ORDER_GAP", 1024))
+
+# Album retrieve serves tracklist from a snapshot kept per album, rebuilt whenever it changes.
+# Turned off, snapshots are dropped on changes instead; 'rebuild_tracklists' command fills them again
+API_TRACKLIST_SNAPSHOTS = int(os.environ.get("API_TRACKLIST_SNAPSHOTS", default=1))
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly'
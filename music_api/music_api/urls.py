@@ -1,7 +1,10 @@
+from django.conf import settings
 from django.urls import include, path
 
 
 urlpatterns = [
     path('', include('api.urls')),
-    path('__debug__/', include('debug_toolbar.urls')),
 ]
+
+if settings.DEBUG:
+    urlpatterns.append(path('__debug__/', include('debug_toolbar.urls')))